@@ -0,0 +1,29 @@
+# import time of kgfe.gene_names, and time of the first lookup with and without a cached index
+# usage: python gene_names_import_benchmark.py [gene_info.gz file, default: the Homo_sapiens.gene_info.gz file in kgfe]
+import os
+import subprocess
+import sys
+import tempfile
+
+code = """
+import sys
+import time
+import kgfe
+t = time.time()
+from kgfe import gene_names
+import_time = time.time() - t
+if len(sys.argv) > 1:
+    gene_names.SPECIES['human']['gene_info'] = sys.argv[1]
+t = time.time()
+gene_names.get_ids(['TP53', 'BRCA1'])
+print(import_time, time.time() - t)
+"""
+
+n_runs = 5
+cache_dir = tempfile.mkdtemp()
+env = dict(os.environ, KGFE_CACHE_DIR=cache_dir)
+for run in range(n_runs):
+    output = subprocess.run([sys.executable, '-c', code] + sys.argv[1:], env=env, capture_output=True, text=True, check=True).stdout
+    import_time, lookup_time = [float(x) for x in output.split()]
+    print('run {0}: import time: {1:.1f}ms, first lookup: {2:.1f}ms{3}'.format(run, import_time*1000, lookup_time*1000,
+        ' (building the index)' if run == 0 else ''))
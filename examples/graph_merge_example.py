@@ -1,20 +1,21 @@
 # basic usage example for kgfe
 import time
 
-import pandas as pd
-
 import kgfe
+from kgfe import graph_merge
 
 # timing ran on intel i7-9700 CPU @ 3.00GHz with 64gb memory
 
-df = kgfe.load_graph('reactome_genes_chems.csv.gz')
-df2 = kgfe.load_graph('uniprot_genes.csv')
-combined_df = pd.concat([df, df2], axis=0)
 t = time.time()
-graph = kgfe.df_to_graph(combined_df)
-graph.simplify()
-print('igraph graph from df time:', time.time() - t)
-# timing: 12s
+# the tables are streamed in chunks into one compiled graph, with duplicate (subject, predicate, object) edges merged.
+# the graph has the same node and edge attributes as kgfe.df_to_graph on the concatenated tables, and every edge also has a
+# 'sources' attribute listing the tables it came from.
+graph = graph_merge.merge_graphs_igraph(['reactome_genes_chems.csv.gz', 'uniprot_genes.csv'])
+print('merged igraph graph time:', time.time() - t)
+# the merged graph is cached, so later runs only load it
+t = time.time()
+graph = graph_merge.merge_graphs_igraph(['reactome_genes_chems.csv.gz', 'uniprot_genes.csv'])
+print('cached merged igraph graph time:', time.time() - t)
 topic_ids = ['NCBIGene::5972',
         'NCBIGene::958',
         'NCBIGene::100', 'NCBIGene::8797', 'NCBIGene::26762']
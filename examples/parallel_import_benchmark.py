@@ -0,0 +1,29 @@
+# throughput of the serial and parallel jsonl importers on a synthetic kg2 dump
+import os
+import tempfile
+import time
+
+from kgfe import kg2_loader, synthetic_kg
+
+n_edges = 2000000
+
+tmp_dir = tempfile.mkdtemp()
+filename = os.path.join(tmp_dir, 'kg2.jsonl')
+synthetic_kg.generate_kg2(filename, None, n_edges=n_edges)
+size_mb = os.path.getsize(filename)/1e6
+print('file size: {0:.0f} MB'.format(size_mb))
+
+t = time.time()
+serial_results = kg2_loader.import_kg2_jsonl(filename, None, verbose=False)
+serial_time = time.time() - t
+print('serial import time: {0:.1f}s ({1:.1f} MB/s)'.format(serial_time, size_mb/serial_time))
+
+for n_processes in [2, 4, 8, None]:
+    t = time.time()
+    parallel_results = kg2_loader.import_kg2_jsonl(filename, None, verbose=False, n_processes=n_processes)
+    parallel_time = time.time() - t
+    print('parallel import time ({0} processes): {1:.1f}s ({2:.1f} MB/s)'.format(n_processes or os.cpu_count(), parallel_time, size_mb/parallel_time))
+    assert parallel_results == serial_results
+
+os.remove(filename)
+os.rmdir(tmp_dir)
@@ -1,4 +1,4 @@
-from .graph_info import get_available_graphs, load_graph, df_to_graph, get_nodes_table
+from .graph_info import get_available_graphs, load_graph, convert_to_parquet, df_to_graph, get_nodes_table
 from . import spoke_loader
 from . import explanations
 from . import feature_engineering
@@ -0,0 +1,248 @@
+# Benchmarks of the loaders on synthetic graphs (see synthetic_kg), to compare their speed and memory use across changes.
+#
+# run_benchmarks generates a synthetic graph at every scale (number of edges) and measures the wall time, peak RSS and rows/s of
+# every loader in LOADERS on it. Each measurement runs in a new process by default, so that the peak RSS of one loader isn't
+# hidden by the peak of a previous one. The results are json-serializable (and can be written to a file), and compare reports the
+# loaders that got slower or use more memory than in a previous run.
+#
+# usage: python -m kgfe.benchmark --scales 10000 100000 --output results.json [--baseline old_results.json]
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from . import synthetic_kg
+from .progress import Progress, peak_rss
+
+# version of the results format
+BENCHMARK_VERSION = 1
+
+
+def _import_kg2_csv(inputs, progress):
+    from .kg2_loader import import_kg2_csv
+    return import_kg2_csv(inputs[0], inputs[1], verbose=False, progress=progress)
+
+
+def _import_kg2_jsonl(inputs, progress):
+    from .kg2_loader import import_kg2_jsonl
+    return import_kg2_jsonl(inputs[0], inputs[1], verbose=False, progress=progress)
+
+
+def _import_ckg_jsonl(inputs, progress):
+    from .spoke_loader import import_ckg_jsonl
+    return import_ckg_jsonl(inputs[0], verbose=False, progress=progress)
+
+
+def _df_to_graph(inputs, progress):
+    from .graph_info import df_to_graph
+    return df_to_graph(inputs)
+
+
+def _read_dataframe(files):
+    import pandas as pd
+    return pd.read_pickle(files[0])
+
+
+# loader name: (dataset, function(inputs, progress), function(files) that returns the inputs, called before timing)
+LOADERS = {
+        'import_kg2_csv': ('kg2_csv', _import_kg2_csv, None),
+        'import_kg2_jsonl': ('kg2_jsonl', _import_kg2_jsonl, None),
+        'import_ckg_jsonl': ('spoke_jsonl', _import_ckg_jsonl, None),
+        'df_to_graph': ('dataframe', _df_to_graph, _read_dataframe),
+}
+
+
+def generate_dataset(dataset, directory, n_edges, seed=0):
+    """
+    Writes a synthetic graph of n_edges edges for the given dataset ('kg2_csv', 'kg2_jsonl', 'spoke_jsonl' or 'dataframe') to directory,
+    unless it already exists.
+
+    Returns:
+        dict with the number of nodes and edges and the names of the files
+    """
+    prefix = os.path.join(directory, '{0}_{1}_{2}'.format(dataset, n_edges, seed))
+    info_filename = prefix + '.json'
+    if os.path.exists(info_filename):
+        with open(info_filename) as f:
+            return json.load(f)
+    if dataset in ('kg2_csv', 'kg2_jsonl'):
+        extension = dataset[4:]
+        info = synthetic_kg.generate_kg2(prefix + '_nodes.' + extension, prefix + '_edges.' + extension, n_edges, seed=seed)
+    elif dataset == 'spoke_jsonl':
+        info = synthetic_kg.generate_spoke(prefix + '.jsonl', n_edges, seed=seed)
+    elif dataset == 'dataframe':
+        df = synthetic_kg.generate_dataframe(n_edges, seed=seed)
+        df.to_pickle(prefix + '.pkl')
+        info = {'n_nodes': int(len(set(df['subject_id']) | set(df['object_id']))), 'n_edges': n_edges, 'files': [prefix + '.pkl']}
+    else:
+        raise ValueError('unknown dataset: {0}'.format(dataset))
+    with open(info_filename, 'w') as f:
+        json.dump(info, f)
+    return info
+
+
+def measure(loader, info, repeat=1):
+    """
+    Runs a loader (a key of LOADERS) repeat times on a dataset returned by generate_dataset, and returns its metrics.
+    The peak RSS is the peak of the whole process, so it only measures the loader if this runs in a new process (see run_benchmarks).
+    """
+    _, function, read_inputs = LOADERS[loader]
+    files = info['files']
+    inputs = read_inputs(files) if read_inputs is not None else files
+    baseline_rss = peak_rss()
+    times = []
+    phases = {}
+    for _ in range(repeat):
+        progress = Progress(loader)
+        t = time.perf_counter()
+        function(inputs, progress)
+        times.append(time.perf_counter() - t)
+        summary = progress.finish()
+        for name, duration in summary['phases'].items():
+            phases[name] = phases.get(name, 0.0) + duration/repeat
+    rows = info['n_nodes'] + info['n_edges']
+    wall_time = min(times)
+    return {
+        'loader': loader,
+        'n_nodes': info['n_nodes'],
+        'n_edges': info['n_edges'],
+        'rows': rows,
+        'bytes': sum(os.path.getsize(f) for f in files),
+        'wall_time': wall_time,
+        'wall_times': times,
+        'rows_per_s': rows/wall_time if wall_time > 0 else None,
+        'peak_rss': peak_rss(),
+        'baseline_rss': baseline_rss,
+        'phases': phases,
+    }
+
+
+def _measure_isolated(loader, info, repeat):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(measure, (loader, info, repeat))
+
+
+def run_benchmarks(scales=(10000,), loaders=None, directory=None, repeat=1, seed=0, isolate=True, output=None, verbose=False):
+    """
+    Benchmarks the loaders on synthetic graphs.
+
+    Args:
+        scales: numbers of edges of the synthetic graphs
+        loaders: names of the loaders to run (keys of LOADERS, default: all of them)
+        directory: directory where the synthetic graphs are written. If it is given, the graphs are kept and reused by later runs,
+            otherwise they are written to a temporary directory that is removed at the end.
+        repeat: number of runs of every loader; wall_time is the fastest run
+        seed: random seed of the synthetic graphs
+        isolate: whether every loader runs in a new process, so that peak_rss is the peak of that loader
+        output: optional name of a json file where the results are written
+        verbose: whether to print the results as they are measured
+
+    Returns:
+        dict with the environment (python and platform), and a list of results with the loader, the graph size (n_nodes, n_edges,
+        rows, bytes), wall_time (seconds), rows_per_s, peak_rss and baseline_rss (bytes, before the loader ran) and the time of
+        every loading phase.
+    """
+    if loaders is None:
+        loaders = list(LOADERS)
+    remove_directory = directory is None
+    if directory is None:
+        directory = tempfile.mkdtemp()
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    try:
+        for n_edges in scales:
+            for loader in loaders:
+                info = generate_dataset(LOADERS[loader][0], directory, n_edges, seed)
+                if isolate:
+                    result = _measure_isolated(loader, info, repeat)
+                else:
+                    result = measure(loader, info, repeat)
+                results.append(result)
+                if verbose:
+                    print('{0} ({1} edges): {2:.2f}s, {3:.0f} rows/s, peak RSS {4:.0f} MB'.format(loader, n_edges, result['wall_time'],
+                        result['rows_per_s'] or 0, (result['peak_rss'] or 0)/1e6))
+    finally:
+        if remove_directory:
+            shutil.rmtree(directory)
+    report = {
+        'version': BENCHMARK_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'results': results,
+    }
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+    return report
+
+
+def _load_report(report):
+    if isinstance(report, str):
+        with open(report) as f:
+            return json.load(f)
+    return report
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Compares two benchmark reports (as returned by run_benchmarks, or the names of their json files).
+
+    Args:
+        baseline: the earlier report
+        current: the new report
+        tolerance: relative increase of wall_time or peak_rss that is reported as a regression
+
+    Returns:
+        list of dicts (loader, n_edges, metric, baseline, current, ratio) for every loader and scale in both reports whose wall_time
+        or peak_rss increased by more than tolerance
+    """
+    baseline = {(r['loader'], r['n_edges']): r for r in _load_report(baseline)['results']}
+    regressions = []
+    for result in _load_report(current)['results']:
+        key = (result['loader'], result['n_edges'])
+        if key not in baseline:
+            continue
+        for metric in ['wall_time', 'peak_rss']:
+            old = baseline[key].get(metric)
+            new = result.get(metric)
+            if not old or new is None:
+                continue
+            if new > old*(1 + tolerance):
+                regressions.append({'loader': key[0], 'n_edges': key[1], 'metric': metric, 'baseline': old, 'current': new,
+                    'ratio': new/old})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks the kgfe loaders on synthetic graphs.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10000], help='numbers of edges')
+    parser.add_argument('--loaders', nargs='+', choices=list(LOADERS), help='loaders to run (default: all)')
+    parser.add_argument('--directory', help='directory where the synthetic graphs are kept')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--baseline', help='json file of earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    report = run_benchmarks(args.scales, args.loaders, args.directory, args.repeat, args.seed, output=args.output, verbose=True)
+    if args.baseline is not None:
+        regressions = compare(args.baseline, report, args.tolerance)
+        for r in regressions:
+            print('regression: {0} ({1} edges) {2}: {3:.3g} -> {4:.3g} ({5:.2f}x)'.format(r['loader'], r['n_edges'], r['metric'],
+                r['baseline'], r['current'], r['ratio']))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,508 @@
+# Compiled on-disk graph format, so that large graphs don't have to be re-parsed from csv/jsonl dumps.
+#
+# A compiled graph is a directory containing a meta.json file and a set of .npy arrays:
+#   indptr, indices, edge_type - CSR adjacency (rows are edge sources), with edge type codes aligned to indices
+#   in_indptr, in_indices - CSR adjacency of the reversed edges (rows are edge targets)
+#   category - node category codes
+#   name_order - permutation of node indices that sorts the utf-8 encoded node names, for binary search
+#   name.offsets.npy, name.blob.npy - string table (utf-8 blob + offsets) of the node names
+#   feature_name, identifier, source - node property columns (see write_column), or the columns in meta['node_columns']
+#   edge_properties/<column> - edge property columns in CSR edge order, if the graph was loaded with use_edge_properties (or merged with graph_merge)
+# Category and edge type codes are keys into meta['node_types'] and meta['edge_types'].
+# meta['typed_edges'] and meta['edge_endpoints'] record which edge attributes load_kg2_igraph_from_data sets for the same input, so that
+# load_compiled_igraph returns the same attributes: the edge 'type' (from the edge type codes), and the 'source'/'target' node ids.
+# meta['edge_type_codes'] is False if the edge type codes are all 0 (kg2 edge property dicts don't have the edge types).
+#
+# A property column is stored in one of three ways, which keep the python types of its values:
+#   <column>.values.npy - int64 or float64 values
+#   <column>.codes.npy plus a <column>.dict string table - dictionary-encoded strings, for columns with few distinct values
+#   <column>.offsets.npy, <column>.blob.npy - a string table
+# Columns with values of several types or None (e.g. spoke identifiers, which are ints or strings) are stored as the json encoding
+# of every value, in a column named <column>.json (with the same two string encodings).
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+FORMAT_VERSION = 5
+
+NODE_STRING_COLUMNS = ('name', 'feature_name', 'identifier', 'source')
+
+
+def default_cache_dir():
+    """
+    Returns the directory where compiled graphs are cached. This is $KGFE_CACHE_DIR if it is set, otherwise ~/.cache/kgfe.
+    """
+    cache_dir = os.environ.get('KGFE_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'kgfe')
+    return cache_dir
+
+
+def _jsonable(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(str(x) for x in value)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(x) for x in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def source_key(filenames, **options):
+    """
+    Returns a json-serializable key identifying the source files (absolute path, size and mtime) and the loader options used to build a graph.
+
+    Args:
+        filenames: list of input filenames (None entries are skipped)
+        options: loader options that change the contents of the graph (edges_to_include, remove_unused_nodes, ...)
+    """
+    files = []
+    for filename in filenames:
+        if filename is None:
+            continue
+        stat = os.stat(filename)
+        files.append([os.path.abspath(filename), stat.st_size, stat.st_mtime_ns])
+    return {'files': files,
+            'options': {k: _jsonable(v) for k, v in sorted(options.items())}}
+
+
+def cache_path(key, cache_dir=None):
+    """
+    Returns the directory of the compiled graph for the given source_key.
+    """
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest)
+
+
+def write_string_table(directory, column, strings):
+    """
+    Writes a list of strings as a utf-8 blob plus an array of offsets, such that string i is blob[offsets[i]:offsets[i+1]].
+    """
+    encoded = [str(s).encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter((len(s) for s in encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    np.save(os.path.join(directory, column + '.offsets.npy'), offsets)
+    np.save(os.path.join(directory, column + '.blob.npy'), blob)
+
+
+def read_string_table(directory, column, mmap_mode=None):
+    """
+    Returns (offsets, blob) for a string table written by write_string_table.
+    """
+    offsets = np.load(os.path.join(directory, column + '.offsets.npy'), mmap_mode=mmap_mode)
+    blob = np.load(os.path.join(directory, column + '.blob.npy'), mmap_mode=mmap_mode)
+    return offsets, blob
+
+
+def decode_strings(offsets, blob, indices=None):
+    """
+    Decodes a string table into a list of python strings. If indices is given, only those strings are decoded.
+    """
+    if indices is None:
+        starts = offsets[:-1].tolist()
+        ends = offsets[1:].tolist()
+        data = bytes(blob)
+        return [data[s:e].decode('utf-8') for s, e in zip(starts, ends)]
+    indices = np.asarray(indices, dtype=np.int64)
+    starts = offsets[indices].tolist()
+    ends = offsets[indices + 1].tolist()
+    return [bytes(blob[s:e]).decode('utf-8') for s, e in zip(starts, ends)]
+
+
+def _is_int(v):
+    return isinstance(v, (int, np.integer)) and not isinstance(v, (bool, np.bool_))
+
+
+def _is_float(v):
+    return isinstance(v, (float, np.floating))
+
+
+def _json_default(value):
+    # numpy scalars and other values that json can't encode
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def _write_strings(directory, column, values):
+    "Writes a list of strings as dictionary codes (if there are at most half as many distinct values as rows) or as a string table."
+    dictionary = {}
+    codes = np.fromiter((dictionary.setdefault(v, len(dictionary)) for v in values), dtype=np.int64, count=len(values))
+    if values and len(dictionary)*2 <= len(values):
+        np.save(os.path.join(directory, column + '.codes.npy'), codes.astype(np.int32))
+        write_string_table(directory, column + '.dict', list(dictionary))
+    else:
+        write_string_table(directory, column, values)
+
+
+def write_column(directory, column, values):
+    """
+    Writes a property column, keeping the types of its values: columns of ints or of floats are written as arrays, string columns
+    with at most half as many distinct values as rows are dictionary-encoded, other string columns are written as string tables,
+    and columns with None or with values of several types are json-encoded (see the module comment).
+    """
+    values = list(values)
+    if values and all(_is_int(v) for v in values):
+        try:
+            np.save(os.path.join(directory, column + '.values.npy'), np.array(values, dtype=np.int64))
+            return
+        except OverflowError:
+            pass
+    elif values and all(_is_float(v) for v in values):
+        np.save(os.path.join(directory, column + '.values.npy'), np.array(values, dtype=np.float64))
+        return
+    if all(isinstance(v, str) for v in values):
+        _write_strings(directory, column, values)
+    else:
+        _write_strings(directory, column + '.json', [json.dumps(v, default=_json_default) for v in values])
+
+
+def column_encoding(directory, column):
+    """
+    Returns 'values', 'codes' or 'strings' depending on how a property column was written by write_column.
+    For json-encoded columns, this is the encoding of the <column>.json column of json strings.
+    """
+    if os.path.exists(os.path.join(directory, column + '.values.npy')):
+        return 'values'
+    if is_json_column(directory, column):
+        return column_encoding(directory, column + '.json')
+    if os.path.exists(os.path.join(directory, column + '.codes.npy')):
+        return 'codes'
+    return 'strings'
+
+
+def is_json_column(directory, column):
+    "Returns True if a property column was json-encoded by write_column."
+    return (os.path.exists(os.path.join(directory, column + '.json.codes.npy'))
+            or os.path.exists(os.path.join(directory, column + '.json.offsets.npy')))
+
+
+def read_column(directory, column, indices=None):
+    """
+    Returns a list of the values of a property column written by write_column, for the given row indices (or all rows).
+    Only the requested rows are read from disk (the column files are memory-mapped).
+    """
+    if is_json_column(directory, column):
+        column = column + '.json'
+        decode = json.loads
+    else:
+        decode = None
+    encoding = column_encoding(directory, column)
+    if encoding == 'values':
+        values = np.load(os.path.join(directory, column + '.values.npy'), mmap_mode='r')
+        if indices is None:
+            return np.asarray(values).tolist()
+        return values[np.asarray(indices, dtype=np.int64)].tolist()
+    if encoding == 'codes':
+        codes = np.load(os.path.join(directory, column + '.codes.npy'), mmap_mode='r')
+        # every row with the same code shares one python value
+        dictionary = decode_strings(*read_string_table(directory, column + '.dict'))
+        if decode is not None:
+            dictionary = [decode(v) for v in dictionary]
+        lookup = np.empty(len(dictionary), dtype=object)
+        lookup[:] = dictionary
+        if indices is None:
+            return lookup[np.asarray(codes)].tolist()
+        return lookup[codes[np.asarray(indices, dtype=np.int64)]].tolist()
+    values = decode_strings(*read_string_table(directory, column, mmap_mode='r'), indices)
+    if decode is not None:
+        values = [decode(v) for v in values]
+    return values
+
+
+def edges_to_arrays(nodes, edges, reindexed=False):
+    """
+    Converts an edge dict as returned by import_kg2_csv/import_kg2_jsonl into (src, dst, edge_type) arrays of node indices.
+
+    Args:
+        nodes: list of node tuples, where n[0] is the node id
+        edges: dict of (node1, node2): _type_id, or an edge_table.EdgeTable
+        reindexed: True if node1/node2 are already indices into nodes, False if they are node ids.
+    """
+    from .edge_table import EdgeTable
+    if isinstance(edges, EdgeTable):
+        return edges.src.astype(np.int64), edges.dst.astype(np.int64), edges.predicate.astype(np.int32)
+    n_edges = len(edges)
+    if reindexed:
+        src = np.fromiter((k[0] for k in edges.keys()), dtype=np.int64, count=n_edges)
+        dst = np.fromiter((k[1] for k in edges.keys()), dtype=np.int64, count=n_edges)
+    else:
+        node_index = {n[0]: i for i, n in enumerate(nodes)}
+        src = np.fromiter((node_index[k[0]] for k in edges.keys()), dtype=np.int64, count=n_edges)
+        dst = np.fromiter((node_index[k[1]] for k in edges.keys()), dtype=np.int64, count=n_edges)
+    # edges with properties (use_edge_properties=True) have type code 0
+    edge_type = np.fromiter((0 if isinstance(v, dict) else int(v) for v in edges.values()), dtype=np.int32, count=n_edges)
+    return src, dst, edge_type
+
+
+def edge_properties_list(edges):
+    """
+    Returns the list of edge property dicts (in edge order) of an edge dict or EdgeTable, or None if the edges don't have properties.
+    """
+    from .edge_table import EdgeTable
+    if isinstance(edges, EdgeTable):
+        if edges.property_row is None:
+            return None
+        return [edges.edge_properties(i) for i in range(len(edges))]
+    for v in edges.values():
+        if not isinstance(v, dict):
+            return None
+        break
+    else:
+        return None
+    return list(edges.values())
+
+
+def write_edge_properties(directory, properties):
+    """
+    Writes a list of edge property dicts as property columns in directory/edge_properties. Lists and dicts are converted to strings (as they are for igraph edge attributes). Returns the list of column names.
+    """
+    columns = []
+    for p in properties:
+        for key in p:
+            if key not in columns:
+                columns.append(key)
+    edge_directory = os.path.join(directory, 'edge_properties')
+    os.makedirs(edge_directory, exist_ok=True)
+    for column in columns:
+        values = []
+        for p in properties:
+            value = p.get(column)
+            if isinstance(value, (list, dict)):
+                value = str(value)
+            values.append(value)
+        write_column(edge_directory, column, values)
+    return columns
+
+
+def to_csr(n_nodes, src, dst, edge_type, return_order=False):
+    """
+    Sorts edges by source, returning (indptr, indices, edge_type), and the sorting permutation if return_order is True. The relative order of edges with the same source is preserved.
+    """
+    order = np.argsort(src, kind='stable')
+    indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+    if return_order:
+        return indptr, dst[order], edge_type[order], order
+    return indptr, dst[order], edge_type[order]
+
+
+def name_order(names):
+    """
+    Returns the permutation that sorts names by their utf-8 encoding.
+    """
+    if len(names) == 0:
+        return np.zeros(0, dtype=np.int64)
+    encoded = np.array([s.encode('utf-8') for s in names], dtype=bytes)
+    return np.argsort(encoded, kind='stable').astype(np.int64)
+
+
+def compile_graph(nodes, edges, node_types, edge_types, directory, key=None, reindexed=False, edge_columns=None, node_columns=None):
+    """
+    Writes the output of import_kg2_csv/import_kg2_jsonl (or the spoke_loader equivalents) as a compiled graph.
+
+    Args:
+        nodes: list of (_id, _name, _labels_id, identifier, source)
+        edges: dict of (node1, node2): _type_id, or an edge_table.EdgeTable
+        node_types: dict of int: str
+        edge_types: dict of int: str
+        directory: output directory. It is replaced if it already exists.
+        key: source_key for the inputs, used to check whether the compiled graph is stale.
+        reindexed: whether the edge dict uses node indices instead of node ids.
+        edge_columns: optional dict of column name: list of values (in edge order), written as edge property columns. Unlike edge property dicts, these don't change the edge type codes, but like them they replace the edge 'type' attribute.
+        node_columns: optional dict of column name: list of values (in node order), written as node property columns instead of the identifier and source of the node tuples.
+    """
+    from .edge_table import EdgeTable
+    n_nodes = len(nodes)
+    src, dst, edge_type = edges_to_arrays(nodes, edges, reindexed)
+    properties = edge_properties_list(edges)
+    if properties is not None and not isinstance(edges, EdgeTable):
+        # edge dicts with properties don't have type codes (spoke edge properties contain the edge type); edge tables keep theirs
+        edge_type_index = {v: k for k, v in edge_types.items()}
+        edge_type = np.array([edge_type_index.get(p.get('type'), 0) for p in properties], dtype=np.int32)
+    in_indptr, in_indices, _ = to_csr(n_nodes, dst, src, edge_type)
+    indptr, indices, edge_type, order = to_csr(n_nodes, src, dst, edge_type, return_order=True)
+    del src, dst
+    category = np.fromiter((int(n[2]) for n in nodes), dtype=np.int32, count=n_nodes)
+    tmp_directory = directory + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+    np.save(os.path.join(tmp_directory, 'indptr.npy'), indptr)
+    np.save(os.path.join(tmp_directory, 'indices.npy'), indices)
+    np.save(os.path.join(tmp_directory, 'edge_type.npy'), edge_type)
+    np.save(os.path.join(tmp_directory, 'in_indptr.npy'), in_indptr)
+    np.save(os.path.join(tmp_directory, 'in_indices.npy'), in_indices)
+    np.save(os.path.join(tmp_directory, 'category.npy'), category)
+    np.save(os.path.join(tmp_directory, 'name_order.npy'), name_order([str(n[0]) for n in nodes]))
+    write_string_table(tmp_directory, 'name', (str(n[0]) for n in nodes))
+    columns = {'feature_name': [n[1] for n in nodes]}
+    if node_columns is None:
+        columns['identifier'] = [n[3] if len(n) > 3 else '' for n in nodes]
+        columns['source'] = [n[4] if len(n) > 4 else '' for n in nodes]
+    else:
+        columns.update(node_columns)
+    for column, values in columns.items():
+        write_column(tmp_directory, column, values)
+    edge_property_columns = []
+    if properties is not None:
+        edge_property_columns = write_edge_properties(tmp_directory, [properties[i] for i in order.tolist()])
+    if edge_columns:
+        os.makedirs(os.path.join(tmp_directory, 'edge_properties'), exist_ok=True)
+        order_list = order.tolist()
+        for column, values in edge_columns.items():
+            write_column(os.path.join(tmp_directory, 'edge_properties'), column, [values[i] for i in order_list])
+            edge_property_columns.append(column)
+    meta = {
+            'version': FORMAT_VERSION,
+            'n_nodes': n_nodes,
+            'n_edges': int(len(indices)),
+            'node_types': [[int(k), v] for k, v in node_types.items()],
+            'edge_types': [[int(k), v] for k, v in edge_types.items()],
+            'node_columns': list(columns),
+            'edge_property_columns': edge_property_columns,
+            # edge property dicts (without an EdgeTable) replace the edge types, and only edge dicts have source/target ids
+            'typed_edges': (properties is None or isinstance(edges, EdgeTable)) and not edge_columns,
+            'edge_type_codes': properties is None or isinstance(edges, EdgeTable) or any('type' in p for p in properties),
+            'edge_endpoints': not isinstance(edges, EdgeTable),
+            'key': key,
+    }
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(tmp_directory, directory)
+
+
+def read_meta(directory):
+    with open(os.path.join(directory, 'meta.json')) as f:
+        return json.load(f)
+
+
+def is_valid(directory, key=None):
+    """
+    Returns True if directory contains a compiled graph of the current format version that was built from the given source_key.
+    """
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return False
+    try:
+        meta = read_meta(directory)
+    except ValueError:
+        return False
+    if meta.get('version') != FORMAT_VERSION:
+        return False
+    if key is not None and json.dumps(meta.get('key'), sort_keys=True) != json.dumps(key, sort_keys=True):
+        return False
+    return True
+
+
+def write_matrix(filename, matrix, key=None):
+    """
+    Writes a scipy sparse matrix with scipy.sparse.save_npz, together with the source_key it was built from (in filename + '.key.json').
+
+    Both files are written to temporary files first. The old key file is removed before the matrix is replaced, and the new key file is only moved in place after the matrix, so an interrupted write never leaves a key that matches a different matrix.
+    """
+    from scipy import sparse
+    tmp_filename = filename + '.tmp'
+    key_filename = filename + '.key.json'
+    with open(tmp_filename, 'wb') as f:
+        sparse.save_npz(f, matrix)
+    with open(key_filename + '.tmp', 'w') as f:
+        json.dump({'version': FORMAT_VERSION, 'key': key}, f)
+    if os.path.exists(key_filename):
+        os.remove(key_filename)
+    os.replace(tmp_filename, filename)
+    os.replace(key_filename + '.tmp', key_filename)
+
+
+def read_matrix(filename, key=None):
+    """
+    Returns the sparse matrix written by write_matrix, or None if the file doesn't exist or was built from a different source_key.
+    """
+    from scipy import sparse
+    if not os.path.exists(filename) or not os.path.exists(filename + '.key.json'):
+        return None
+    try:
+        with open(filename + '.key.json') as f:
+            meta = json.load(f)
+    except ValueError:
+        return None
+    if meta.get('version') != FORMAT_VERSION:
+        return None
+    if json.dumps(meta.get('key'), sort_keys=True) != json.dumps(key, sort_keys=True):
+        return None
+    return sparse.load_npz(filename)
+
+
+def _code_lookup(types):
+    """
+    Returns an object array mapping codes to labels for a [[code, label], ...] list from meta.json.
+    """
+    max_code = max([k for k, _ in types], default=0)
+    lookup = np.empty(max_code + 1, dtype=object)
+    for k, v in types:
+        lookup[k] = v
+    return lookup
+
+
+def load_compiled_igraph(directory, directed=False, low_memory=False, lazy_properties=False):
+    """
+    Creates an igraph.Graph from a compiled graph, with the same attributes as kg2_loader.load_kg2_igraph_from_data. The vertices are in
+    the same order, and the edges are sorted by source vertex.
+
+    Args:
+        directory: compiled graph directory
+        directed: whether the graph is directed
+        low_memory: if True, the 'source' node attribute and the edge attributes are not set.
+        lazy_properties: if True, only the 'name' and 'category' node attributes and the edge 'type' attribute (if the edges have types) are set, and the graph attribute 'compiled_graph' is set to directory. The other node and edge properties are read from the compiled graph when they are needed (see property_store).
+    """
+    import igraph as ig
+    meta = read_meta(directory)
+    n_nodes = meta['n_nodes']
+    edge_property_columns = meta.get('edge_property_columns', [])
+    typed_edges = meta.get('typed_edges', not edge_property_columns)
+    indptr = np.load(os.path.join(directory, 'indptr.npy'))
+    indices = np.load(os.path.join(directory, 'indices.npy'))
+    src = np.repeat(np.arange(n_nodes, dtype=np.int64), np.diff(indptr))
+    graph = ig.Graph(n=n_nodes, edges=np.column_stack([src, indices]), directed=directed)
+    names = decode_strings(*read_string_table(directory, 'name'))
+    graph.vs['name'] = names
+    if not lazy_properties:
+        graph.vs['feature_name'] = read_column(directory, 'feature_name')
+    # the category labels are shared python strings, so every vertex only holds a reference
+    category = np.load(os.path.join(directory, 'category.npy'))
+    graph.vs['category'] = _code_lookup(meta['node_types'])[category].tolist()
+    if lazy_properties:
+        graph['compiled_graph'] = directory
+        if 'type' in edge_property_columns and not typed_edges:
+            graph.es['type'] = read_column(os.path.join(directory, 'edge_properties'), 'type')
+        elif typed_edges or meta.get('edge_type_codes', True):
+            # the edge types tell parallel edges apart in property_store.materialize, which removes them if the graph has no 'type'
+            edge_type = np.load(os.path.join(directory, 'edge_type.npy'))
+            graph.es['type'] = _code_lookup(meta['edge_types'])[edge_type].tolist()
+        return graph
+    for column in meta.get('node_columns', ['feature_name', 'identifier', 'source']):
+        if column != 'feature_name' and not (low_memory and column == 'source'):
+            graph.vs[column] = read_column(directory, column)
+    if not low_memory:
+        if typed_edges:
+            edge_type = np.load(os.path.join(directory, 'edge_type.npy'))
+            graph.es['type'] = _code_lookup(meta['edge_types'])[edge_type].tolist()
+        # like load_kg2_igraph_from_data with use_edge_properties=True, the edge properties are edge attributes
+        edge_directory = os.path.join(directory, 'edge_properties')
+        for column in edge_property_columns:
+            if not (typed_edges and column == 'type'):
+                graph.es[column] = read_column(edge_directory, column)
+        if meta.get('edge_endpoints'):
+            name_lookup = np.empty(n_nodes, dtype=object)
+            name_lookup[:] = names
+            graph.es['source'] = name_lookup[src].tolist()
+            graph.es['target'] = name_lookup[indices].tolist()
+    return graph
@@ -0,0 +1,569 @@
+# Reading compressed input files (gzip, zstd, BGZF) with decompression in background threads, and writing BGZF files.
+#
+# open_text/open_binary detect the format from the first bytes of the file (not the extension):
+#   gzip - decompressed by a background thread, which hands chunks to the parser through a bounded queue
+#   BGZF - block-gzip (as written by bgzip/htslib): a series of independent gzip members of at most 64KB, which are
+#          decompressed in parallel by a thread pool (zlib releases the GIL). BGZF files are valid gzip files.
+#   zstd - requires the zstandard package (pip install zstandard); decompressed by a background thread
+# Uncompressed files are read directly.
+#
+# BGZF files also support random access by uncompressed offset (BgzfReader), using a .gzi index (the htslib format)
+# if there is one, so parallel_import can split them into chunks without decompressing them to a temporary file first.
+# recompress converts existing .gz (or .zst) dumps to BGZF, and writes the .gzi index.
+
+import collections
+import io
+import os
+import queue
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# maximum number of uncompressed bytes in a BGZF block (the same as htslib)
+BGZF_BLOCK_SIZE = 0xff00
+# the empty block at the end of BGZF files
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# number of bytes read from the compressed file at a time
+READ_SIZE = 4*1024*1024
+# number of BGZF blocks decompressed or compressed by one task
+BLOCKS_PER_TASK = 64
+# maximum number of decompressed chunks waiting to be parsed
+QUEUE_SIZE = 8
+N_THREADS = min(4, os.cpu_count() or 1)
+
+COMPRESSION_EXTENSIONS = ('.gz', '.bgz', '.zst')
+
+
+def base_name(filename):
+    "Returns filename without a compression extension (.gz, .bgz or .zst), to check the file type."
+    for extension in COMPRESSION_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[:-len(extension)]
+    return filename
+
+
+def _peek(f, n):
+    if hasattr(f, 'peek'):
+        return f.peek(n)[:n]
+    position = f.tell()
+    data = f.read(n)
+    f.seek(position)
+    return data
+
+
+def _bgzf_header_size(header):
+    """
+    Returns the size of the BGZF block starting with header (its first 18 bytes), or None if it isn't a BGZF block header.
+    """
+    if len(header) < 18 or header[:2] != GZIP_MAGIC or header[3] & 4 == 0:
+        return None
+    xlen = struct.unpack('<H', header[10:12])[0]
+    # the BC subfield (BSIZE) is the first extra subfield in files written by htslib
+    if xlen >= 6 and header[12:14] == b'BC' and struct.unpack('<H', header[14:16])[0] == 2:
+        return struct.unpack('<H', header[16:18])[0] + 1
+    return None
+
+
+def detect_format(f):
+    """
+    Returns the compression format of a file ('bgzf', 'gzip', 'zstd' or 'raw').
+
+    Args:
+        f: filename, or binary file object that is at the start of the data (the data is peeked, not consumed)
+    """
+    if isinstance(f, (str, os.PathLike)):
+        with open(f, 'rb') as f:
+            return detect_format(f)
+    header = _peek(f, 18)
+    if header[:4] == ZSTD_MAGIC:
+        return 'zstd'
+    if header[:2] == GZIP_MAGIC:
+        if _bgzf_header_size(header) is not None:
+            return 'bgzf'
+        return 'gzip'
+    return 'raw'
+
+
+def _gzip_chunks(f):
+    "Yields the decompressed data of a (possibly multi-member) gzip stream."
+    decompressor = zlib.decompressobj(31)
+    # whether the current gzip member has started
+    started = False
+    while True:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+        while data:
+            chunk = decompressor.decompress(data)
+            if chunk:
+                yield chunk
+            if not decompressor.eof:
+                started = True
+                break
+            # the next gzip member starts after the end of this one
+            data = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+            started = False
+    chunk = decompressor.flush()
+    if chunk:
+        yield chunk
+    if started:
+        raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+
+
+def _zstd_chunks(f):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('reading zstd files requires the zstandard package (pip install zstandard)')
+    reader = zstandard.ZstdDecompressor().stream_reader(f, read_size=READ_SIZE, read_across_frames=True)
+    while True:
+        chunk = reader.read(READ_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _read_bgzf_blocks(f, n_blocks):
+    "Reads up to n_blocks BGZF blocks from f, and returns the list of their compressed data."
+    blocks = []
+    for _ in range(n_blocks):
+        header = f.read(18)
+        if not header:
+            break
+        size = _bgzf_header_size(header)
+        if size is None:
+            raise ValueError('Invalid BGZF block header')
+        blocks.append(header + f.read(size - 18))
+    return blocks
+
+
+def _inflate_block(block):
+    "Decompresses one BGZF block."
+    xlen = struct.unpack('<H', block[10:12])[0]
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+    crc, size = struct.unpack('<II', block[-8:])
+    if size != len(data) or crc != zlib.crc32(data):
+        raise ValueError('Corrupt BGZF block')
+    return data
+
+
+def _inflate_blocks(blocks):
+    return b''.join([_inflate_block(block) for block in blocks])
+
+
+def _bgzf_chunks(f, n_threads=N_THREADS):
+    "Yields the decompressed data of a BGZF stream, decompressing batches of blocks in parallel."
+    pending = collections.deque()
+    with ThreadPoolExecutor(n_threads) as pool:
+        while True:
+            blocks = _read_bgzf_blocks(f, BLOCKS_PER_TASK)
+            if blocks:
+                pending.append(pool.submit(_inflate_blocks, blocks))
+            # keep a few tasks per thread in flight
+            while pending and (not blocks or len(pending) >= 2*n_threads):
+                chunk = pending.popleft().result()
+                if chunk:
+                    yield chunk
+            if not blocks:
+                break
+
+
+class ThreadedReader(io.RawIOBase):
+    """
+    A read-only binary stream of chunks produced by a background thread.
+
+    The thread runs the chunks iterator and puts its results in a queue of at most queue_size chunks, so decompression
+    runs ahead of parsing without reading the whole file into memory. Errors in the thread are raised by read.
+
+    Args:
+        chunks: iterator of bytes objects
+        fileobj: optional file object that is closed with this stream
+        queue_size: maximum number of chunks waiting to be read
+    """
+
+    def __init__(self, chunks, fileobj=None, queue_size=QUEUE_SIZE):
+        self._queue = queue.Queue(queue_size)
+        self._fileobj = fileobj
+        self._buffer = memoryview(b'')
+        self._done = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, args=(chunks,), daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, chunks):
+        try:
+            for chunk in chunks:
+                if not self._put(chunk):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+        self._put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            if self._done:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._done = True
+                return 0
+            if isinstance(item, BaseException):
+                self._done = True
+                raise item
+            self._buffer = memoryview(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            if self._fileobj is not None:
+                self._fileobj.close()
+        super().close()
+
+
+def open_binary(f, threads=True, n_threads=N_THREADS, queue_size=QUEUE_SIZE):
+    """
+    Opens a file (compressed or not) for reading decompressed bytes.
+
+    Args:
+        f: filename or binary file object (which is closed with the returned stream)
+        threads: whether to decompress in background threads. If False, gzip and BGZF files are read with the gzip module.
+        n_threads: number of threads decompressing BGZF blocks
+        queue_size: maximum number of decompressed chunks buffered ahead of the reader
+
+    Returns:
+        a buffered binary file object
+    """
+    if isinstance(f, (str, os.PathLike)):
+        f = open(f, 'rb')
+    compression = detect_format(f)
+    if compression == 'raw':
+        return f
+    if not threads and compression != 'zstd':
+        return _gzip_file(f)
+    if compression == 'gzip':
+        chunks = _gzip_chunks(f)
+    elif compression == 'bgzf':
+        chunks = _bgzf_chunks(f, n_threads)
+    else:
+        chunks = _zstd_chunks(f)
+    return io.BufferedReader(ThreadedReader(chunks, f, queue_size), READ_SIZE)
+
+
+def _gzip_file(f):
+    "Returns a gzip.GzipFile reading from f, which also closes f."
+    import gzip
+
+    class GzipFile(gzip.GzipFile):
+        def close(self):
+            super().close()
+            f.close()
+
+    return GzipFile(fileobj=f)
+
+
+def open_text(f, encoding='utf-8', **kwargs):
+    "Opens a file (compressed or not) for reading text. See open_binary for the other arguments."
+    return io.TextIOWrapper(open_binary(f, **kwargs), encoding=encoding)
+
+
+# Random access to BGZF files
+
+def gzi_filename(filename):
+    return filename + '.gzi'
+
+
+def read_gzi(filename):
+    """
+    Reads a .gzi index (the htslib format: the number of entries, then pairs of compressed and uncompressed offsets of the blocks
+    after the first one, as little-endian uint64).
+
+    Returns:
+        (compressed offsets, uncompressed offsets) as int64 arrays, starting with the first block (0, 0)
+    """
+    with open(filename, 'rb') as f:
+        n = struct.unpack('<Q', f.read(8))[0]
+        offsets = np.frombuffer(f.read(16*n), dtype='<u8').reshape(n, 2).astype(np.int64)
+    return np.concatenate([[0], offsets[:, 0]]), np.concatenate([[0], offsets[:, 1]])
+
+
+def write_gzi(filename, compressed_offsets, uncompressed_offsets):
+    "Writes a .gzi index (see read_gzi). The offsets start with the first block (0, 0), which isn't written."
+    offsets = np.stack([compressed_offsets[1:], uncompressed_offsets[1:]], axis=1).astype('<u8')
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<Q', len(offsets)))
+        f.write(offsets.tobytes())
+
+
+def _scan_blocks(f, compressed_offset=0, uncompressed_offset=0):
+    "Reads the block headers (and sizes) of a BGZF file from the given block to the end, without decompressing them."
+    compressed = []
+    uncompressed = []
+    f.seek(compressed_offset)
+    while True:
+        header = f.read(18)
+        if not header:
+            break
+        size = _bgzf_header_size(header)
+        if size is None:
+            raise ValueError('Invalid BGZF block header at offset {0}'.format(compressed_offset))
+        f.seek(compressed_offset + size - 4)
+        compressed.append(compressed_offset)
+        uncompressed.append(uncompressed_offset)
+        uncompressed_offset += struct.unpack('<I', f.read(4))[0]
+        compressed_offset += size
+    # end of the file
+    compressed.append(compressed_offset)
+    uncompressed.append(uncompressed_offset)
+    return compressed, uncompressed
+
+
+# dict of (filename, mtime, size): index
+_bgzf_indices = {}
+
+
+def bgzf_index(filename):
+    """
+    Returns the block offsets of a BGZF file, from its .gzi index if it is up to date, otherwise by reading the block headers.
+
+    Returns:
+        (compressed offsets, uncompressed offsets) as int64 arrays, with an entry for every block and a last entry for the end of the file
+    """
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime, stat.st_size)
+    if key in _bgzf_indices:
+        return _bgzf_indices[key]
+    index_filename = gzi_filename(filename)
+    with open(filename, 'rb') as f:
+        if os.path.exists(index_filename) and os.path.getmtime(index_filename) >= stat.st_mtime:
+            compressed, uncompressed = read_gzi(index_filename)
+            # the index doesn't have the size of the last blocks
+            end = _scan_blocks(f, int(compressed[-1]), int(uncompressed[-1]))
+            compressed = np.concatenate([compressed[:-1], end[0]])
+            uncompressed = np.concatenate([uncompressed[:-1], end[1]])
+        else:
+            compressed, uncompressed = _scan_blocks(f)
+    index = (np.asarray(compressed, dtype=np.int64), np.asarray(uncompressed, dtype=np.int64))
+    _bgzf_indices[key] = index
+    return index
+
+
+class BgzfReader(io.RawIOBase):
+    """
+    Seekable binary stream of the decompressed data of a BGZF file. Seeking to an uncompressed offset only decompresses the block containing it.
+
+    Args:
+        filename: BGZF file
+    """
+
+    def __init__(self, filename):
+        self.name = filename
+        self._file = open(filename, 'rb')
+        self.compressed_offsets, self.uncompressed_offsets = bgzf_index(filename)
+        self.size = int(self.uncompressed_offsets[-1])
+        self._position = 0
+        self._block = -1
+        self._data = b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self._position = offset
+        return offset
+
+    def _load_block(self, block):
+        if block != self._block:
+            start = int(self.compressed_offsets[block])
+            self._file.seek(start)
+            self._data = _inflate_block(self._file.read(int(self.compressed_offsets[block + 1]) - start))
+            self._block = block
+
+    def readinto(self, b):
+        if self._position >= self.size:
+            return 0
+        # last block starting at or before the position (skipping empty blocks)
+        block = int(np.searchsorted(self.uncompressed_offsets, self._position, side='right')) - 1
+        self._load_block(block)
+        start = self._position - int(self.uncompressed_offsets[block])
+        n = min(len(b), len(self._data) - start)
+        b[:n] = self._data[start:start + n]
+        self._position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def open_random_access(filename):
+    """
+    Opens an uncompressed or BGZF file as a seekable binary file object, whose offsets are offsets in the uncompressed data.
+    Raises a ValueError for other compressed files.
+    """
+    compression = detect_format(filename)
+    if compression == 'raw':
+        return open(filename, 'rb')
+    if compression == 'bgzf':
+        return io.BufferedReader(BgzfReader(filename), BGZF_BLOCK_SIZE)
+    raise ValueError('{0} is {1}-compressed; only uncompressed and BGZF files support random access'.format(filename, compression))
+
+
+def uncompressed_size(filename):
+    "Returns the size of the uncompressed data of an uncompressed or BGZF file."
+    if detect_format(filename) == 'bgzf':
+        return int(bgzf_index(filename)[1][-1])
+    return os.path.getsize(filename)
+
+
+# Writing BGZF files
+
+def _deflate_block(data, level):
+    "Compresses data (at most BGZF_BLOCK_SIZE bytes) into a BGZF block."
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(compressed) + 25)
+    return header + compressed + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def _deflate_blocks(data, level):
+    return [_deflate_block(data[i:i + BGZF_BLOCK_SIZE], level) for i in range(0, len(data), BGZF_BLOCK_SIZE)]
+
+
+class BgzfWriter:
+    """
+    Writes a BGZF file, compressing batches of blocks in parallel, and optionally its .gzi index.
+
+    Args:
+        filename: output filename
+        level: zlib compression level
+        n_threads: number of compression threads
+        index_filename: filename of the .gzi index, or None to not write one
+    """
+
+    def __init__(self, filename, level=6, n_threads=N_THREADS, index_filename=None):
+        self._file = open(filename, 'wb')
+        self.level = level
+        self.index_filename = index_filename
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._pool = ThreadPoolExecutor(n_threads)
+        self._max_pending = 2*n_threads
+        self.compressed_offsets = [0]
+        self.uncompressed_offsets = [0]
+
+    def write(self, data):
+        self._buffer += data
+        task_size = BGZF_BLOCK_SIZE*BLOCKS_PER_TASK
+        if len(self._buffer) >= task_size:
+            n = len(self._buffer) // task_size * task_size
+            self._submit(bytes(self._buffer[:n]))
+            del self._buffer[:n]
+        return len(data)
+
+    def _submit(self, data):
+        self._pending.append((self._pool.submit(_deflate_blocks, data, self.level), len(data)))
+        while len(self._pending) > self._max_pending:
+            self._write_pending()
+
+    def _write_pending(self):
+        future, size = self._pending.popleft()
+        uncompressed = size
+        for block in future.result():
+            self._file.write(block)
+            block_size = min(BGZF_BLOCK_SIZE, uncompressed)
+            uncompressed -= block_size
+            self.compressed_offsets.append(self.compressed_offsets[-1] + len(block))
+            self.uncompressed_offsets.append(self.uncompressed_offsets[-1] + block_size)
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_pending()
+        self._pool.shutdown()
+        self._file.write(BGZF_EOF)
+        self._file.close()
+        if self.index_filename is not None:
+            # the offsets end with the end of the last data block, which is the start of the EOF block
+            write_gzi(self.index_filename, self.compressed_offsets[:-1], self.uncompressed_offsets[:-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def recompress(filename, output_filename=None, level=6, n_threads=N_THREADS, index=True):
+    """
+    Converts a compressed (gzip, zstd) or uncompressed file to BGZF, so that it can be read in parallel and with random access.
+
+    Args:
+        filename: input file
+        output_filename: output file. By default, the input file is replaced.
+        level: zlib compression level
+        n_threads: number of compression threads
+        index: whether to write a .gzi index next to the output file
+
+    Returns:
+        output_filename
+    """
+    if output_filename is None:
+        output_filename = filename
+    tmp_filename = output_filename + '.tmp'
+    with open_binary(filename, n_threads=n_threads) as f_in, BgzfWriter(tmp_filename, level, n_threads) as f_out:
+        while True:
+            data = f_in.read(READ_SIZE)
+            if not data:
+                break
+            f_out.write(data)
+    os.replace(tmp_filename, output_filename)
+    if index:
+        write_gzi(gzi_filename(output_filename), f_out.compressed_offsets[:-1], f_out.uncompressed_offsets[:-1])
+    return output_filename
@@ -0,0 +1,171 @@
+# Columnar edge list, used by the loaders instead of a dict of (node1, node2): type when edge_format='table'.
+# Unlike the edge dict, this keeps parallel edges with different predicates, and takes ~10 bytes per edge instead of ~200.
+
+import numpy as np
+from scipy import sparse
+
+
+class EdgeTable:
+    """
+    A growable table of edges with columns src, dst (indices into the loader's node list), predicate (a key into edge_types) and property_row (an index into properties, or -1).
+
+    The columns are numpy arrays that double in size when full. src/dst start as int32 and are converted to int64 if a node index doesn't fit.
+    """
+
+    def __init__(self, capacity=1024, index_dtype=np.int32):
+        capacity = max(int(capacity), 1)
+        self.n_edges = 0
+        self._src = np.zeros(capacity, dtype=index_dtype)
+        self._dst = np.zeros(capacity, dtype=index_dtype)
+        self._predicate = np.zeros(capacity, dtype=np.int16)
+        self._property_row = None
+        self.properties = []
+
+    def __len__(self):
+        return self.n_edges
+
+    @property
+    def capacity(self):
+        return len(self._src)
+
+    @property
+    def src(self):
+        return self._src[:self.n_edges]
+
+    @property
+    def dst(self):
+        return self._dst[:self.n_edges]
+
+    @property
+    def predicate(self):
+        return self._predicate[:self.n_edges]
+
+    @property
+    def property_row(self):
+        "Index into self.properties for every edge (-1 if the edge has no properties), or None if no edge has properties."
+        if self._property_row is None:
+            return None
+        return self._property_row[:self.n_edges]
+
+    def _grow(self, min_capacity):
+        capacity = max(self.capacity*2, min_capacity)
+        for name in ('_src', '_dst', '_predicate', '_property_row'):
+            old = getattr(self, name)
+            if old is None:
+                continue
+            new = np.zeros(capacity, dtype=old.dtype)
+            if name == '_property_row':
+                new[:] = -1
+            new[:self.n_edges] = old[:self.n_edges]
+            setattr(self, name, new)
+
+    def _check_dtypes(self, max_index, max_predicate):
+        if max_index > np.iinfo(self._src.dtype).max:
+            self._src = self._src.astype(np.int64)
+            self._dst = self._dst.astype(np.int64)
+        if max_predicate > np.iinfo(self._predicate.dtype).max:
+            self._predicate = self._predicate.astype(np.int32)
+
+    def append(self, src, dst, predicate, properties=None):
+        "Adds an edge. properties is an optional dict."
+        if self.n_edges == self.capacity:
+            self._grow(self.n_edges + 1)
+        if src > 2147483647 or dst > 2147483647 or predicate > 32767:
+            self._check_dtypes(max(src, dst), predicate)
+        i = self.n_edges
+        self._src[i] = src
+        self._dst[i] = dst
+        self._predicate[i] = predicate
+        if properties is not None:
+            if self._property_row is None:
+                self._property_row = np.full(self.capacity, -1, dtype=np.int64)
+            self._property_row[i] = len(self.properties)
+            self.properties.append(properties)
+        self.n_edges += 1
+
+    def extend(self, src, dst, predicate, properties=None):
+        "Adds arrays of edges. properties is an optional list of dicts (one per edge)."
+        src = np.asarray(src)
+        dst = np.asarray(dst)
+        predicate = np.asarray(predicate)
+        n = len(src)
+        if n == 0:
+            return
+        if self.n_edges + n > self.capacity:
+            self._grow(self.n_edges + n)
+        self._check_dtypes(max(int(src.max()), int(dst.max())), int(predicate.max()))
+        self._src[self.n_edges:self.n_edges + n] = src
+        self._dst[self.n_edges:self.n_edges + n] = dst
+        self._predicate[self.n_edges:self.n_edges + n] = predicate
+        if properties is not None:
+            if self._property_row is None:
+                self._property_row = np.full(self.capacity, -1, dtype=np.int64)
+            self._property_row[self.n_edges:self.n_edges + n] = np.arange(len(self.properties), len(self.properties) + n)
+            self.properties.extend(properties)
+        self.n_edges += n
+
+    def compact(self):
+        "Shrinks the arrays to the number of edges. Returns self."
+        for name in ('_src', '_dst', '_predicate', '_property_row'):
+            old = getattr(self, name)
+            if old is not None and len(old) != self.n_edges:
+                setattr(self, name, old[:self.n_edges].copy())
+        return self
+
+    def keys(self):
+        "Iterates over (src, dst) pairs, like the keys of an edge dict."
+        return zip(self.src.tolist(), self.dst.tolist())
+
+    def items(self):
+        "Iterates over ((src, dst), predicate) pairs, like the items of an edge dict."
+        return zip(self.keys(), self.predicate.tolist())
+
+    def edge_properties(self, i):
+        "Returns the properties dict of edge i (empty if it has none)."
+        if self._property_row is None or self._property_row[i] < 0:
+            return {}
+        return self.properties[self._property_row[i]]
+
+    def remove_unused_nodes(self, n_nodes):
+        """
+        Renumbers src/dst so that nodes without edges are removed. Returns the array of old node indices that are kept, in order.
+        """
+        has_edge = np.zeros(n_nodes, dtype=bool)
+        has_edge[self.src] = True
+        has_edge[self.dst] = True
+        keep = np.flatnonzero(has_edge)
+        new_index = np.cumsum(has_edge) - 1
+        self._src[:self.n_edges] = new_index[self.src]
+        self._dst[:self.n_edges] = new_index[self.dst]
+        return keep
+
+    def to_coo(self, n_nodes):
+        "Returns a scipy.sparse.coo_array with the predicate codes as values (parallel edges are kept as separate entries)."
+        return sparse.coo_array((self.predicate, (self.src, self.dst)), shape=(n_nodes, n_nodes))
+
+    def to_counts(self, n_nodes):
+        "Returns a scipy.sparse.csr_array with the number of edges from every node to every other node as values."
+        return sparse.coo_array((np.ones(self.n_edges, dtype=np.int32), (self.src, self.dst)), shape=(n_nodes, n_nodes)).tocsr()
+
+    @classmethod
+    def from_dict(cls, nodes, edges, reindexed=False):
+        """
+        Converts an edge dict of (node1, node2): _type_id (as returned by the loaders with edge_format='dict') to an EdgeTable.
+
+        Args:
+            nodes: list of node tuples, where n[0] is the node id
+            edges: dict of (node1, node2): _type_id, or of (node1, node2): properties dict if use_edge_properties was set.
+            reindexed: True if node1/node2 are indices into nodes, False if they are node ids.
+        """
+        if not reindexed:
+            node_index = {n[0]: i for i, n in enumerate(nodes)}
+        table = cls(len(edges), index_dtype=np.int32 if len(nodes) <= 2147483647 else np.int64)
+        for (node1, node2), value in edges.items():
+            if not reindexed:
+                node1 = node_index[node1]
+                node2 = node_index[node2]
+            if isinstance(value, dict):
+                table.append(node1, node2, 0, value)
+            else:
+                table.append(node1, node2, int(value))
+        return table
@@ -7,40 +7,216 @@ import functools
 import numpy as np
 from scipy.stats import hypergeom
 
+from . import property_store
+from .graph_index import get_graph_index, resolve_nodes
+from .pagerank import approximate_pagerank, global_pagerank, start_scores, topic_indices, power_iteration as pagerank_power_iteration
+
+
+class RankedNodes:
+    """
+    Columnar result of topic_pagerank with top_k: the top nodes as arrays, with their attributes only read when they are needed.
+
+    Attributes:
+        graph: the igraph graph
+        indices: array of vertex indices, by decreasing score (ties in vertex order)
+        scores: array of the pagerank scores of indices
+        pagerank: array of the pagerank scores of all the vertices (None for the results of batch_topic_pagerank, and a 1 x N
+            scipy.sparse matrix for local_topic_pagerank)
+    """
+
+    def __init__(self, graph, indices, scores, pagerank):
+        self.graph = graph
+        self.indices = indices
+        self.scores = scores
+        self.pagerank = pagerank
+        self._table = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def names(self):
+        "List of the names (node ids) of the top nodes."
+        names = get_graph_index(self.graph).names
+        return [names[i] for i in self.indices.tolist()]
+
+    def to_dataframe(self):
+        "Returns a pandas DataFrame of the attributes of the top nodes, with a score column (read once, then cached)."
+        if self._table is None:
+            import pandas as pd
+            self._table = pd.DataFrame(property_store.node_attributes(self.graph, self.indices.tolist()))
+            self._table['score'] = self.scores
+        return self._table
+
+    def to_list(self):
+        "Returns the top nodes as a list of attribute dicts with a score, like the top_nodes returned by topic_pagerank without top_k."
+        nodes = property_store.node_attributes(self.graph, self.indices.tolist())
+        for node, score in zip(nodes, self.scores.tolist()):
+            node['score'] = score
+        return nodes
+
+
+def _top_indices(scores, k=None, exclude=None):
+    """
+    Returns the indices of the k highest scores, not counting the indices in exclude, by decreasing score.
+    Ties are in index order (as with sorting all the scores with a stable sort), and only O(n + k log k) time is used for k << n.
+    """
+    candidates = np.asarray(scores, dtype=np.float64)
+    if exclude is not None and len(exclude):
+        candidates = candidates.copy()
+        candidates[exclude] = -np.inf
+        n = len(candidates) - len(np.unique(exclude))
+    else:
+        n = len(candidates)
+    if k is None or k >= n:
+        k = n
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        threshold = np.partition(candidates, len(candidates) - k)[len(candidates) - k]
+        above = np.flatnonzero(candidates > threshold)
+        ties = np.flatnonzero(candidates == threshold)[:k - len(above)]
+        selected = np.concatenate([above, ties])
+    else:
+        selected = np.flatnonzero(candidates != -np.inf) if exclude is not None and len(exclude) else np.arange(n)
+    # decreasing score, then increasing index
+    return selected[np.lexsort((selected, -candidates[selected]))]
+
+
+def batch_topic_pagerank(graph, topic_sets, topic_weights=None, alpha=0.7, tol=1e-9, max_iter=100, batch_size=256, top_k=None):
+    """
+    Personalized pagerank for many topic sets on the same graph. This runs a power iteration on the cached transition matrix of the
+    graph (see graph_index.GraphIndex.transition_matrix) for batch_size topic sets at a time, instead of one igraph
+    personalized_pagerank call per set. The scores are the same as those of topic_pagerank (up to tol).
+
+    Params:
+        graph - an igraph graph
+        topic_sets - a list of topic sets, each a list of node ids or a dict of node id : weight
+        topic_weights - optional list of dicts of node id : weight, one for each topic set (see topic_pagerank)
+        alpha - damping factor
+        tol - convergence tolerance (L1 norm of the change of the scores of a topic set in one iteration)
+        max_iter - maximum number of iterations
+        batch_size - number of topic sets per batch; memory use is about 4 * 8 * batch_size bytes per node
+        top_k - if given, returns the top_k nodes of every topic set (excluding its topics) instead of the score matrix
+
+    Returns:
+        if top_k is None: N x B array of pagerank scores, where B is the number of topic sets
+        otherwise: list of RankedNodes (whose pagerank is None), one for each topic set
+    """
+    matrix, dangling = get_graph_index(graph).transition_matrix()
+    n = graph.vcount()
+    if topic_weights is None:
+        topic_weights = [None]*len(topic_sets)
+    elif len(topic_weights) != len(topic_sets):
+        raise ValueError('topic_weights must have one dict per topic set')
+    topics = [topic_indices(graph, ids, weights) for ids, weights in zip(topic_sets, topic_weights)]
+    scores = np.zeros((n, len(topics))) if top_k is None else None
+    results = []
+    for start in range(0, len(topics), batch_size):
+        batch = topics[start:start + batch_size]
+        restart = np.zeros((n, len(batch)))
+        for column, (indices, weights) in enumerate(batch):
+            np.add.at(restart[:, column], indices, weights)
+        batch_scores = pagerank_power_iteration(matrix, dangling, restart, alpha, tol, max_iter)
+        if top_k is None:
+            scores[:, start:start + len(batch)] = batch_scores
+            continue
+        for column, (indices, _) in enumerate(batch):
+            column_scores = batch_scores[:, column]
+            ranked = _top_indices(column_scores, top_k, indices)
+            results.append(RankedNodes(graph, ranked, column_scores[ranked], None))
+    return scores if top_k is None else results
+
 
 def topic_pagerank(graph, topic_ids=None, topic_category=None, topic_weights=None,
         topic_id_prefix=None,
-        alpha=0.7, max_iter=50, nstart=None):
+        alpha=0.7, max_iter=50, nstart=None, top_k=None):
     """
     Params:
         graph - an igraph graph
         topic_ids - a list of topics for personalization (random restart in pagerank) - use None for regular PR
         topic_category: 'Gene', 'Drug', 'SmallMolecule', 'Pathway'
-        topic_weights - a dict of topic_id : weight TODO: not implemented
+        topic_weights - a dict of topic_id : weight of the random restarts to that topic. Topics in topic_ids without a weight
+            have a weight of 1; if topic_ids is None, the topics are the keys of topic_weights.
+        max_iter - maximum number of iterations, if nstart is given
+        nstart - optional initial scores (an array of one score per vertex, or a dict of node id : score, where ids that aren't
+            in the graph are ignored), e.g. the scores of a previous version of the graph or of a similar topic set. If it is given,
+            the scores are computed by a power iteration (see pagerank.power_iteration) started from nstart instead of igraph,
+            which converges in fewer steps if nstart is close.
+        top_k - if given, only the top_k nodes (excluding the topic nodes) are ranked, and a RankedNodes is returned.
+            Use top_k=None to rank all the nodes.
 
     Returns:
-        dict of node id : pagerank score
+        if top_k is None: Counter of node id : pagerank score, and list of node attribute dicts with a 'score', for all
+        the nodes except the topic nodes, by decreasing score.
+        otherwise: RankedNodes with the indices and scores of the top_k nodes; their attributes are only read by its
+        to_dataframe or to_list methods.
     """
     # alpha is set to 0.7 based on https://academic.oup.com/bioinformatics/article/35/3/497/5055408
     # all random restarts go to the topic nodes.
-    if topic_ids is None:
-        topic_ids = set()
+    reset = None
+    if topic_weights is not None:
+        graph_ids, weights = topic_indices(graph, topic_ids, topic_weights)
+        reset = np.zeros(graph.vcount())
+        np.add.at(reset, graph_ids, weights)
+        graph_ids = graph_ids.tolist()
+    elif topic_ids is None:
+        graph_ids = []
+    else:
+        graph_ids = resolve_nodes(graph, topic_ids).tolist()
+    if nstart is not None:
+        # warm start: power iteration on the transition matrix, from nstart
+        start = start_scores(graph, nstart)
+        if not graph_ids:
+            pr_results = global_pagerank(graph, alpha, start, max_iter=max_iter)
+        else:
+            if reset is None:
+                reset = np.zeros(graph.vcount())
+                np.add.at(reset, graph_ids, 1.0)
+            matrix, dangling = get_graph_index(graph).transition_matrix()
+            pr_results = pagerank_power_iteration(matrix, dangling, reset.reshape(-1, 1), alpha, max_iter=max_iter,
+                    start=None if start is None else start.reshape(-1, 1))[:, 0]
+        pr_results = pr_results.tolist()
+    elif reset is not None:
+        pr_results = graph.personalized_pagerank(reset=reset.tolist(), damping=alpha)
+    elif not graph_ids:
         pr_results = graph.pagerank(damping=alpha)
     else:
-        graph_ids = [graph.vs.find(name=t).index for t in topic_ids]
         pr_results = graph.personalized_pagerank(reset_vertices=graph_ids, damping=alpha)
     # postprocessing
-    top_nodes = []
-    ids_set = set(topic_ids)
-    pr_results = Counter({v['name']: pr_results[v.index] for v in graph.vs})
-    for node_id, score in pr_results.most_common():
-        if node_id in ids_set:
-            continue
-        node = graph.vs.find(name=node_id).attributes().copy()
-        node['score'] = score
-        top_nodes.append(node)
+    scores = np.asarray(pr_results, dtype=np.float64)
+    ranked = _top_indices(scores, top_k, np.asarray(graph_ids, dtype=np.int64))
+    if top_k is not None:
+        return RankedNodes(graph, ranked, scores[ranked], scores)
+    pr_results = Counter(dict(zip(get_graph_index(graph).names, pr_results)))
+    # node properties are fetched in one batch (lazily loaded graphs read them from the property store)
+    top_nodes = RankedNodes(graph, ranked, scores[ranked], scores).to_list()
     return pr_results, top_nodes
 
+def local_topic_pagerank(graph, topic_ids=None, topic_weights=None, alpha=0.7, epsilon=1e-5, normalize=None, top_k=100):
+    """
+    Approximate personalized pagerank by local pushes from the topic nodes (see pagerank.approximate_pagerank). Only the
+    neighborhood of the topics is visited, so the cost depends on epsilon and not on the size of the graph, which makes this
+    suitable for interactive queries on large graphs.
+
+    Params:
+        graph - an igraph graph
+        topic_ids, topic_weights - the topics (see topic_pagerank)
+        alpha - damping factor
+        epsilon - residual threshold of the pushes (per unit of degree); smaller values are more accurate and visit more nodes
+        normalize - None, 'degree' or 'pagerank' (divides the scores by the global pagerank, computed once per graph)
+        top_k - number of top nodes (excluding the topic nodes) to return; None returns all the nodes that were reached
+
+    Returns:
+        RankedNodes of the top nodes, whose pagerank is the 1 x N scipy.sparse matrix of approximate scores
+    """
+    scores = approximate_pagerank(graph, topic_ids, topic_weights, alpha, epsilon, normalize)
+    seeds, _ = topic_indices(graph, topic_ids, topic_weights)
+    reached = scores.indices.astype(np.int64)
+    ranked = reached[_top_indices(scores.data, top_k, np.flatnonzero(np.isin(reached, seeds)))]
+    return RankedNodes(graph, ranked, np.asarray(scores[0, ranked].todense()).ravel(), scores)
+
+
 def steiner_tree(graph, ids, method='takahashi', **params):
     """
     A thin wrapper around a couple of approximate steiner tree algorithms.
@@ -54,7 +230,7 @@ def steiner_tree(graph, ids, method='takahashi', **params):
         tree that contains all nodes in ids as leaves.
     """
     from . import steiner_tree
-    indices = [graph.vs.find(name=i).index for i in ids]
+    indices = resolve_nodes(graph, ids).tolist()
     if method == 'takahashi':
         tree = steiner_tree.takahashi_matsuyama_steiner_tree(graph, indices)
     elif method == 'shortest_paths':
@@ -69,7 +245,7 @@ def steiner_tree(graph, ids, method='takahashi', **params):
             n['in_query'] = 1
         else:
             n['in_query'] = 0
-    return tree
+    return property_store.materialize(tree)
 
 
 def multi_steiner_tree(graph, ids):
@@ -77,7 +253,7 @@ def multi_steiner_tree(graph, ids):
     Returns a set of Steiner trees, starting from every node in the graph.
     """
     from . import steiner_tree
-    indices = [graph.vs.find(name=i).index for i in ids]
+    indices = resolve_nodes(graph, ids).tolist()
     all_trees = []
     for initial_terminal in range(len(ids)):
         tree = steiner_tree.takahashi_matsuyama_steiner_tree(graph, indices, initial_terminal)
@@ -87,7 +263,7 @@ def multi_steiner_tree(graph, ids):
                 n['in_query'] = 1
             else:
                 n['in_query'] = 0
-        all_trees.append(tree)
+        all_trees.append(property_store.materialize(tree))
     return all_trees
 
 def steiner_tree_subgraph(graph, ids, method='takahashi'):
@@ -95,7 +271,7 @@ def steiner_tree_subgraph(graph, ids, method='takahashi'):
     Returns a steiner tree as well as an subgraph, where the subgraph has the property "in_query" if the node is part of the query.
     """
     tree = steiner_tree(graph, ids, method)
-    subgraph = graph.induced_subgraph([n['name'] for n in tree.vs])
+    subgraph = property_store.materialize(graph.induced_subgraph([n['name'] for n in tree.vs]))
     for n in subgraph.vs:
         if n['name'] in ids:
             n['in_query'] = 1
@@ -110,7 +286,7 @@ def multi_steiner_tree_subgraph(graph, ids):
     trees = multi_steiner_tree(graph, ids)
     subgraphs = []
     for tree in trees:
-        subgraph = graph.induced_subgraph([n['name'] for n in tree.vs])
+        subgraph = property_store.materialize(graph.induced_subgraph([n['name'] for n in tree.vs]))
         for n in subgraph.vs:
             if n['name'] in ids:
                 n['in_query'] = 1
@@ -123,11 +299,11 @@ def shortest_paths_subgraph(graph, ids, target_id):
     """
     Returns a tree that contains all of the shortest paths from the ids to the given target_id.
     """
-    indices = [graph.vs.find(name=i).index for i in ids]
-    target_index = graph.vs.find(name=target_id)
+    indices = resolve_nodes(graph, ids).tolist()
+    target_index = int(resolve_nodes(graph, [target_id])[0])
     shortest_paths = graph.get_shortest_paths(target_index, indices)
     shortest_path_nodes = [x for path in shortest_paths for x in path]
-    subgraph = graph.induced_subgraph(shortest_path_nodes)
+    subgraph = property_store.materialize(graph.induced_subgraph(shortest_path_nodes))
     for n in subgraph.vs:
         if n['name'] in ids:
             n['in_query'] = 1
@@ -271,6 +447,36 @@ def graph_node_stats_networkx(graph, ids, target_nodes=None, shortest_paths_cach
             'average_jaccard': average_jaccard,
             }
 
+def graph_node_stats_store(store, ids, target_nodes=None):
+    """
+    graph_node_stats for a graph_store.GraphStore, so that node set statistics can be computed in worker processes that share a memory-mapped graph instead of each holding an igraph.Graph. Clustering coefficients are not computed.
+
+    Args:
+        - store - a graph_store.GraphStore
+        - ids - a list of node indices or node names
+        - target_nodes - a list of node indices or names of interest that we want to find the distances to.
+    """
+    def to_indices(nodes):
+        return [store.find(n) if isinstance(n, str) else int(n) for n in nodes]
+    ids = list(set(to_indices(ids)))
+    all_path_lengths = []
+    for i, n1 in enumerate(ids[:-1]):
+        distances = store.bfs_distances(n1)
+        all_path_lengths.extend(distances[ids[i+1:]].tolist())
+    average_pairwise_distance = sum(all_path_lengths)/(len(all_path_lengths))
+    output = {'average_pairwise_distance': average_pairwise_distance}
+    degrees = store.degree(ids)
+    output['degree_mean'] = np.mean(degrees)
+    output['degree_std'] = np.std(degrees)
+    if target_nodes is not None:
+        target_node_distances = []
+        for n1 in to_indices(target_nodes):
+            distances = store.bfs_distances(n1)
+            target_node_distances.extend(distances[ids].tolist())
+        average_target_distance = sum(target_node_distances)/len(target_node_distances)
+        output['average_target_distance'] = average_target_distance
+    return output
+
 def null_graph_stats(graph, category, n_ids, n_samples=100, ids_subset=None, use_degree_sampling=False, input_id_set=None, parallel=False, n_threads=None, **kwargs):
     """
     This generates node set statistics for n_samples random sets of nodes of size n_ids, where all nodes are either belonging to category, or are part of the ids_subset (if provided)
@@ -383,11 +589,11 @@ def hypergeom_test(graph, query_ids, query_category, query_universe=None):
     # 2. get all nodes in the graph that are connected to nodes in the query set
     # 2. compute the overlaps and the hypergeometric score
     if query_universe is None:
-        category_nodes = set([n.index for n in graph.vs if n['category'] == query_category])
+        category_nodes = set(get_graph_index(graph).nodes_in(query_category).tolist())
     else:
-        category_nodes = set([graph.vs.find(name=n).index for n in query_universe])
+        category_nodes = set(resolve_nodes(graph, query_universe).tolist())
     def single_hypergeom(ids):
-        indices = [graph.vs.find(name=i).index for i in ids]
+        indices = resolve_nodes(graph, ids).tolist()
         neighbors = set()
         for i in indices:
             neighbors.update(graph.neighbors(i))
@@ -0,0 +1,410 @@
+# Out-of-core compilation of kg2 dumps that don't fit in memory, into the compiled graph format (see compiled_graph).
+#
+# The in-memory loaders keep a dict of node ids, a set of used nodes and the edge dicts alive at the same time. build_kg2_external
+# instead reads the dumps in chunks, and keeps about memory_budget bytes of rows in memory:
+#   1. node rows are spilled to disk as sorted runs of (id, row number), and their properties as string tables in row order
+#   2. the runs are merged (external sort) into the sorted array of unique node ids, whose positions are the dense node indices;
+#      if an id appears in several rows, the last row is used
+#   3. edge rows are read in chunks; each chunk is sorted by node id and joined with the sorted node ids (sort-merge join),
+#      and spilled as runs of integer edges sorted by source and by target
+#   4. the edge runs are merged into the CSR arrays (the shards of each run are written in order into memory-mapped .npy files)
+# Nodes are numbered in the utf-8 order of their ids, instead of in file order as with kg2_loader.compile_kg2, and every edge row is
+# kept (as with edge_format='table'). Memory use is about memory_budget plus a few integers per node.
+
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import compiled_graph
+from .compressed_io import base_name
+from .progress import get_progress
+
+BUILD_VERSION = 1
+
+# default memory budget in bytes
+MEMORY_BUDGET = 1024**3
+# approximate memory used by a row of a chunk being parsed (python strings and lists), to get the chunk size from the budget
+ROW_BYTES = 512
+# approximate memory used by an item of a run while runs are merged
+MERGE_ITEM_BYTES = 64
+
+NODE_COLUMNS = ('id', 'name', 'category')
+EDGE_COLUMNS = ('subject', 'object', 'predicate')
+NODE_STRING_COLUMNS = ('feature_name', 'identifier', 'source')
+
+
+def _read_chunks(filename, kind, chunk_rows, progress):
+    """
+    Yields dicts of column lists of the node ('id', 'name', 'category') or edge ('subject', 'object', 'predicate') rows of a
+    kg2 csv/tsv/jsonl file, at most chunk_rows rows at a time.
+    """
+    base = base_name(filename)
+    with progress.open(filename) as f:
+        if base.endswith('.csv') or base.endswith('.tsv'):
+            columns = NODE_COLUMNS if kind == 'nodes' else EDGE_COLUMNS
+            for chunk in pd.read_csv(f, sep='\t' if 'tsv' in filename else ',', usecols=lambda c: c in columns, dtype=str,
+                    keep_default_na=False, na_filter=False, chunksize=chunk_rows):
+                data = {c: chunk[c].tolist() for c in chunk.columns}
+                if kind == 'nodes' and 'name' not in data:
+                    data['name'] = data['id']
+                progress.update(progress.rows + len(chunk))
+                yield data
+            return
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            data = {c: [] for c in (NODE_COLUMNS if kind == 'nodes' else EDGE_COLUMNS)}
+            for line in lines:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                is_node = 'id' in row and 'category' in row and 'subject' not in row and 'object' not in row
+                if kind == 'nodes' and is_node:
+                    data['id'].append(row['id'])
+                    data['name'].append(row['name'] if 'name' in row else row['id'])
+                    data['category'].append(row['category'])
+                elif kind == 'edges' and not is_node:
+                    data['subject'].append(row['subject'])
+                    data['object'].append(row['object'])
+                    data['predicate'].append(row['predicate'])
+            progress.update(progress.rows + len(lines))
+            yield data
+
+
+def _encode(strings):
+    "Returns a fixed-width bytes array of the utf-8 encoded strings."
+    return np.array([s.encode('utf-8') for s in strings], dtype=bytes)
+
+
+def _codes(values, types):
+    "Returns the 1-based codes of values in a label: code dict, adding new labels in first-seen order."
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), sort=False)
+    lookup = np.array([types.setdefault(u, len(types) + 1) for u in uniques], dtype=np.int32)
+    return lookup[codes] if len(codes) else np.zeros(0, dtype=np.int32)
+
+
+class _SpillColumn:
+    "A string column written to disk in row order: a utf-8 blob file and a file of string lengths."
+
+    def __init__(self, directory, name):
+        self.blob_filename = os.path.join(directory, name + '.blob')
+        self.lengths_filename = os.path.join(directory, name + '.lengths')
+        self._blob = open(self.blob_filename, 'wb')
+        self._lengths = open(self.lengths_filename, 'wb')
+
+    def append(self, strings):
+        encoded = [str(s).encode('utf-8') for s in strings]
+        self._blob.write(b''.join(encoded))
+        np.fromiter((len(s) for s in encoded), dtype=np.int64, count=len(encoded)).tofile(self._lengths)
+
+    def close(self):
+        self._blob.close()
+        self._lengths.close()
+
+    def write_string_table(self, directory, column, rows, block_size):
+        "Writes the strings of the given rows (in that order) as a compiled_graph string table, block_size strings at a time."
+        lengths = np.fromfile(self.lengths_filename, dtype=np.int64)
+        starts = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=starts[1:])
+        del lengths
+        blob = np.memmap(self.blob_filename, dtype=np.uint8, mode='r') if starts[-1] > 0 else np.zeros(0, dtype=np.uint8)
+        out_lengths = starts[rows + 1] - starts[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(out_lengths, out=offsets[1:])
+        np.save(os.path.join(directory, column + '.offsets.npy'), offsets)
+        out_blob = _output_array(os.path.join(directory, column + '.blob.npy'), np.uint8, int(offsets[-1]))
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start:start + block_size]
+            block_lengths = out_lengths[start:start + block_size]
+            total = int(block_lengths.sum())
+            if total == 0:
+                continue
+            # gather the bytes of every string of the block: position in the output block -> position in the blob
+            block_starts = offsets[start:start + len(block_rows)] - offsets[start]
+            index = np.arange(total, dtype=np.int64) + np.repeat(starts[block_rows] - block_starts, block_lengths)
+            out_blob[offsets[start]:offsets[start] + total] = blob[index]
+        del out_blob
+
+
+def _output_array(filename, dtype, n):
+    "Returns a memory-mapped .npy file of n items to fill in (or an array that is already saved if n is 0, which can't be memory-mapped)."
+    if n == 0:
+        array = np.zeros(0, dtype=dtype)
+        np.save(filename, array)
+        return array
+    return np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(n,))
+
+
+def _save_run(directory, name, arrays):
+    filenames = []
+    for i, array in enumerate(arrays):
+        filename = os.path.join(directory, '{0}.{1}.npy'.format(name, i))
+        np.save(filename, array)
+        filenames.append(filename)
+    return filenames
+
+
+def _sorted_concat(parts):
+    "Concatenates blocks of (keys, payloads...) and sorts them by key; ties keep the order of the parts."
+    arrays = [np.concatenate(a) for a in zip(*parts)]
+    order = np.argsort(arrays[0], kind='stable')
+    return tuple(a[order] for a in arrays)
+
+
+def merge_runs(runs, block_size, keep_groups=False):
+    """
+    Merges sorted runs into sorted blocks (k-way merge), reading block_size items of each run at a time.
+
+    Args:
+        runs: list of runs, each a list of .npy files: the sorted keys, then payload arrays
+        block_size: number of items read from a run at a time
+        keep_groups: if True, all the items with the same key are in the same block, and ties keep the order of the runs
+
+    Returns:
+        iterator of tuples of arrays (keys, payloads...)
+    """
+    arrays = [[np.load(f, mmap_mode='r') for f in run] for run in runs]
+    sizes = [len(a[0]) for a in arrays]
+    positions = [0]*len(runs)
+    buffers = [None]*len(runs)
+
+    def load(i):
+        start = positions[i]
+        end = min(start + block_size, sizes[i])
+        block = tuple(np.asarray(a[start:end]) for a in arrays[i])
+        positions[i] = end
+        buffers[i] = block if buffers[i] is None else tuple(np.concatenate([b, c]) for b, c in zip(buffers[i], block))
+
+    for i in range(len(runs)):
+        load(i)
+    while True:
+        # runs that have unread items bound the keys that can be merged
+        more = [i for i in range(len(runs)) if positions[i] < sizes[i]]
+        if not more:
+            parts = [b for b in buffers if len(b[0]) > 0]
+            if parts:
+                yield _sorted_concat(parts)
+            return
+        bound = min(buffers[i][0][-1] for i in more)
+        parts = []
+        for i in range(len(runs)):
+            n = int(np.searchsorted(buffers[i][0], bound, side='left' if keep_groups else 'right'))
+            if n > 0:
+                parts.append(tuple(a[:n] for a in buffers[i]))
+                buffers[i] = tuple(a[n:] for a in buffers[i])
+        if parts:
+            yield _sorted_concat(parts)
+        for i in more:
+            if len(buffers[i][0]) == 0 or buffers[i][0][-1] == bound:
+                load(i)
+
+
+def _lookup(node_ids, keys):
+    """
+    Returns the positions of keys (a bytes array) in the sorted node_ids array (memory-mapped), sorting the keys first so that
+    the node ids are read in order. Raises a KeyError for keys that aren't node ids.
+    """
+    positions = np.zeros(len(keys), dtype=np.int64)
+    if len(keys) == 0:
+        return positions
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    # longer keys than the node ids can't be node ids (and would be truncated by the cast)
+    too_long = np.char.str_len(sorted_keys) > node_ids.dtype.itemsize
+    sorted_keys = sorted_keys.astype(node_ids.dtype)
+    found = np.searchsorted(node_ids, sorted_keys)
+    valid = (found < len(node_ids)) & ~too_long
+    valid[valid] = node_ids[found[valid]] == sorted_keys[valid]
+    if not valid.all():
+        raise KeyError(keys[order][np.argmin(valid)].decode('utf-8'))
+    positions[order] = found
+    return positions
+
+
+def build_kg2_external(node_filename, edge_filename=None, directory=None, edges_to_include=None, remove_unused_nodes=True,
+        memory_budget=MEMORY_BUDGET, tmp_dir=None, cache_dir=None, verbose=False, progress=None):
+    """
+    Compiles a kg2 dump (csv/tsv or jsonl, optionally compressed) into a compiled graph without loading it in memory.
+
+    Args:
+        node_filename: node file, or file with both nodes and edges (jsonl)
+        edge_filename: edge file
+        directory: output directory. By default, the compiled graph is cached in cache_dir (see compiled_graph.cache_path), and reused if the files haven't changed.
+        edges_to_include: set of edge types
+        remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
+        memory_budget: approximate number of bytes of rows kept in memory
+        tmp_dir: directory for the sorted runs (default: the system temporary directory)
+        verbose: whether to log progress at INFO level (see progress)
+        progress: optional progress.Progress that collects the metrics of the build
+
+    Returns:
+        directory of the compiled graph, which can be loaded with compiled_graph.load_compiled_igraph or graph_store.GraphStore
+    """
+    filenames = [node_filename] + ([edge_filename] if edge_filename is not None else [])
+    key = compiled_graph.source_key(filenames, loader='kg2_external', build_version=BUILD_VERSION,
+            edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes)
+    if directory is None:
+        directory = compiled_graph.cache_path(key, cache_dir)
+        if compiled_graph.is_valid(directory, key):
+            return directory
+    progress, owned = get_progress(progress, 'build_kg2_external', verbose)
+    chunk_rows = max(1000, memory_budget // ROW_BYTES)
+    run_dir = tempfile.mkdtemp(prefix='kgfe_build_', dir=tmp_dir)
+    tmp_directory = directory + '.tmp'
+    try:
+        # 1. node runs and properties
+        progress.start_phase('parse')
+        node_types = {}
+        columns = {c: _SpillColumn(run_dir, c) for c in NODE_STRING_COLUMNS}
+        category_file = open(os.path.join(run_dir, 'category'), 'wb')
+        node_runs = []
+        n_rows = 0
+        width = 1
+        for data in _read_chunks(node_filename, 'nodes', chunk_rows, progress):
+            if not data['id']:
+                continue
+            ids = _encode(data['id'])
+            width = max(width, ids.dtype.itemsize)
+            order = np.argsort(ids, kind='stable')
+            rows = np.arange(n_rows, n_rows + len(ids), dtype=np.int64)
+            node_runs.append(_save_run(run_dir, 'nodes{0}'.format(len(node_runs)), [ids[order], rows[order]]))
+            columns['feature_name'].append(data['name'])
+            columns['identifier'].append(data['id'])
+            columns['source'].append(data['category'])
+            _codes(data['category'], node_types).tofile(category_file)
+            n_rows += len(ids)
+        category_file.close()
+        for column in columns.values():
+            column.close()
+        # 2. sorted unique node ids (keeping the last row of every id)
+        progress.start_phase('sort')
+        block_size = max(1000, memory_budget // (MERGE_ITEM_BYTES*max(1, len(node_runs))))
+        node_ids_filename = os.path.join(run_dir, 'node_ids')
+        node_rows = []
+        n_nodes = 0
+        with open(node_ids_filename, 'wb') as f:
+            for ids, rows in merge_runs(node_runs, block_size, keep_groups=True):
+                last = np.ones(len(ids), dtype=bool)
+                last[:-1] = ids[1:] != ids[:-1]
+                ids = ids[last].astype('S{0}'.format(width))
+                f.write(ids.tobytes())
+                node_rows.append(rows[last])
+                n_nodes += len(ids)
+        node_rows = np.concatenate(node_rows) if node_rows else np.zeros(0, dtype=np.int64)
+        if n_nodes > 0:
+            node_ids = np.memmap(node_ids_filename, dtype='S{0}'.format(width), mode='r', shape=(n_nodes,))
+        else:
+            node_ids = np.zeros(0, dtype='S{0}'.format(width))
+        # 3. edges as integer pairs
+        progress.start_phase('join')
+        edge_types = {}
+        out_runs = []
+        in_runs = []
+        used = np.zeros(n_nodes, dtype=bool)
+        for data in _read_chunks(edge_filename if edge_filename is not None else node_filename, 'edges', chunk_rows, progress):
+            predicate = pd.Series(data['predicate'], dtype=object)
+            keep = np.ones(len(predicate), dtype=bool) if edges_to_include is None else predicate.isin(list(edges_to_include)).to_numpy()
+            if not keep.any():
+                continue
+            src = _lookup(node_ids, _encode(np.array(data['subject'], dtype=object)[keep]))
+            dst = _lookup(node_ids, _encode(np.array(data['object'], dtype=object)[keep]))
+            edge_type = _codes(predicate[keep], edge_types)
+            used[src] = True
+            used[dst] = True
+            order = np.argsort(src, kind='stable')
+            out_runs.append(_save_run(run_dir, 'out{0}'.format(len(out_runs)), [src[order], dst[order], edge_type[order]]))
+            order = np.argsort(dst, kind='stable')
+            in_runs.append(_save_run(run_dir, 'in{0}'.format(len(in_runs)), [dst[order], src[order]]))
+        if remove_unused_nodes:
+            new_index = np.cumsum(used, dtype=np.int64) - 1
+            kept = np.flatnonzero(used)
+        else:
+            new_index = None
+            kept = np.arange(n_nodes, dtype=np.int64)
+        del used
+        n_kept = len(kept)
+        # 4. CSR arrays and node columns
+        progress.start_phase('csr')
+        if os.path.exists(tmp_directory):
+            shutil.rmtree(tmp_directory)
+        os.makedirs(tmp_directory)
+        n_edges = sum(int(np.load(run[0], mmap_mode='r').shape[0]) for run in out_runs)
+        block_size = max(1000, memory_budget // (MERGE_ITEM_BYTES*max(1, len(out_runs))))
+        arrays = {}
+        for name, dtype in [('indices', np.int64), ('edge_type', np.int32), ('in_indices', np.int64)]:
+            arrays[name] = _output_array(os.path.join(tmp_directory, name + '.npy'), dtype, n_edges)
+        for runs, indptr_name, columns_out in [(out_runs, 'indptr', ('indices', 'edge_type')), (in_runs, 'in_indptr', ('in_indices',))]:
+            counts = np.zeros(n_kept, dtype=np.int64)
+            position = 0
+            for merged in merge_runs(runs, block_size):
+                rows, values = merged[0], list(merged[1:])
+                values[0] = values[0] if new_index is None else new_index[values[0]]
+                rows = rows if new_index is None else new_index[rows]
+                counts += np.bincount(rows, minlength=n_kept)
+                for name, value in zip(columns_out, values):
+                    arrays[name][position:position + len(rows)] = value
+                position += len(rows)
+            indptr = np.zeros(n_kept + 1, dtype=np.int64)
+            np.cumsum(counts, out=indptr[1:])
+            np.save(os.path.join(tmp_directory, indptr_name + '.npy'), indptr)
+        del arrays
+        progress.start_phase('properties')
+        rows = node_rows[kept]
+        category = np.fromfile(os.path.join(run_dir, 'category'), dtype=np.int32)
+        np.save(os.path.join(tmp_directory, 'category.npy'), category[rows])
+        del category
+        # the nodes are sorted by their utf-8 encoded names
+        np.save(os.path.join(tmp_directory, 'name_order.npy'), np.arange(n_kept, dtype=np.int64))
+        string_block = max(1000, memory_budget // ROW_BYTES)
+        _write_names(tmp_directory, node_ids, kept, string_block)
+        for column, spilled in columns.items():
+            spilled.write_string_table(tmp_directory, column, rows, string_block)
+        meta = {
+                'version': compiled_graph.FORMAT_VERSION,
+                'n_nodes': n_kept,
+                'n_edges': n_edges,
+                'node_types': [[int(v), k] for k, v in node_types.items()],
+                'edge_types': [[int(v), k] for k, v in edge_types.items()],
+                'node_columns': list(NODE_STRING_COLUMNS),
+                'edge_property_columns': [],
+                'typed_edges': True,
+                # like edge_format='table', the edges don't have source/target node id attributes
+                'edge_endpoints': False,
+                'key': key,
+        }
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_directory, directory)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+        if os.path.exists(tmp_directory):
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+    if owned:
+        progress.finish(nodes=n_kept, edges=n_edges)
+    else:
+        progress.update(nodes=n_kept, edges=n_edges)
+        progress.end_phase()
+    return directory
+
+
+def _write_names(directory, node_ids, nodes, block_size):
+    "Writes the name string table of the given nodes from the sorted node ids, block_size names at a time."
+    lengths = np.zeros(len(nodes), dtype=np.int64)
+    for start in range(0, len(nodes), block_size):
+        lengths[start:start + block_size] = np.char.str_len(node_ids[nodes[start:start + block_size]])
+    offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    np.save(os.path.join(directory, 'name.offsets.npy'), offsets)
+    blob = _output_array(os.path.join(directory, 'name.blob.npy'), np.uint8, int(offsets[-1]))
+    for start in range(0, len(nodes), block_size):
+        data = b''.join(node_ids[nodes[start:start + block_size]].tolist())
+        blob[offsets[start]:offsets[start] + len(data)] = np.frombuffer(data, dtype=np.uint8)
+    del blob
@@ -1,13 +1,13 @@
 import igraph as ig
 import pandas as pd
 from .graph_info import get_names_to_ids
+from .graph_index import resolve_nodes
 
 def get_feature_pairs(graph, ids, category='Gene'):
     """
     Returns a list of feature pairs within the ids with their specific interactions.
     """
-    graph_node_ids = set(v['name'] for v in graph.vs)
-    node_ids = {graph.vs.find(i).index for i in ids if i in graph_node_ids}
+    node_ids = set(resolve_nodes(graph, list(ids), missing='drop').tolist())
     edges = []
     for i in node_ids:
         for n in graph.neighbors(i):
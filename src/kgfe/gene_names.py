@@ -1,58 +1,422 @@
 # extremely simple way of converting gene names
-import gzip
+#
+# The lookup tables are only built when they are first used. They are cached as sorted numpy arrays in
+# $KGFE_CACHE_DIR/gene_names (default: ~/.cache/kgfe/gene_names), and rebuilt if the source files change,
+# so later processes only have to memory-map them.
+#
+# Every function takes a species argument (default 'human'), which is a key of SPECIES (or a taxon id); see register_species.
+import json
 import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from .compressed_io import open_text
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
-ID_TO_SYMBOL = {}
-SYMBOL_TO_ID = {}
-ID_TO_UNIPROT = {}
-UNIPROT_TO_ID = {}
-ID_TO_ENSEMBL = {}
-ENSEMBL_TO_ID = {}
+# relative data file names are looked up in the package directory, then in the repository root
+DATA_DIRS = [base_dir, os.path.abspath(os.path.join(base_dir, '..', '..'))]
+
+INDEX_VERSION = 2
+
+# Data files of each species:
+#   gene_info - NCBI gene_info file (gzipped), for the symbol tables
+#   gene_uniprot, uniprot_genes - gene id -> uniprot and uniprot -> gene id files, for the uniprot tables
+#   geneid_ensembl - gene id -> ensembl file. If it is missing, the ensembl tables are built from the dbXrefs column of the gene_info file.
+SPECIES = {
+        'human': {
+            'taxon_id': 9606,
+            'gene_info': 'Homo_sapiens.gene_info.gz',
+            'gene_uniprot': 'gene_uniprot.txt',
+            'uniprot_genes': 'uniprot_genes.txt',
+            'geneid_ensembl': 'geneid_ensembl.txt',
+        },
+        'mouse': {
+            'taxon_id': 10090,
+            'gene_info': 'Mus_musculus.gene_info.gz',
+        },
+}
+
+# prefixes of graph node ids for each identifier type, in the 'prefix::id' form of graph_info.df_to_graph (see to_graph_ids)
+GRAPH_ID_PREFIXES = {
+        'ncbi': 'NCBIGene::',
+        'uniprot': 'UniProtKB::',
+        'ensembl': 'ENSEMBL::',
+        'symbol': '',
+}
 
+# the old module-level dicts (for human), which are now created on first access (see __getattr__)
+_DICT_TABLES = {
+        'ID_TO_SYMBOL': 'id_to_symbol',
+        'SYMBOL_TO_ID': 'symbol_to_id',
+        'ID_TO_UNIPROT': 'id_to_uniprot',
+        'UNIPROT_TO_ID': 'uniprot_to_id',
+        'ID_TO_ENSEMBL': 'id_to_ensembl',
+        'ENSEMBL_TO_ID': 'ensembl_to_id',
+}
 
-def _load_gene_info():
-    with gzip.open(os.path.join(base_dir, 'Homo_sapiens.gene_info.gz'), 'rt') as f:
-        for row in f.readlines():
+_TABLE_GROUPS = {
+        'id_to_symbol': 'gene_info',
+        'symbol_to_id': 'gene_info',
+        'id_to_uniprot': 'uniprot',
+        'uniprot_to_id': 'uniprot',
+        'id_to_ensembl': 'ensembl',
+        'ensembl_to_id': 'ensembl',
+}
+
+# dict of (species, table name): _LookupTable
+_tables = {}
+
+
+def register_species(name, taxon_id=None, gene_info=None, gene_uniprot=None, uniprot_genes=None, geneid_ensembl=None):
+    """
+    Adds a species (or replaces its data files). The files can be absolute paths or names of files in DATA_DIRS; see SPECIES.
+    """
+    files = {'taxon_id': taxon_id, 'gene_info': gene_info, 'gene_uniprot': gene_uniprot,
+            'uniprot_genes': uniprot_genes, 'geneid_ensembl': geneid_ensembl}
+    SPECIES[name] = {k: v for k, v in files.items() if v is not None}
+    for key in list(_tables):
+        if key[0] == name:
+            del _tables[key]
+
+
+def _species_name(species):
+    "Returns the SPECIES key for a species name or taxon id."
+    if species in SPECIES:
+        return species
+    for name, files in SPECIES.items():
+        if files.get('taxon_id') is not None and str(files['taxon_id']) == str(species):
+            return name
+    raise ValueError('Unknown species: {0} (available: {1})'.format(species, ', '.join(SPECIES)))
+
+
+def _data_file(filename):
+    if os.path.isabs(filename):
+        return filename
+    for directory in DATA_DIRS:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    return os.path.join(DATA_DIRS[0], filename)
+
+
+def _read_gene_info(filename):
+    "Returns the id_to_symbol and symbol_to_id dicts from an NCBI gene_info file."
+    id_to_symbol = {}
+    symbol_to_id = {}
+    with open_text(filename) as f:
+        for row in f:
             row = row.split('\t')
             if row[0] == '#tax_id':
                 continue
             gene_id = int(row[1])
-            ID_TO_SYMBOL[gene_id] = row[2]
+            id_to_symbol[gene_id] = row[2]
             synonyms = row[4].split('|')
-            if row[2] not in SYMBOL_TO_ID:
-                SYMBOL_TO_ID[row[2]] = gene_id
+            if row[2] not in symbol_to_id:
+                symbol_to_id[row[2]] = gene_id
             for s in synonyms:
-                if s not in SYMBOL_TO_ID:
-                    SYMBOL_TO_ID[s] = gene_id
+                if s not in symbol_to_id:
+                    symbol_to_id[s] = gene_id
+    return {'id_to_symbol': id_to_symbol, 'symbol_to_id': symbol_to_id}
+
 
-def _load_uniprot_info():
-    with open(os.path.join(base_dir, 'gene_uniprot.txt')) as f:
-        for row in f.readlines():
+def _read_uniprot_info(gene_uniprot_filename, uniprot_genes_filename):
+    id_to_uniprot = {}
+    uniprot_to_id = {}
+    with open(gene_uniprot_filename) as f:
+        for row in f:
             row = row.split()
             gene_id = int(row[0])
-            if gene_id not in ID_TO_UNIPROT:
-                ID_TO_UNIPROT[gene_id] = row[1]
-            if row[1] not in UNIPROT_TO_ID:
-                UNIPROT_TO_ID[row[1]] = gene_id
-    with open(os.path.join(base_dir, 'uniprot_genes.txt')) as f:
-        for row in f.readlines():
+            if gene_id not in id_to_uniprot:
+                id_to_uniprot[gene_id] = row[1]
+            if row[1] not in uniprot_to_id:
+                uniprot_to_id[row[1]] = gene_id
+    with open(uniprot_genes_filename) as f:
+        for row in f:
             row = row.strip().split()
             gene_id = int(row[1])
-            if row[0] not in UNIPROT_TO_ID:
-                UNIPROT_TO_ID[row[0]] = gene_id
+            if row[0] not in uniprot_to_id:
+                uniprot_to_id[row[0]] = gene_id
+    return {'id_to_uniprot': id_to_uniprot, 'uniprot_to_id': uniprot_to_id}
 
-def _load_ensembl_info():
-    with open(os.path.join(base_dir, 'geneid_ensembl.txt')) as f:
-        for row in f.readlines():
+
+def _read_ensembl_info(filename):
+    id_to_ensembl = {}
+    ensembl_to_id = {}
+    with open(filename) as f:
+        for row in f:
             row = row.split()
             gene_id = int(row[0])
-            ID_TO_ENSEMBL[gene_id] = row[1]
-            ENSEMBL_TO_ID[row[1]] = gene_id
+            id_to_ensembl[gene_id] = row[1]
+            ensembl_to_id[row[1]] = gene_id
+    return {'id_to_ensembl': id_to_ensembl, 'ensembl_to_id': ensembl_to_id}
+
+
+def _read_gene_info_ensembl(filename):
+    "Returns the id_to_ensembl and ensembl_to_id dicts from the dbXrefs column of an NCBI gene_info file."
+    id_to_ensembl = {}
+    ensembl_to_id = {}
+    with open_text(filename) as f:
+        for row in f:
+            row = row.split('\t')
+            if row[0] == '#tax_id':
+                continue
+            gene_id = int(row[1])
+            for xref in row[5].split('|'):
+                if xref.startswith('Ensembl:'):
+                    ensembl_id = xref[len('Ensembl:'):]
+                    id_to_ensembl.setdefault(gene_id, ensembl_id)
+                    ensembl_to_id.setdefault(ensembl_id, gene_id)
+    return {'id_to_ensembl': id_to_ensembl, 'ensembl_to_id': ensembl_to_id}
+
+
+def _table_sources(species):
+    """
+    Returns a dict of group name: (list of source files, function that reads them into a dict of table name: dict) for the species.
+    """
+    files = {k: _data_file(v) for k, v in SPECIES[species].items() if k != 'taxon_id'}
+    sources = {}
+    if 'gene_info' in files:
+        sources['gene_info'] = ([files['gene_info']], lambda: _read_gene_info(files['gene_info']))
+    if 'gene_uniprot' in files and 'uniprot_genes' in files:
+        sources['uniprot'] = ([files['gene_uniprot'], files['uniprot_genes']],
+                lambda: _read_uniprot_info(files['gene_uniprot'], files['uniprot_genes']))
+    if 'geneid_ensembl' in files:
+        sources['ensembl'] = ([files['geneid_ensembl']], lambda: _read_ensembl_info(files['geneid_ensembl']))
+    elif 'gene_info' in files:
+        sources['ensembl'] = ([files['gene_info']], lambda: _read_gene_info_ensembl(files['gene_info']))
+    return sources
+
+
+def _encode(values):
+    "Converts a list of ints or strings to an int64 array or an array of utf-8 bytes."
+    if values and isinstance(values[0], str):
+        return np.array([v.encode('utf-8') for v in values], dtype=bytes)
+    return np.array(values, dtype=np.int64)
+
+
+def _as_int64(values):
+    """
+    Converts a list, array or pandas Series of gene ids (ints, floats or numeric strings) to an int64 array.
+    Returns (array, valid), where valid is False for missing or non-numeric values.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64), np.ones(len(values), dtype=bool)
+    numbers = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+    valid = ~np.isnan(numbers)
+    result = np.zeros(len(values), dtype=np.int64)
+    result[valid] = numbers[valid]
+    return result, valid
+
+
+def _as_bytes(values):
+    """
+    Converts a list, array or pandas Series of strings to an array of utf-8 bytes. Returns (array, valid), where valid is False for missing values.
+    """
+    values = pd.Series(np.asarray(values, dtype=object))
+    valid = values.notna().to_numpy()
+    strings = values.where(valid, '').astype(str).to_numpy(dtype=str)
+    return np.char.encode(strings, 'utf-8'), valid
 
-_load_gene_info()
-    
-def convert(source, dest, ids, ignore_missing=True):
+
+class _LookupTable:
+    """
+    A read-only mapping stored as an array of sorted keys and an array of the corresponding values.
+    Keys and values are int64 or utf-8 encoded bytes. Keys are looked up with a binary search.
+    """
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.values = values
+        self.str_keys = keys.dtype.kind == 'S'
+        self.str_values = values.dtype.kind == 'S'
+
+    @classmethod
+    def from_dict(cls, d):
+        keys = list(d.keys())
+        key_array = _encode(keys)
+        value_array = _encode([d[k] for k in keys])
+        order = np.argsort(key_array, kind='stable')
+        return cls(key_array[order], value_array[order])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """
+        Looks up a list, array or pandas Series of keys. Returns (values, found), where found is a boolean array, and values[i] is only meaningful where found[i] is True.
+        """
+        if self.str_keys:
+            query, valid = _as_bytes(keys)
+        else:
+            query, valid = _as_int64(keys)
+        if len(self.keys) == 0 or len(query) == 0:
+            return np.zeros(len(query), dtype=self.values.dtype), np.zeros(len(query), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        found = np.asarray(self.keys[positions] == query) & valid
+        return np.asarray(self.values[positions]), found
+
+    def get_list(self, keys, ignore_missing=True):
+        """
+        Returns the list of values for keys. Missing keys are skipped if ignore_missing is True, otherwise they raise a KeyError.
+        """
+        keys = list(keys)
+        values, found = self.lookup(keys)
+        if not ignore_missing and not found.all():
+            raise KeyError(keys[int(np.flatnonzero(~found)[0])])
+        values = values[found]
+        if self.str_values:
+            return [v.decode('utf-8') for v in values.tolist()]
+        return values.tolist()
+
+    def __getitem__(self, key):
+        return self.get_list([key], ignore_missing=False)[0]
+
+    def __contains__(self, key):
+        return bool(self.lookup([key])[1][0])
+
+    def to_dict(self):
+        keys = self.keys.tolist()
+        values = self.values.tolist()
+        if self.str_keys:
+            keys = [k.decode('utf-8') for k in keys]
+        if self.str_values:
+            values = [v.decode('utf-8') for v in values]
+        return dict(zip(keys, values))
+
+
+def index_dir():
+    "Returns the directory where the gene name indices are cached."
+    from .compiled_graph import default_cache_dir
+    return os.path.join(default_cache_dir(), 'gene_names')
+
+
+def _load_group(species, group):
+    """
+    Loads the lookup tables of a group from the cached index, building the index first if it is missing or older than the source files.
+    """
+    from .compiled_graph import source_key
+    sources = _table_sources(species)
+    if group not in sources:
+        raise ValueError('No {0} mapping files for species {1}'.format(group, species))
+    filenames, read = sources[group]
+    key = {'version': INDEX_VERSION, 'sources': source_key(filenames)}
+    directory = os.path.join(index_dir(), species, group)
+    meta_filename = os.path.join(directory, 'meta.json')
+    try:
+        with open(meta_filename) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        meta = None
+    if meta is not None and meta.get('key') == json.loads(json.dumps(key)):
+        for name in meta['tables']:
+            _tables[(species, name)] = _LookupTable(np.load(os.path.join(directory, name + '.keys.npy'), mmap_mode='r'),
+                    np.load(os.path.join(directory, name + '.values.npy'), mmap_mode='r'))
+        return
+    tables = {name: _LookupTable.from_dict(d) for name, d in read().items()}
+    for name, table in tables.items():
+        _tables[(species, name)] = table
+    try:
+        tmp_directory = directory + '.tmp{0}'.format(os.getpid())
+        os.makedirs(tmp_directory, exist_ok=True)
+        for name, table in tables.items():
+            np.save(os.path.join(tmp_directory, name + '.keys.npy'), table.keys)
+            np.save(os.path.join(tmp_directory, name + '.values.npy'), table.values)
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+            json.dump({'key': key, 'tables': list(tables)}, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_directory, directory)
+    except OSError:
+        # the cache directory isn't writable, or another process wrote the index first; the tables are still in memory
+        pass
+
+
+def _get_table(name, species='human'):
+    species = _species_name(species)
+    if (species, name) not in _tables:
+        _load_group(species, _TABLE_GROUPS[name])
+    return _tables[(species, name)]
+
+
+def __getattr__(name):
+    # ID_TO_SYMBOL etc. used to be built when the module was imported
+    if name in _DICT_TABLES:
+        d = _get_table(_DICT_TABLES[name]).to_dict()
+        globals()[name] = d
+        return d
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+
+
+def _id_type(name):
+    if name == 'geneid':
+        return 'ncbi'
+    if name not in GRAPH_ID_PREFIXES:
+        raise ValueError('Unknown identifier type: {0}'.format(name))
+    return name
+
+
+def convert_array(ids, source, dest, species='human'):
+    """
+    Vectorized version of convert, which keeps missing values aligned with the input.
+
+    Args:
+        ids: list, numpy array or pandas Series of identifiers
+        source, dest: 'ncbi'/'geneid', 'symbol', 'uniprot' or 'ensembl'
+        species: key of SPECIES (e.g. 'human', 'mouse') or taxon id
+
+    Returns:
+        values: numpy array with one entry per id - int64 gene ids if dest is 'ncbi' (0 where missing), otherwise an object array of strings (None where missing)
+        found: boolean numpy array, False where the id couldn't be converted
+    """
+    source = _id_type(source)
+    dest = _id_type(dest)
+    if source == dest:
+        if dest == 'ncbi':
+            return _as_int64(ids)
+        ids, found = _as_bytes(ids)
+        values = np.full(len(ids), None, dtype=object)
+        values[found] = np.char.decode(ids[found], 'utf-8')
+        return values, found
+    if source == 'ncbi':
+        gene_ids, found = _as_int64(ids)
+    else:
+        gene_ids, found = _get_table(source + '_to_id', species).lookup(ids)
+    if dest == 'ncbi':
+        return np.where(found, gene_ids, 0), found
+    table = _get_table('id_to_' + dest, species)
+    encoded, dest_found = table.lookup(gene_ids)
+    found = found & dest_found
+    values = np.full(len(found), None, dtype=object)
+    values[found] = np.char.decode(encoded[found], 'utf-8')
+    return values, found
+
+
+def to_graph_ids(ids, source, dest='ncbi', species='human', prefix=None):
+    """
+    Converts a list, numpy array or pandas Series of identifiers (e.g. a column of uniprot ids) to graph node ids such as 'NCBIGene::1234'.
+
+    Args:
+        ids: identifiers of type source
+        source, dest: see convert_array
+        prefix: prefix of the graph ids (default: GRAPH_ID_PREFIXES[dest])
+
+    Returns:
+        graph_ids: object array of graph ids (None where missing)
+        found: boolean array
+    """
+    dest = _id_type(dest)
+    if prefix is None:
+        prefix = GRAPH_ID_PREFIXES[dest]
+    values, found = convert_array(ids, source, dest, species)
+    graph_ids = np.full(len(found), None, dtype=object)
+    graph_ids[found] = np.char.add(prefix, values[found].astype(str))
+    return graph_ids, found
+
+
+def convert(source, dest, ids, ignore_missing=True, species='human'):
     """
     General conversion function.
 
@@ -62,74 +426,50 @@ def convert(source, dest, ids, ignore_missing=True):
     if source == 'ncbi' or source == 'geneid':
         gene_ids = ids
     elif source == 'symbol':
-        gene_ids = get_ids(ids, ignore_missing=ignore_missing)
+        gene_ids = get_ids(ids, ignore_missing=ignore_missing, species=species)
     elif source == 'uniprot':
-        gene_ids = uniprot_to_gene_ids(ids, ignore_missing=ignore_missing)
+        gene_ids = uniprot_to_gene_ids(ids, ignore_missing=ignore_missing, species=species)
     elif source == 'ensembl':
-        gene_ids = ensembl_to_gene_ids(ids, ignore_missing=ignore_missing)
+        gene_ids = ensembl_to_gene_ids(ids, ignore_missing=ignore_missing, species=species)
     if dest == 'ncbi' or dest == 'geneid':
         return gene_ids
     elif dest == 'symbol':
-        return get_symbols(gene_ids, ignore_missing=ignore_missing)
+        return get_symbols(gene_ids, ignore_missing=ignore_missing, species=species)
     elif dest == 'uniprot':
-        return gene_ids_to_uniprot(gene_ids, ignore_missing=ignore_missing)
+        return gene_ids_to_uniprot(gene_ids, ignore_missing=ignore_missing, species=species)
     elif dest == 'ensembl':
-        return gene_ids_to_ensembl(gene_ids, ignore_missing=ignore_missing)
+        return gene_ids_to_ensembl(gene_ids, ignore_missing=ignore_missing, species=species)
 
-def get_symbols(gene_ids, ignore_missing=True):
+def get_symbols(gene_ids, ignore_missing=True, species='human'):
     """
     Get symbols given a list of gene ids.
     """
-    gene_ids = [int(x) for x in gene_ids]
-    if ignore_missing:
-        return [ID_TO_SYMBOL[x] for x in gene_ids if x in ID_TO_SYMBOL]
-    return [ID_TO_SYMBOL[x] for x in gene_ids]
+    return _get_table('id_to_symbol', species).get_list(gene_ids, ignore_missing)
 
-def get_symbol(gene_id):
-    return ID_TO_SYMBOL[int(gene_id)]
+def get_symbol(gene_id, species='human'):
+    return _get_table('id_to_symbol', species)[int(gene_id)]
 
-def get_ids(gene_symbols, ignore_missing=True):
+def get_ids(gene_symbols, ignore_missing=True, species='human'):
     """
     Get ids given a list of gene symbols.
     """
-    if ignore_missing:
-        return [SYMBOL_TO_ID[x] for x in gene_symbols if x in SYMBOL_TO_ID]
-    return [SYMBOL_TO_ID[x] for x in gene_symbols]
-
-def get_id(gene_symbol):
-    return SYMBOL_TO_ID[gene_symbol]
+    return _get_table('symbol_to_id', species).get_list(gene_symbols, ignore_missing)
 
+def get_id(gene_symbol, species='human'):
+    return _get_table('symbol_to_id', species)[gene_symbol]
 
-def gene_ids_to_uniprot(gene_ids, ignore_missing=True):
-    if len(ID_TO_UNIPROT) == 0:
-        _load_uniprot_info()
-    gene_ids = [int(x) for x in gene_ids]
-    if ignore_missing:
-        return [ID_TO_UNIPROT[x] for x in gene_ids if x in ID_TO_UNIPROT]
-    return [ID_TO_UNIPROT[x] for x in gene_ids]
 
+def gene_ids_to_uniprot(gene_ids, ignore_missing=True, species='human'):
+    return _get_table('id_to_uniprot', species).get_list(gene_ids, ignore_missing)
 
-def uniprot_to_gene_ids(uniprot_ids, ignore_missing=True):
-    if len(ID_TO_UNIPROT) == 0:
-        _load_uniprot_info()
-    if ignore_missing:
-        return [UNIPROT_TO_ID[x] for x in uniprot_ids if x in UNIPROT_TO_ID]
-    return [UNIPROT_TO_ID[x] for x in uniprot_ids]
 
+def uniprot_to_gene_ids(uniprot_ids, ignore_missing=True, species='human'):
+    return _get_table('uniprot_to_id', species).get_list(uniprot_ids, ignore_missing)
 
 
-def gene_ids_to_ensembl(gene_ids, ignore_missing=True):
-    if len(ID_TO_ENSEMBL) == 0:
-        _load_ensembl_info()
-    gene_ids = [int(x) for x in gene_ids]
-    if ignore_missing:
-        return [ID_TO_ENSEMBL[x] for x in gene_ids if x in ID_TO_ENSEMBL]
-    return [ID_TO_ENSEMBL[x] for x in gene_ids]
+def gene_ids_to_ensembl(gene_ids, ignore_missing=True, species='human'):
+    return _get_table('id_to_ensembl', species).get_list(gene_ids, ignore_missing)
 
 
-def ensembl_to_gene_ids(ensembl_ids, ignore_missing=True):
-    if len(ID_TO_ENSEMBL) == 0:
-        _load_ensembl_info()
-    if ignore_missing:
-        return [ENSEMBL_TO_ID[x] for x in ensembl_ids if x in ENSEMBL_TO_ID]
-    return [ENSEMBL_TO_ID[x] for x in ensembl_ids]
+def ensembl_to_gene_ids(ensembl_ids, ignore_missing=True, species='human'):
+    return _get_table('ensembl_to_id', species).get_list(ensembl_ids, ignore_missing)
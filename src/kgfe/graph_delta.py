@@ -0,0 +1,413 @@
+# Incremental updates of compiled graphs (see compiled_graph) and igraph graphs from delta files.
+#
+# A delta file has the same schema as the kg2 csv/tsv or jsonl dumps (optionally compressed), with nodes and edges in one file:
+#   node rows (id, name, category) add nodes,
+#   edge rows (subject, object, predicate) add edges,
+#   edge rows with an _op column of 'remove' remove the matching edges (all edges from subject to object if predicate is empty).
+# New nodes are appended after the existing nodes, so the indices of existing nodes don't change. Nodes are never removed (with
+# remove_unused_nodes, new nodes without edges are skipped, but existing nodes that lose all their edges are kept).
+
+import csv
+import json
+import os
+import shutil
+
+import numpy as np
+
+from . import compiled_graph, compressed_io, graph_index, pagerank
+from .graph_store import GraphStore
+from .progress import log
+
+REMOVE_OPS = ('remove', 'delete', 'retract')
+
+
+def _rows(filename):
+    "Iterates over the rows of a csv/tsv/jsonl file as dicts."
+    base_filename = compressed_io.base_name(filename)
+    with compressed_io.open_text(filename) as f:
+        if base_filename.endswith('.json') or base_filename.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            csv.field_size_limit(99999999)
+            delimiter = '\t' if 'tsv' in base_filename else ','
+            for row in csv.DictReader(f, dialect='unix', delimiter=delimiter):
+                yield row
+
+
+def read_delta(filename, edges_to_include=None):
+    """
+    Reads a delta file.
+
+    Args:
+        filename: csv, tsv or jsonl file (can be compressed, see compressed_io)
+        edges_to_include: set of edge types. Edges of other types are ignored.
+
+    Returns:
+        nodes: list of (_id, _name, category, identifier, source) for the added nodes
+        added_edges: list of (subject, object, predicate)
+        removed_edges: list of (subject, object, predicate), where predicate is None if all edges from subject to object are removed
+    """
+    nodes = []
+    added_edges = []
+    removed_edges = []
+    for row in _rows(filename):
+        op = (row.get('_op') or 'add').lower()
+        if row.get('subject'):
+            predicate = row.get('predicate') or None
+            if edges_to_include is not None and predicate is not None and predicate not in edges_to_include:
+                continue
+            if op in REMOVE_OPS:
+                removed_edges.append((row['subject'], row['object'], predicate))
+            elif predicate is None:
+                raise ValueError('Added edge {0} -> {1} has no predicate'.format(row['subject'], row['object']))
+            else:
+                added_edges.append((row['subject'], row['object'], predicate))
+        elif op in REMOVE_OPS:
+            raise ValueError('Removing nodes is not supported (node {0})'.format(row.get('id')))
+        else:
+            row_name = row['name'] if 'name' in row else row['id']
+            nodes.append((row['id'], row_name, row['category'], row['id'], row['category']))
+    return nodes, added_edges, removed_edges
+
+
+def delta_key(key, delta_filename, directed=False, remove_unused_nodes=False):
+    """
+    Returns the source_key of a compiled graph built from the compiled graph with the given key plus a delta file (see apply_delta for the options).
+    """
+    return {'base': key, 'delta': compiled_graph.source_key([delta_filename]), 'directed': directed, 'remove_unused_nodes': remove_unused_nodes}
+
+
+def _used_nodes(delta_nodes, added_edges, remove_unused_nodes):
+    "Returns the delta nodes that are added to the graph: all of them, or only those with an added edge if remove_unused_nodes is True."
+    if not remove_unused_nodes:
+        return delta_nodes
+    used = {str(subject) for subject, _, _ in added_edges} | {str(obj) for _, obj, _ in added_edges}
+    return [node for node in delta_nodes if str(node[0]) in used]
+
+
+def _splice_rows(indptr, arrays, rows):
+    """
+    Replaces some rows of CSR arrays.
+
+    Args:
+        indptr: row pointers (of length n_rows + 1)
+        arrays: list of arrays indexed by indptr
+        rows: dict of row: list of new arrays for the row (one for every array)
+
+    Returns:
+        new indptr, list of new arrays. The rows that aren't in rows are copied in bulk.
+    """
+    parts = [[] for _ in arrays]
+    length_changes = np.zeros(len(indptr) - 1, dtype=np.int64)
+    previous = 0
+    for row in sorted(rows):
+        start, end = int(indptr[row]), int(indptr[row + 1])
+        for array_parts, array, new_values in zip(parts, arrays, rows[row]):
+            array_parts.append(array[previous:start])
+            array_parts.append(np.asarray(new_values, dtype=array.dtype))
+        length_changes[row] = len(rows[row][0]) - (end - start)
+        previous = end
+    for array_parts, array in zip(parts, arrays):
+        array_parts.append(array[previous:])
+    indptr = indptr.copy()
+    indptr[1:] += np.cumsum(length_changes)
+    return indptr, [np.concatenate(array_parts) for array_parts in parts]
+
+
+def _append_strings(offsets, blob, strings):
+    "Returns the offsets and blob of a string table with strings appended."
+    encoded = [str(s).encode('utf-8') for s in strings]
+    lengths = np.fromiter((len(s) for s in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.concatenate([offsets, offsets[-1] + np.cumsum(lengths)])
+    blob = np.concatenate([blob, np.frombuffer(b''.join(encoded), dtype=np.uint8)])
+    return offsets, blob
+
+
+def _append_column(directory, output_directory, column, values):
+    "Writes the node column of directory, with values appended, to output_directory (keeping its encoding if possible)."
+    encoding = compiled_graph.column_encoding(directory, column)
+    if encoding == 'values' or compiled_graph.is_json_column(directory, column) or not all(isinstance(v, str) for v in values):
+        # typed columns (see compiled_graph.write_column) are re-encoded, since the new values can change their type
+        compiled_graph.write_column(output_directory, column, compiled_graph.read_column(directory, column) + list(values))
+        return
+    if encoding == 'codes':
+        codes = np.load(os.path.join(directory, column + '.codes.npy'), mmap_mode='r')
+        dictionary = compiled_graph.decode_strings(*compiled_graph.read_string_table(directory, column + '.dict'))
+        dictionary_index = {v: i for i, v in enumerate(dictionary)}
+        new_codes = np.fromiter((dictionary_index.setdefault(v, len(dictionary_index)) for v in values),
+                dtype=codes.dtype, count=len(values))
+        np.save(os.path.join(output_directory, column + '.codes.npy'), np.concatenate([codes, new_codes]))
+        compiled_graph.write_string_table(output_directory, column + '.dict', list(dictionary_index))
+        return
+    offsets, blob = compiled_graph.read_string_table(directory, column, mmap_mode='r')
+    offsets, blob = _append_strings(offsets, blob, values)
+    np.save(os.path.join(output_directory, column + '.offsets.npy'), offsets)
+    np.save(os.path.join(output_directory, column + '.blob.npy'), blob)
+
+
+def apply_delta(directory, delta_filename, output_directory=None, key=None, edges_to_include=None, directed=False, remove_unused_nodes=False, verbose=False):
+    """
+    Applies a delta file to a compiled graph, without re-parsing the source files of the compiled graph.
+
+    Only the delta file is parsed, and only the CSR rows of the nodes it touches are rebuilt; the other rows are copied in bulk into the new arrays (so writing the updated graph is still O(E), but the rest of the work depends on the size of the delta).
+    Nodes that are already in the graph and edges that already exist (same subject, object and predicate) are skipped.
+
+    Args:
+        directory: compiled graph directory
+        delta_filename: delta file (see read_delta)
+        output_directory: directory of the updated compiled graph. If None, the compiled graph is updated in place.
+        key: source_key stored with the updated graph. Defaults to delta_key(key of the original graph, delta_filename, directed, remove_unused_nodes).
+        edges_to_include: set of edge types. Edges of other types in the delta file are ignored.
+        directed: whether the graph is loaded as a directed graph. If False, removed and existing edges are matched in either direction (as in update_igraph on an undirected graph).
+        remove_unused_nodes: True if the new nodes without edges are to be skipped. Existing nodes are never removed, even if they lose all their edges.
+
+    Returns:
+        the directory of the updated compiled graph
+    """
+    store = GraphStore(directory)
+    meta = store.meta
+    if meta.get('edge_property_columns'):
+        raise ValueError('Delta files cannot be applied to compiled graphs with edge properties')
+    if output_directory is None:
+        output_directory = directory
+    if key is None:
+        key = delta_key(meta.get('key'), delta_filename, directed, remove_unused_nodes)
+    delta_nodes, added_edges, removed_edges = read_delta(delta_filename, edges_to_include)
+    log(verbose, 'Delta: %d nodes, %d added edges, %d removed edges', len(delta_nodes), len(added_edges), len(removed_edges))
+    n_old = store.n_nodes
+    node_types = dict(store.node_types)
+    category_index = dict(store.category_index)
+    edge_types = dict(store.edge_types)
+    edge_type_index = {v: k for k, v in edge_types.items()}
+
+    # new nodes are appended
+    new_node_index = {}
+    new_nodes = []
+    for node in _used_nodes(delta_nodes, added_edges, remove_unused_nodes):
+        name = str(node[0])
+        if name in new_node_index:
+            continue
+        try:
+            store.find(name)
+            continue
+        except ValueError:
+            pass
+        if node[2] not in category_index:
+            code = max(node_types, default=0) + 1
+            node_types[code] = node[2]
+            category_index[node[2]] = code
+        new_node_index[name] = n_old + len(new_nodes)
+        new_nodes.append(node)
+    n_new = len(new_nodes)
+    n_nodes = n_old + n_new
+
+    def node_index(name):
+        if name in new_node_index:
+            return new_node_index[name]
+        return store.find(name)
+
+    indptr = np.concatenate([store.indptr, np.full(n_new, store.indptr[-1], dtype=np.int64)])
+    in_indptr = np.concatenate([store.in_indptr, np.full(n_new, store.in_indptr[-1], dtype=np.int64)])
+    indices = store.indices
+    edge_type = store.edge_type
+    in_indices = store.in_indices
+    # removed positions in the CSR and reversed CSR, and added (target, type) and sources of every affected row
+    out_removed = set()
+    in_removed = set()
+    out_added = {}
+    in_added = {}
+
+    def directions(node1, node2):
+        if directed or node1 == node2:
+            return [(node1, node2)]
+        return [(node1, node2), (node2, node1)]
+
+    def edge_positions(node1, node2, code):
+        "Returns the positions of the remaining edges from node1 to node2 (with type code, unless code is None) in the CSR."
+        start, end = indptr[node1], indptr[node1 + 1]
+        is_match = indices[start:end] == node2
+        if code is not None:
+            is_match &= edge_type[start:end] == code
+        return [p for p in (start + np.flatnonzero(is_match)).tolist() if p not in out_removed]
+
+    # removed edges
+    for subject, obj, predicate in removed_edges:
+        try:
+            node1 = node_index(str(subject))
+            node2 = node_index(str(obj))
+        except ValueError:
+            continue
+        code = None if predicate is None else edge_type_index.get(predicate, -1)
+        for source, target in directions(node1, node2):
+            positions = edge_positions(source, target, code)
+            if not positions:
+                continue
+            out_removed.update(positions)
+            # the reversed CSR doesn't store edge types, so any len(positions) entries for this node pair can be removed
+            start, end = in_indptr[target], in_indptr[target + 1]
+            in_positions = [p for p in (start + np.flatnonzero(in_indices[start:end] == source)).tolist() if p not in in_removed]
+            in_removed.update(in_positions[:len(positions)])
+
+    # added edges
+    added = set()
+    for subject, obj, predicate in added_edges:
+        try:
+            node1 = node_index(str(subject))
+            node2 = node_index(str(obj))
+        except ValueError:
+            raise ValueError('Edge {0} -> {1} refers to a node that is neither in the graph nor in the delta file'.format(subject, obj))
+        if predicate not in edge_type_index:
+            code = max(edge_types, default=0) + 1
+            edge_types[code] = predicate
+            edge_type_index[predicate] = code
+        code = edge_type_index[predicate]
+        if any((source, target, code) in added or edge_positions(source, target, code) for source, target in directions(node1, node2)):
+            continue
+        added.add((node1, node2, code))
+        out_added.setdefault(node1, []).append((node2, code))
+        in_added.setdefault(node2, []).append(node1)
+
+    # only the affected rows are rebuilt, with the new edges at the end of their row
+    out_rows = {}
+    for row in set(np.searchsorted(indptr, sorted(out_removed), side='right') - 1) | set(out_added):
+        start, end = int(indptr[row]), int(indptr[row + 1])
+        keep = [p for p in range(start, end) if p not in out_removed]
+        row_added = out_added.get(row, [])
+        out_rows[row] = [np.concatenate([indices[keep], np.array([t for t, _ in row_added], dtype=indices.dtype)]),
+                np.concatenate([edge_type[keep], np.array([c for _, c in row_added], dtype=edge_type.dtype)])]
+    in_rows = {}
+    for row in set(np.searchsorted(in_indptr, sorted(in_removed), side='right') - 1) | set(in_added):
+        start, end = int(in_indptr[row]), int(in_indptr[row + 1])
+        keep = [p for p in range(start, end) if p not in in_removed]
+        in_rows[row] = [np.concatenate([in_indices[keep], np.array(in_added.get(row, []), dtype=in_indices.dtype)])]
+    indptr, (indices, edge_type) = _splice_rows(indptr, [indices, edge_type], out_rows)
+    in_indptr, (in_indices,) = _splice_rows(in_indptr, [in_indices], in_rows)
+
+    # node arrays
+    category = np.concatenate([store.category_codes,
+        np.array([category_index[n[2]] for n in new_nodes], dtype=store.category_codes.dtype)])
+    new_names = [str(n[0]) for n in new_nodes]
+    name_order = np.asarray(store.name_order)
+    if new_nodes:
+        new_order = sorted(range(n_new), key=lambda i: new_names[i].encode('utf-8'))
+        positions = [store._name_position(new_names[i]) for i in new_order]
+        name_order = np.insert(name_order, positions, np.array(new_order, dtype=name_order.dtype) + n_old)
+    columns = {
+            'name': new_names,
+            'feature_name': [n[1] for n in new_nodes],
+            'identifier': [n[3] for n in new_nodes],
+            'source': [n[4] for n in new_nodes],
+    }
+
+    tmp_directory = output_directory + '.tmp'
+    if os.path.exists(tmp_directory):
+        shutil.rmtree(tmp_directory)
+    os.makedirs(tmp_directory)
+    arrays = {'indptr': indptr, 'indices': indices, 'edge_type': edge_type, 'in_indptr': in_indptr,
+            'in_indices': in_indices, 'category': category, 'name_order': name_order}
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_directory, name + '.npy'), array)
+    for column, values in columns.items():
+        _append_column(directory, tmp_directory, column, values)
+    meta = dict(meta)
+    meta['n_nodes'] = n_nodes
+    meta['n_edges'] = int(len(indices))
+    meta['node_types'] = [[int(k), v] for k, v in node_types.items()]
+    meta['edge_types'] = [[int(k), v] for k, v in edge_types.items()]
+    meta['key'] = key
+    with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    del store
+    if os.path.exists(output_directory):
+        shutil.rmtree(output_directory)
+    os.replace(tmp_directory, output_directory)
+    return output_directory
+
+
+def update_igraph(graph, delta_filename, edges_to_include=None, remove_unused_nodes=False):
+    """
+    Applies a delta file in place to an igraph.Graph created by kg2_loader.load_kg2_igraph. New vertices are appended, so existing vertex indices don't change.
+
+    In an undirected graph, removed edges are matched in either direction.
+    If remove_unused_nodes is True, the new nodes without edges are skipped (existing vertices are never removed).
+    The cached graph_index and global pagerank of the graph are discarded.
+
+    Returns:
+        the graph
+    """
+    delta_nodes, added_edges, removed_edges = read_delta(delta_filename, edges_to_include)
+    has_type = 'type' in graph.es.attributes()
+
+    def vertex_index(name):
+        try:
+            return graph.vs.find(name=name).index
+        except (ValueError, KeyError):
+            return None
+
+    new_nodes = []
+    seen = set()
+    for node in _used_nodes(delta_nodes, added_edges, remove_unused_nodes):
+        name = str(node[0])
+        if name in seen or vertex_index(name) is not None:
+            continue
+        seen.add(name)
+        new_nodes.append(node)
+    if new_nodes:
+        attributes = {'name': [str(n[0]) for n in new_nodes], 'feature_name': [n[1] for n in new_nodes],
+                'category': [n[2] for n in new_nodes], 'identifier': [n[3] for n in new_nodes]}
+        if 'source' in graph.vs.attributes():
+            attributes['source'] = [n[4] for n in new_nodes]
+        graph.add_vertices(len(new_nodes), attributes=attributes)
+
+    mode = 'out' if graph.is_directed() else 'all'
+
+    def matching_edges(node1, node2, predicate):
+        result = []
+        for e in set(graph.incident(node1, mode=mode)):
+            edge = graph.es[e]
+            other = edge.target if edge.source == node1 else edge.source
+            if other == node2 and (predicate is None or not has_type or edge['type'] == predicate):
+                result.append(e)
+        return result
+
+    removed = set()
+    for subject, obj, predicate in removed_edges:
+        node1 = vertex_index(str(subject))
+        node2 = vertex_index(str(obj))
+        if node1 is None or node2 is None:
+            continue
+        removed.update(matching_edges(node1, node2, predicate))
+    if removed:
+        graph.delete_edges(sorted(removed))
+
+    pairs = []
+    types = []
+    added = set()
+    for subject, obj, predicate in added_edges:
+        node1 = vertex_index(str(subject))
+        node2 = vertex_index(str(obj))
+        if node1 is None or node2 is None:
+            raise ValueError('Edge {0} -> {1} refers to a node that is neither in the graph nor in the delta file'.format(subject, obj))
+        if (node1, node2, predicate) in added or (mode == 'all' and (node2, node1, predicate) in added):
+            continue
+        if matching_edges(node1, node2, predicate if has_type else None):
+            continue
+        added.add((node1, node2, predicate))
+        pairs.append((node1, node2))
+        types.append(predicate)
+    if pairs:
+        attributes = {}
+        if has_type:
+            attributes['type'] = types
+        if 'source' in graph.es.attributes():
+            # the node ids of the ends of dict-format edges (as in compiled_graph.load_compiled_igraph)
+            names = graph.vs['name']
+            attributes['source'] = [names[node1] for node1, _ in pairs]
+            attributes['target'] = [names[node2] for _, node2 in pairs]
+        graph.add_edges(pairs, attributes=attributes or None)
+    # the edge count can be unchanged, so the cached index and pagerank wouldn't be rebuilt
+    graph_index.invalidate(graph)
+    pagerank.invalidate(graph)
+    return graph
@@ -0,0 +1,211 @@
+# Lookup index of an igraph.Graph: node names, node ids/identifiers per category, nodes per category, degrees and the random walk
+# transition matrix and adjacency arrays.
+#
+# The index is built on first use with get_graph_index(graph), and kept until the graph is garbage collected,
+# so the lookup functions in graph_info don't have to scan every vertex on each call.
+# It is rebuilt if the number of vertices or edges of the graph changes; call invalidate(graph) after changing vertex attributes in place.
+
+import weakref
+
+import numpy as np
+import pandas as pd
+
+# dict of id(graph): GraphIndex
+_indices = {}
+
+
+def vertex_column(graph, column):
+    """
+    Returns the values of a vertex attribute for all vertices, reading it from the property store for graphs loaded with lazy_properties=True.
+    Returns None if the graph has no such attribute.
+    """
+    if column in graph.vs.attributes():
+        return graph.vs[column]
+    from .property_store import get_property_store, lazy_node_columns
+    if column in lazy_node_columns(graph):
+        store = get_property_store(graph)
+        return store.node_values(column, store.find_all(graph.vs['name']))
+    return None
+
+
+def _group(values):
+    "Returns a dict of value: sorted array of the positions of that value."
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=False)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {value: order[bounds[i]:bounds[i+1]] for i, value in enumerate(uniques)}
+
+
+class GraphIndex:
+    """
+    Lookup tables of a graph. Columns and mappings are computed when they are first requested.
+
+    Attributes:
+        names: list of vertex names
+        name_to_index: dict of vertex name: vertex index
+        degree: array of vertex degrees (in_degree and out_degree are also set for directed graphs)
+    """
+
+    def __init__(self, graph):
+        self.signature = (graph.vcount(), graph.ecount())
+        self._graph = weakref.ref(graph)
+        self.names = graph.vs['name'] if 'name' in graph.vs.attributes() else [str(i) for i in range(graph.vcount())]
+        self.name_to_index = {name: i for i, name in enumerate(self.names)}
+        self.degree = np.array(graph.degree(), dtype=np.int64)
+        if graph.is_directed():
+            self.in_degree = np.array(graph.indegree(), dtype=np.int64)
+            self.out_degree = np.array(graph.outdegree(), dtype=np.int64)
+        self._columns = {}
+        self._groups = {}
+        self._mappings = {}
+        self._name_index = None
+        self._transition = None
+        self._adjacency = None
+
+    def column(self, column):
+        "Returns the values of a vertex attribute (None if the graph doesn't have it)."
+        if column not in self._columns:
+            self._columns[column] = vertex_column(self._graph(), column)
+        return self._columns[column]
+
+    def _required_column(self, column):
+        "Returns the values of a vertex attribute, raising a KeyError if the graph doesn't have it."
+        values = self.column(column)
+        if values is None:
+            raise KeyError('The graph has no vertex attribute {0!r}'.format(column))
+        return values
+
+    def nodes_in(self, value, column='category'):
+        "Returns the sorted array of vertex indices whose attribute column is equal to value."
+        if column not in self._groups:
+            values = self.column(column)
+            self._groups[column] = {} if values is None else _group(values)
+        return self._groups[column].get(value, np.zeros(0, dtype=np.int64))
+
+    def mapping(self, key_column, value_column, category=None, source=None):
+        """
+        Returns a dict of key_column value: value_column value for the vertices in the category (or all vertices) and source (or all sources).
+        value_column can be 'index' for vertex indices. If several vertices have the same key, the last one is used.
+        Raises a KeyError if the graph doesn't have one of the columns.
+        """
+        cache_key = (key_column, value_column, category, source)
+        if cache_key not in self._mappings:
+            nodes = np.arange(len(self.names)) if category is None else self.nodes_in(category)
+            if source is not None:
+                nodes = np.intersect1d(nodes, self.nodes_in(source, 'source'), assume_unique=True)
+            keys = self._required_column(key_column)
+            if value_column == 'index':
+                values = nodes.tolist()
+            elif value_column == 'name':
+                values = [self.names[i] for i in nodes.tolist()]
+            else:
+                column = self._required_column(value_column)
+                values = [column[i] for i in nodes.tolist()]
+            self._mappings[cache_key] = dict(zip([keys[i] for i in nodes.tolist()], values))
+        return self._mappings[cache_key]
+
+    def _walk_edges(self):
+        "Returns the sources and targets of the edges followed by a random walk (both directions of undirected edges)."
+        graph = self._graph()
+        edges = np.array(graph.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        sources, targets = edges[:, 0], edges[:, 1]
+        if not graph.is_directed():
+            sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+        return sources, targets
+
+    def adjacency(self):
+        """
+        Returns the out-neighbors of every vertex (the neighbors in undirected graphs) as a list with one pair of CSR arrays
+        (indptr, indices), in the format of graph_store.GraphStore._adjacency. Parallel edges appear several times.
+        """
+        if self._adjacency is None:
+            sources, targets = self._walk_edges()
+            order = np.argsort(sources, kind='stable')
+            indptr = np.zeros(len(self.names) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources, minlength=len(self.names)), out=indptr[1:])
+            self._adjacency = [(indptr, targets[order])]
+        return self._adjacency
+
+    def transition_matrix(self):
+        """
+        Returns the random walk transition matrix of the graph, as used by pagerank: a scipy.sparse CSR matrix whose entry (j, i)
+        is the number of edges from i to j divided by the out-degree of i (edges are followed in both directions in undirected graphs),
+        so that its columns sum to 1, and a boolean array of the dangling vertices (without out-edges), whose columns are 0.
+        """
+        if self._transition is None:
+            from .graph_store import transition_matrix
+            self._transition = transition_matrix(*self._walk_edges(), len(self.names))
+        return self._transition
+
+    def find_all(self, names):
+        "Returns the vertex indices of the given names. Raises a KeyError if a name isn't in the graph."
+        return [self.name_to_index[name] for name in names]
+
+    def lookup(self, names):
+        "Returns an int64 array of the vertex indices of the given names (any iterable, array or pandas Series), with -1 for names that aren't in the graph."
+        names = name_array(names)
+        if self._name_index is None:
+            self._name_index = pd.Index(self.names, dtype=object)
+        if self._name_index.is_unique:
+            return self._name_index.get_indexer(names).astype(np.int64)
+        return np.array([self.name_to_index.get(name, -1) for name in names.tolist()], dtype=np.int64)
+
+
+def name_array(names):
+    "Returns node names (a list, set, generator, dict view, array or pandas Series) as a 1-d object array."
+    if isinstance(names, (np.ndarray, pd.Series, pd.Index)):
+        return np.asarray(names, dtype=object).ravel()
+    if isinstance(names, str):
+        names = [names]
+    names = list(names)
+    # assigned element by element, so that tuples and other sequences stay single names
+    array = np.empty(len(names), dtype=object)
+    array[:] = names
+    return array
+
+
+def get_graph_index(graph):
+    "Returns the GraphIndex of a graph, building it if needed."
+    key = id(graph)
+    index = _indices.get(key)
+    if index is not None and index._graph() is graph and index.signature == (graph.vcount(), graph.ecount()):
+        return index
+    index = GraphIndex(graph)
+    if key not in _indices:
+        weakref.finalize(graph, _indices.pop, key, None)
+    _indices[key] = index
+    return index
+
+
+def resolve_nodes(graph, names, missing='raise'):
+    """
+    Converts node names to vertex indices in one batch, instead of calling graph.vs.find(name=...) for every name.
+
+    Args:
+        graph: an igraph.Graph
+        names: node names (a list, set or other iterable, array or pandas Series)
+        missing: what to do with names that aren't in the graph - 'raise' (ValueError), 'drop' (skip them), or 'report' (skip them, and also return them)
+
+    Returns:
+        int64 array of vertex indices, in the order of names. If missing is 'report', returns (indices, list of missing names).
+    """
+    if missing not in ('raise', 'drop', 'report'):
+        raise ValueError('missing must be one of "raise", "drop" or "report"')
+    names = name_array(names)
+    indices = get_graph_index(graph).lookup(names)
+    found = indices >= 0
+    if found.all():
+        return (indices, []) if missing == 'report' else indices
+    missing_names = names[~found].tolist()
+    if missing == 'raise':
+        raise ValueError('{0} node(s) not in the graph: {1}'.format(len(missing_names), ', '.join(str(n) for n in missing_names[:10])))
+    if missing == 'report':
+        return indices[found], missing_names
+    return indices[found]
+
+
+def invalidate(graph):
+    "Discards the cached index of a graph."
+    index = _indices.get(id(graph))
+    if index is not None and index._graph() is graph:
+        del _indices[id(graph)]
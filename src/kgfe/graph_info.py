@@ -1,93 +1,384 @@
 # TODO: get info on available graphs
+import json
 import os
 import random
+import shutil
 import zipfile
 
 import igraph as ig
 import numpy as np
 import pandas as pd
 
+from .graph_index import get_graph_index, resolve_nodes
+from .progress import log
+
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 DATA_PATH = os.path.join(PATH, 'processed_graphs')
 MSIGDB_PATH = os.path.join(PATH, 'raw_graphs/msigdb_v2023.1.Hs_json_files_to_download_locally.zip')
+MSIGDB_CACHE_VERSION = 1
 
 def get_available_graphs():
     files = os.listdir(DATA_PATH)
     return files
 
-def get_available_msigdb():
-    f = zipfile.ZipFile(MSIGDB_PATH)
+def get_available_msigdb(zip_filename=MSIGDB_PATH):
+    f = zipfile.ZipFile(zip_filename)
     files = f.namelist()
     f.close()
     return files
 
 
-def load_graph(filename):
+# number of rows per chunk when filtering csv files
+CSV_CHUNKSIZE = 500000
+# rows per parquet row group; smaller groups can be skipped more precisely by the filters, but compress less well
+PARQUET_ROW_GROUP_SIZE = 100000
+
+# node id columns, which can hold numeric and string ids; they are always read as strings, so that the inferred type doesn't
+# depend on the rows that are read (e.g. by a filtered load)
+ID_COLUMNS = {'subject_id': str, 'object_id': str}
+
+# load_graph filter arguments and the columns they apply to
+FILTER_COLUMNS = {
+    'predicates': 'predicate',
+    'subject_categories': 'subject_category',
+    'object_categories': 'object_category',
+    'knowledge_sources': 'Knowledge_Source',
+}
+
+
+def _graph_path(filename):
     files = os.listdir(DATA_PATH)
     if filename not in files:
         # if filename not in files, try opening it as a path
         if not os.path.exists(filename):
             raise FileNotFoundError()
-    else:
-        filename = os.path.join(DATA_PATH, filename)
-    if 'tsv' in filename:
-        df = pd.read_csv(filename, sep='\t')
-    else:
-        df = pd.read_csv(filename)
+        return filename
+    return os.path.join(DATA_PATH, filename)
+
+
+def parquet_filename(filename):
+    "Returns the name of the parquet version of a csv/tsv graph file (e.g. reactome_genes_chems.csv.gz -> reactome_genes_chems.parquet)."
+    base = filename
+    for extension in ('.gz', '.csv', '.tsv', '.txt'):
+        if base.endswith(extension):
+            base = base[:-len(extension)]
+    return base + '.parquet'
+
+
+def _source_stat(filename):
+    "Returns the size and modification time of a file, which convert_to_parquet stores in the parquet metadata."
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def fresh_parquet(filename):
+    """
+    Returns the name of the parquet version of a csv/tsv graph file (see parquet_filename) if it exists, pyarrow is installed and it
+    was converted by convert_to_parquet from the current version of the file (same size and modification time), or None otherwise.
+    """
+    parquet = parquet_filename(filename)
+    if not os.path.exists(parquet) or not _has_pyarrow():
+        return None
+    import pyarrow.parquet as pq
+    try:
+        metadata = pq.read_metadata(parquet).metadata or {}
+    except (OSError, ValueError):
+        return None
+    source = metadata.get(b'kgfe_source')
+    if source is None or json.loads(source) != _source_stat(filename):
+        return None
+    return parquet
+
+
+def _has_pyarrow():
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        return False
+    return True
+
+
+def _graph_filters(filters):
+    "Converts the load_graph filter arguments to a dict of column: list of allowed values."
+    column_filters = {}
+    for arg, column in FILTER_COLUMNS.items():
+        values = filters.get(arg)
+        if values is None:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        column_filters[column] = list(values)
+    return column_filters
+
+
+def _read_graph_csv(filename, columns=None, column_filters=None):
+    """
+    Reads a csv or tsv edge table. If there are filters, the file is read in chunks of CSV_CHUNKSIZE rows, and only the matching rows of each chunk are kept.
+    The ID_COLUMNS are read as strings.
+    """
+    sep = '\t' if 'tsv' in filename else ','
+    usecols = None
+    if columns is not None:
+        usecols = list(columns) + [c for c in column_filters if c not in columns]
+    if not column_filters:
+        return pd.read_csv(filename, sep=sep, usecols=usecols, dtype=ID_COLUMNS)
+    chunks = []
+    for chunk in pd.read_csv(filename, sep=sep, usecols=usecols, dtype=ID_COLUMNS, chunksize=CSV_CHUNKSIZE):
+        mask = np.ones(len(chunk), dtype=bool)
+        for column, values in column_filters.items():
+            mask &= chunk[column].isin(values).to_numpy()
+        chunks.append(chunk[mask])
+    df = pd.concat(chunks, ignore_index=True)
+    if columns is not None:
+        df = df[list(columns)]
     return df
 
 
+def _read_graph_parquet(filename, columns=None, column_filters=None):
+    """
+    Reads a parquet edge table. The filters are passed to pyarrow, which skips the row groups whose statistics don't match.
+    """
+    import pyarrow.parquet as pq
+    filters = None
+    if column_filters:
+        filters = [(column, 'in', values) for column, values in column_filters.items()]
+    table = pq.read_table(filename, columns=list(columns) if columns is not None else None, filters=filters)
+    return table.to_pandas()
+
+
+def load_graph(filename, columns=None, predicates=None, subject_categories=None, object_categories=None, knowledge_sources=None,
+        use_parquet=False):
+    """
+    Loads an edge table from processed_graphs (or a path) as a pandas DataFrame.
+
+    If use_parquet is True and an up-to-date parquet version of the file exists (see convert_to_parquet and fresh_parquet), it is read instead of the csv, and the filters are pushed down to the parquet reader.
+    Otherwise, the csv is read in chunks and filtered.
+
+    Args:
+        filename: name of a file in processed_graphs, or a path (csv, tsv, or parquet)
+        columns: list of columns to load (default: all columns)
+        predicates, subject_categories, object_categories, knowledge_sources: values (a string or list) of the predicate, subject_category, object_category and Knowledge_Source columns to keep (default: all)
+        use_parquet: whether to use the parquet version of the file if there is one. Its rows may be in a different order (see convert_to_parquet), and its mixed-type columns are strings.
+
+    Returns:
+        DataFrame of edges
+    """
+    filename = _graph_path(filename)
+    column_filters = _graph_filters({'predicates': predicates, 'subject_categories': subject_categories,
+        'object_categories': object_categories, 'knowledge_sources': knowledge_sources})
+    if filename.endswith('.parquet'):
+        return _read_graph_parquet(filename, columns, column_filters)
+    parquet = fresh_parquet(filename) if use_parquet else None
+    if parquet is not None:
+        return _read_graph_parquet(parquet, columns, column_filters)
+    return _read_graph_csv(filename, columns, column_filters)
+
+
+def convert_to_parquet(filename, output_filename=None, row_group_size=PARQUET_ROW_GROUP_SIZE, sort_rows=False):
+    """
+    Converts a csv/tsv edge table to parquet (requires pyarrow, e.g. pip install kg-feature-engineering[parquet]).
+
+    Args:
+        filename: name of a file in processed_graphs, or a path
+        output_filename: default: parquet_filename(filename), which load_graph reads with use_parquet=True while the csv is unchanged
+        row_group_size: number of rows per row group
+        sort_rows: if True, the rows are sorted by predicate, categories and knowledge source, so that filtering on them only has to decode a few row groups. This changes the row order (and so the vertex order of df_to_graph) compared to the csv.
+
+    Returns:
+        output filename
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('convert_to_parquet requires pyarrow (pip install pyarrow)')
+    filename = _graph_path(filename)
+    if output_filename is None:
+        output_filename = parquet_filename(filename)
+    df = _read_graph_csv(filename)
+    sort_columns = [c for c in ('predicate', 'subject_category', 'object_category', 'Knowledge_Source') if c in df.columns]
+    if sort_rows and sort_columns:
+        df = df.sort_values(sort_columns, kind='stable', ignore_index=True)
+    # columns with mixed types (e.g. numeric and string ids) are stored as strings, since parquet columns have a single type
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(lambda x: x if x is None or isinstance(x, str) or (isinstance(x, float) and np.isnan(x)) else str(x))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # the version of the csv that was converted (see fresh_parquet)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, kgfe_source=json.dumps(_source_stat(filename))))
+    pq.write_table(table, output_filename, row_group_size=row_group_size)
+    return output_filename
+
+
 def _load_msigdb(data, object_category='BiologicalProcess', object_id_prefix='MSigDB',
         predicate='participates_in'):
     """
-    Returns a pandas edge table and a graph
-    """
-    import gene_names
-    new_entries = []
-    for k, v in data.items():
-        gene_set_name = k
-        source = v['exactSource']
-        ref = v['pmid']
-        genes = v['geneSymbols']
-        try:
-            gene_ids = gene_names.get_ids(genes)
-        except:
-            gene_ids = []
-            for g in genes:
-                try:
-                    gene_id = gene_names.get_ids([g])
-                    gene_ids.append(gene_id)
-                except:
-                    continue
-        for gene_id, symbol in zip(gene_ids, genes):
-            entry = {}
-            entry['subject_category'] = 'Gene'
-            entry['subject_id_prefix'] = 'NCBIGene'
-            entry['subject_id'] = gene_id
-            entry['subject_name'] = symbol
-            entry['predicate'] = predicate
-            entry['object_category'] = object_category
-            entry['object_id_prefix'] = object_id_prefix
-            entry['object_id'] = gene_set_name
-            entry['object_name'] = gene_set_name
-            entry['Primary_Knowledge_Source'] = source
-            entry['Knowledge_Source'] = v['collection']
-            entry['publications'] = ref
-            new_entries.append(entry)
-    return pd.DataFrame(new_entries)
-
-
-def load_msigdb(name):
-    """Load an msigdb graph as a dataframe. Input name is one of the filenames returned by get_available_msigdb."""
-    import json
-    f = zipfile.ZipFile(MSIGDB_PATH)
-    m = f.getinfo(name)
-    json_file = f.open(m)
-    data = json.load(json_file)
+    Returns a pandas edge table (gene -> gene set) for a parsed MSigDB json collection. Gene symbols that aren't found are skipped.
+    """
+    from . import gene_names
+    gene_sets = list(data.values())
+    counts = [len(v['geneSymbols']) for v in gene_sets]
+    symbols = [g for v in gene_sets for g in v['geneSymbols']]
+    # one lookup for all the symbols of the collection
+    gene_ids, found = gene_names.convert_array(symbols, 'symbol', 'ncbi')
+    set_index = np.repeat(np.arange(len(gene_sets), dtype=np.int64), counts)[found]
+
+    def gene_set_column(values):
+        return np.array(values, dtype=object)[set_index]
+    n_rows = len(set_index)
+    gene_set_names = gene_set_column(list(data.keys()))
+    return pd.DataFrame({
+        'subject_category': ['Gene']*n_rows,
+        'subject_id_prefix': ['NCBIGene']*n_rows,
+        'subject_id': gene_ids[found],
+        'subject_name': np.array(symbols, dtype=object)[found],
+        'predicate': [predicate]*n_rows,
+        'object_category': [object_category]*n_rows,
+        'object_id_prefix': [object_id_prefix]*n_rows,
+        'object_id': gene_set_names,
+        'object_name': gene_set_names,
+        'Primary_Knowledge_Source': gene_set_column([v['exactSource'] for v in gene_sets]),
+        'Knowledge_Source': gene_set_column([v['collection'] for v in gene_sets]),
+        'publications': gene_set_column([v['pmid'] for v in gene_sets]),
+    })
+
+
+def _msigdb_cache_key(zip_filename, name):
+    "Returns the cache key of a collection: the zip member's crc32 and size, and the gene names file used to map the symbols."
+    from . import compiled_graph, gene_names
+    with zipfile.ZipFile(zip_filename) as f:
+        info = f.getinfo(name)
+    gene_info = gene_names._data_file(gene_names.SPECIES['human']['gene_info'])
+    return {'version': MSIGDB_CACHE_VERSION, 'member': name, 'crc': info.CRC, 'size': info.file_size,
+            'gene_info': compiled_graph.source_key([gene_info])}
+
+
+def _msigdb_cache_dir(key):
+    from . import compiled_graph
+    return compiled_graph.cache_path(key, os.path.join(compiled_graph.default_cache_dir(), 'msigdb'))
+
+
+def _read_msigdb_cache(directory, key):
+    from . import compiled_graph
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if json.dumps(meta.get('key'), sort_keys=True) != json.dumps(key, sort_keys=True):
+        return None
+    return pd.DataFrame({column: compiled_graph.read_column(directory, column) for column in meta['columns']})
+
+
+def _write_msigdb_cache(directory, key, df):
+    "Writes an msigdb edge table as property columns (see compiled_graph.write_column)."
+    from . import compiled_graph
+    tmp_directory = directory + '.tmp{0}'.format(os.getpid())
+    try:
+        os.makedirs(tmp_directory, exist_ok=True)
+        for column in df.columns:
+            compiled_graph.write_column(tmp_directory, column, df[column].tolist())
+        with open(os.path.join(tmp_directory, 'meta.json'), 'w') as f:
+            json.dump({'key': key, 'columns': list(df.columns), 'n_rows': len(df)}, f)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        os.replace(tmp_directory, directory)
+    except OSError:
+        # the cache isn't writable, or another process wrote it first
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+
+
+def load_msigdb(name, zip_filename=MSIGDB_PATH, use_cache=True):
+    """
+    Load an msigdb graph as a dataframe. Input name is one of the filenames returned by get_available_msigdb.
+
+    The edge table is cached in the kgfe cache directory, keyed by the checksum of the collection in the zip file.
+    """
+    key = _msigdb_cache_key(zip_filename, name)
+    directory = _msigdb_cache_dir(key)
+    if use_cache:
+        df = _read_msigdb_cache(directory, key)
+        if df is not None:
+            return df
+    with zipfile.ZipFile(zip_filename) as f:
+        with f.open(name) as json_file:
+            data = json.load(json_file)
     df = _load_msigdb(data)
-    f.close()
+    if use_cache:
+        _write_msigdb_cache(directory, key, df)
     return df
 
+
+def _load_msigdb_task(args):
+    name, zip_filename, use_cache = args
+    return name, load_msigdb(name, zip_filename, use_cache)
+
+
+def load_msigdb_collections(names=None, zip_filename=MSIGDB_PATH, n_processes=None, use_cache=True, verbose=False):
+    """
+    Loads several msigdb collections, parsing the ones that aren't cached in parallel.
+
+    Args:
+        names: list of filenames in the zip file (default: all json files)
+        n_processes: number of worker processes (default: os.cpu_count())
+
+    Returns:
+        dict of name: DataFrame
+    """
+    from . import gene_names
+    if names is None:
+        names = [n for n in get_available_msigdb(zip_filename) if n.endswith('.json')]
+    results = {}
+    to_parse = []
+    for name in names:
+        key = _msigdb_cache_key(zip_filename, name)
+        df = _read_msigdb_cache(_msigdb_cache_dir(key), key) if use_cache else None
+        if df is None:
+            to_parse.append(name)
+        else:
+            results[name] = df
+    log(verbose, 'Loaded %d cached msigdb collections, parsing %d', len(results), len(to_parse))
+    if n_processes is None:
+        n_processes = os.cpu_count()
+    tasks = [(name, zip_filename, use_cache) for name in to_parse]
+    if n_processes > 1 and len(tasks) > 1:
+        import multiprocessing as mp
+        # build the gene name index once, so that the workers only memory-map it
+        gene_names._get_table('symbol_to_id')
+        with mp.Pool(min(n_processes, len(tasks))) as pool:
+            parsed = pool.map(_load_msigdb_task, tasks)
+    else:
+        parsed = [_load_msigdb_task(task) for task in tasks]
+    results.update(parsed)
+    return {name: results[name] for name in names}
+
+def _df_nodes(df, name_attribute='feature_name'):
+    """
+    Factorizes the subject and object ids of an edge table.
+
+    Returns:
+        codes: array of shape (len(df), 2) of node indices for the subject and object of every row
+        full_ids: list of full node ids (prefix::id), in order of first appearance
+        nodes: DataFrame of node attributes ('id', 'id_prefix', name_attribute, 'category'), aligned with full_ids. If a node appears in several rows, the attributes are taken from the last row.
+    """
+    def interleave(subject_column, object_column):
+        # row-major order: subject of row 0, object of row 0, subject of row 1, ...
+        return np.column_stack([df[subject_column].to_numpy(dtype=object),
+            df[object_column].to_numpy(dtype=object)]).ravel()
+    full_ids = interleave('subject_id_full', 'object_id_full')
+    codes, uniques = pd.factorize(full_ids, use_na_sentinel=False)
+    # position of the last occurrence of every node
+    _, last_reversed = np.unique(codes[::-1], return_index=True)
+    last = len(codes) - 1 - last_reversed
+    nodes = pd.DataFrame({
+        'id': interleave('subject_id', 'object_id')[last],
+        'id_prefix': interleave('subject_id_prefix', 'object_id_prefix')[last],
+        name_attribute: interleave('subject_name', 'object_name')[last],
+        'category': interleave('subject_category', 'object_category')[last],
+    })
+    return codes.reshape(-1, 2), list(uniques), nodes
+
+
 def df_to_networkx(df, directed=False):
     """
     Converts a panda dataframe to a networkx Graph (or DiGraph), with node and edge attributes.
@@ -104,20 +395,8 @@ def df_to_networkx(df, directed=False):
                        'Knowledge_Source',
                        'publications'],
             create_using=create_using)
-    node_attributes = {}
-    for _, row in df.iterrows():
-        if row['subject_id'] not in node_attributes:
-            node_attributes[row['subject_id_full']] = {
-                    'id': row['subject_id'],
-                    'id_prefix': row['subject_id_prefix'],
-                    'name': row['subject_name'],
-                    'category': row['subject_category']}
-        if row['object_id'] not in node_attributes:
-            node_attributes[row['object_id_full']] = {
-                    'id': row['object_id'],
-                    'id_prefix': row['object_id_prefix'],
-                    'name': row['object_name'],
-                    'category': row['object_category']}
+    _, full_ids, nodes = _df_nodes(df, 'name')
+    node_attributes = dict(zip(full_ids, nodes.to_dict(orient='records')))
     nx.set_node_attributes(graph, node_attributes)
     return graph
 
@@ -127,48 +406,31 @@ def df_to_graph(df, directed=False):
     """
     df['subject_id_full'] = df['subject_id_prefix'] + '::' + df['subject_id'].astype(str)
     df['object_id_full'] = df['object_id_prefix'] + '::' + df['object_id'].astype(str)
-    # reorder?
-    edges_df = df[['subject_id_full', 'object_id_full', 'predicate', 'Primary_Knowledge_Source', 'Knowledge_Source', 'publications']]
-    graph = ig.Graph.DataFrame(edges_df, directed=directed, use_vids=False)
-    node_attributes = {}
-    for i, row in df.iterrows():
-        if row['subject_id'] not in node_attributes:
-            node_attributes[row['subject_id_full']] = {
-                    'id': row['subject_id'],
-                    'id_prefix': row['subject_id_prefix'],
-                    'feature_name': row['subject_name'],
-                    'category': row['subject_category']}
-        if row['object_id'] not in node_attributes:
-            node_attributes[row['object_id_full']] = {
-                    'id': row['object_id'],
-                    'id_prefix': row['object_id_prefix'],
-                    'feature_name': row['object_name'],
-                    'category': row['object_category']}
-    for v in graph.vs:
-        attributes = node_attributes[v['name']]
-        v.update_attributes(attributes)
+    codes, full_ids, nodes = _df_nodes(df, 'feature_name')
+    graph = ig.Graph(n=len(full_ids), edges=codes, directed=directed)
+    graph.vs['name'] = full_ids
+    for column in nodes.columns:
+        graph.vs[column] = nodes[column].tolist()
+    for column in ['predicate', 'Primary_Knowledge_Source', 'Knowledge_Source', 'publications']:
+        graph.es[column] = df[column].tolist()
     return graph
 
 
 def get_nodes_table(graph):
     """
-    Returns a Pandas DataFrame of the nodes.
+    Returns a Pandas DataFrame of the nodes. For graphs loaded with lazy_properties=True, the node properties are read from the property store.
     """
+    from .property_store import node_attributes
     rows = []
-    for v in graph.vs:
-        row = {'id': v['name']}
-        row.update(v.attributes())
+    for attributes in node_attributes(graph, range(len(graph.vs))):
+        row = {'id': attributes['name']}
+        row.update(attributes)
         rows.append(row)
     return pd.DataFrame(rows)
 
 def get_names_to_ids(graph, category=None):
     """Returns a dict mapping node names to IDs (ignoring prefixes and categories so on)"""
-    names_to_ids = {}
-    for v in graph.vs:
-        if category is not None and v['category'] != category:
-            continue
-        names_to_ids[v['feature_name']] = v['name']
-    return names_to_ids
+    return dict(get_graph_index(graph).mapping('feature_name', 'name', category))
 
 def get_names_to_ids_networkx(graph, category=None):
     """Returns a dict mapping node names to IDs (ignoring prefixes and categories so on)"""
@@ -180,10 +442,10 @@ def get_names_to_ids_networkx(graph, category=None):
     return names_to_ids
 
 def get_spoke_categories(graph):
-    return set(attrs['category'] for attrs in graph.vs)
+    return set(get_graph_index(graph).column('category'))
 
 def get_spoke_sources(graph):
-    return set(attrs['source'] for attrs in graph.vs)
+    return set(get_graph_index(graph).column('source'))
 
 def spoke_identifiers_to_ids(graph, category, source=None):
     """
@@ -192,13 +454,7 @@ def spoke_identifiers_to_ids(graph, category, source=None):
     category: 'Protein', 'Gene', 'Compound', 'Disease', etc
     source: 'KEGG', ...
     """
-    identifiers_to_ids = {}
-    for v in graph.vs:
-        attrs = v.attributes()
-        if 'category' in attrs and attrs['category'] == category:
-            if source is None or ('source' in attrs and attrs['source'] == source):
-                identifiers_to_ids[attrs['identifier']] = v['name']
-    return identifiers_to_ids
+    return dict(get_graph_index(graph).mapping('identifier', 'name', category, source))
 
 def spoke_identifiers_to_ids_networkx(graph, category, source=None):
     """
@@ -218,11 +474,7 @@ def get_category_ids_to_nodes(graph, category):
     """
     Returns a dict that maps from identifiers in the specified category to graph node indices, for graphs that are not SPOKE.
     """
-    identifiers_to_ids = {}
-    for v in graph.vs:
-        if v['category'] == category:
-            identifiers_to_ids[v['id']] = v.index 
-    return identifiers_to_ids
+    return dict(get_graph_index(graph).mapping('id', 'index', category))
 
 def largest_component(graph):
     "Returns a subgraph containing the largest connected component of the given graph."
@@ -240,12 +492,7 @@ def largest_component(graph):
 
 def nodes_in_category(graph, category, attr_name='category'):
     "Returns all nodes that are within a given category, as a list of igraph.Vertex objects."
-    nodes_in_category = []
-    for v in graph.vs:
-        attrs = v.attributes()
-        if attr_name in attrs and attrs[attr_name] == category:
-            nodes_in_category.append(v)
-    return nodes_in_category
+    return [graph.vs[i] for i in get_graph_index(graph).nodes_in(category, attr_name).tolist()]
 
 
 def nodes_in_category_networkx(graph, category, attr_name='category'):
@@ -259,18 +506,14 @@ def random_nodes_in_category(graph, category, n_nodes):
     """
     Returns a list of random node ids in the given category.
     """
-    nodes_in_category = []
-    for v in graph.vs:
-        attrs = v.attributes()
-        if 'category' in attrs and attrs['category'] == category:
-            nodes_in_category.append(attrs['name'])
-    return random.sample(nodes_in_category, n_nodes)
+    index = get_graph_index(graph)
+    return random.sample([index.names[i] for i in index.nodes_in(category).tolist()], n_nodes)
 
 def random_nodes(graph, n_nodes):
     """
     Returns a list of random node ids.
     """
-    return random.sample([v['name'] for v in graph.vs], n_nodes)
+    return random.sample(get_graph_index(graph).names, n_nodes)
 
 
 def random_nodes_in_category_networkx(graph, category, n_nodes):
@@ -285,13 +528,31 @@ def random_nodes_in_category_networkx(graph, category, n_nodes):
 
 
 # random nodes with similar degree distributions? investigative bias - constrain null model to be similar to the problem. We could select random nodes among the nodes that are in the general set...
+def _vertex_indices(graph, nodes):
+    "Returns the int64 array of vertex indices of a list of vertex indices, names or igraph.Vertex objects (like graph.degree)."
+    indices = np.empty(len(nodes), dtype=np.int64)
+    names = []
+    name_positions = []
+    for i, node in enumerate(nodes):
+        if isinstance(node, (int, np.integer)):
+            indices[i] = node
+        elif isinstance(node, ig.Vertex):
+            indices[i] = node.index
+        else:
+            names.append(node)
+            name_positions.append(i)
+    if names:
+        indices[name_positions] = resolve_nodes(graph, names)
+    return indices
+
+
 def degree_sample(graph, node_list, n_samples, dist_or_probs):
     """
     Degree-based node sampling, to sample nodes such that they approximately match the given degree distribution.
 
     Args:
         graph - an igraph.Graph
-        node_list - a list of vertices to be sampled from
+        node_list - a list of vertices (vertex indices or names) to be sampled from
         n_samples - the number of points to sample
         dist_or_probs - Either a scipy.stats distribution that has a pdf function (could probably use a kernel density estimation), or a list/array of probabilities over node_list
     """
@@ -301,7 +562,7 @@ def degree_sample(graph, node_list, n_samples, dist_or_probs):
         prob_vals = dist_or_probs
     else:
         dist = dist_or_probs
-        prob_vals = dist.pdf(graph.degree(node_list))
+        prob_vals = dist.pdf(get_graph_index(graph).degree[_vertex_indices(graph, node_list)])
         prob_vals = np.array(prob_vals)
         prob_vals = prob_vals/prob_vals.sum()
     sampled_nodes = np.random.choice(node_list, size=n_samples, replace=False, p=prob_vals)
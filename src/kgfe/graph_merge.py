@@ -0,0 +1,257 @@
+# Streaming merge of several edge tables (processed_graphs files or DataFrames in the load_graph format) into one compiled graph.
+#
+# The tables are read in chunks, and every chunk is added to a shared node id dict and edge table, so the merged graph is never
+# materialized as one concatenated DataFrame. Edges are deduplicated on (subject, predicate, object), and every edge keeps the list
+# of tables it came from (the 'sources' edge property). The result is a compiled graph (see compiled_graph), which can be loaded
+# with compiled_graph.load_compiled_igraph or graph_store.GraphStore. Its node and edge attributes are the same as those of
+# graph_info.df_to_graph on the concatenated tables (plus 'sources'); every edge keeps the attributes of its first row.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import compiled_graph
+from .edge_table import EdgeTable
+from .graph_info import CSV_CHUNKSIZE, ID_COLUMNS, _df_nodes, _graph_filters, _graph_path, fresh_parquet
+from .progress import Progress, log
+
+MERGE_VERSION = 2
+
+# columns of the edge tables that are used by the merge
+MERGE_COLUMNS = ['subject_id', 'object_id', 'subject_id_prefix', 'object_id_prefix', 'subject_name', 'object_name',
+        'predicate', 'subject_category', 'object_category']
+
+# edge attributes of graph_info.df_to_graph, besides the predicate; they are None for tables that don't have them
+EDGE_COLUMNS = ['Primary_Knowledge_Source', 'Knowledge_Source', 'publications']
+
+
+def _source_name(table, i):
+    if isinstance(table, str):
+        name = os.path.basename(table)
+        for extension in ('.gz', '.csv', '.tsv', '.txt', '.parquet'):
+            if name.endswith(extension):
+                name = name[:-len(extension)]
+        return name
+    return 'table{0}'.format(i)
+
+
+def _read_chunks(table, chunksize, column_filters, use_parquet=False):
+    """
+    Yields DataFrame chunks of a table (a filename or a DataFrame), with only the rows that match the filters.
+    If use_parquet is True, the up-to-date parquet version of a csv file is read instead if there is one (see graph_info.load_graph).
+    """
+    if isinstance(table, pd.DataFrame):
+        chunks = (table.iloc[start:start+chunksize] for start in range(0, len(table), chunksize))
+    else:
+        filename = _graph_path(table)
+        if filename.endswith('.parquet'):
+            parquet = filename
+        else:
+            parquet = fresh_parquet(filename) if use_parquet else None
+        columns = MERGE_COLUMNS + [c for c in EDGE_COLUMNS + list(column_filters) if c not in MERGE_COLUMNS]
+        if parquet is not None:
+            import pyarrow.parquet as pq
+            parquet_file = pq.ParquetFile(parquet)
+            columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+            chunks = (batch.to_pandas() for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns))
+        else:
+            sep = '\t' if 'tsv' in filename else ','
+            chunks = pd.read_csv(filename, sep=sep, usecols=lambda c: c in columns, dtype=ID_COLUMNS, chunksize=chunksize)
+    for chunk in chunks:
+        if column_filters:
+            mask = np.ones(len(chunk), dtype=bool)
+            for column, values in column_filters.items():
+                mask &= chunk[column].isin(values).to_numpy()
+            chunk = chunk[mask]
+        if len(chunk) > 0:
+            yield chunk
+
+
+class GraphMerger:
+    """
+    Accumulates nodes and deduplicated edges from several edge tables.
+
+    Nodes are identified by prefix::id (as in graph_info.df_to_graph). If a node appears in several rows, its name and category are taken from the last row.
+    Edges are identified by (subject, predicate, object); every edge has the list of sources (tables) it was found in.
+    """
+
+    def __init__(self):
+        self.node_index = {}
+        # list of (name, feature_name, category code), as for compiled_graph.compile_graph, and the id and id_prefix of every node
+        self.nodes = []
+        self.node_ids = []
+        self.node_prefixes = []
+        self.node_types = {}
+        self.edge_types = {}
+        self.sources = []
+        self.edges = EdgeTable()
+        # dict of predicate code: dict of (subject << 32 | object): edge row
+        self._edge_rows = {}
+        # first source of every edge, and the other sources of edges found in several tables
+        self._edge_source = []
+        self._other_sources = {}
+        # EDGE_COLUMNS values of every edge
+        self.edge_values = {column: [] for column in EDGE_COLUMNS}
+
+    def _codes(self, labels, types):
+        "Returns the codes of an array of labels in a label: code dict, adding new labels."
+        label_codes, uniques = pd.factorize(pd.Series(labels, dtype=object).astype(str), use_na_sentinel=False)
+        codes = np.array([types.setdefault(u, len(types)) for u in uniques], dtype=np.int64)
+        return codes[label_codes]
+
+    def add_frame(self, df, source):
+        "Adds the rows of an edge table DataFrame, coming from the given source name."
+        if source not in self.sources:
+            self.sources.append(source)
+        source_code = self.sources.index(source)
+        df = df.copy()
+        df['subject_id_full'] = df['subject_id_prefix'].astype(str) + '::' + df['subject_id'].astype(str)
+        df['object_id_full'] = df['object_id_prefix'].astype(str) + '::' + df['object_id'].astype(str)
+        codes, full_ids, nodes = _df_nodes(df, 'feature_name')
+        # local node codes -> global node indices
+        node_map = np.empty(len(full_ids), dtype=np.int64)
+        for i, full_id in enumerate(full_ids):
+            index = self.node_index.get(full_id)
+            if index is None:
+                index = len(self.nodes)
+                self.node_index[full_id] = index
+                self.nodes.append(None)
+                self.node_ids.append(None)
+                self.node_prefixes.append(None)
+            node_map[i] = index
+        categories = self._codes(nodes['category'].to_numpy(dtype=object), self.node_types)
+        for index, full_id, name, category, identifier, prefix in zip(node_map.tolist(), full_ids, nodes['feature_name'].tolist(),
+                categories.tolist(), nodes['id'].tolist(), nodes['id_prefix'].tolist()):
+            self.nodes[index] = (full_id, name, category)
+            self.node_ids[index] = identifier
+            self.node_prefixes[index] = prefix
+        if len(self.nodes) >= 2**31:
+            raise ValueError('GraphMerger supports at most 2**31 nodes')
+        src = node_map[codes[:, 0]]
+        dst = node_map[codes[:, 1]]
+        predicate = self._codes(df['predicate'].to_numpy(dtype=object), self.edge_types)
+        packed = (src << 32) | dst
+        new_rows = []
+        row = len(self.edges)
+        for i, (key, p) in enumerate(zip(packed.tolist(), predicate.tolist())):
+            rows = self._edge_rows.get(p)
+            if rows is None:
+                rows = self._edge_rows[p] = {}
+            existing = rows.get(key)
+            if existing is None:
+                rows[key] = row
+                row += 1
+                new_rows.append(i)
+                self._edge_source.append(source_code)
+            elif self._edge_source[existing] != source_code:
+                other = self._other_sources.setdefault(existing, [])
+                if source_code not in other:
+                    other.append(source_code)
+        new_rows = np.array(new_rows, dtype=np.int64)
+        self.edges.extend(src[new_rows], dst[new_rows], predicate[new_rows])
+        for column, values in self.edge_values.items():
+            if column in df.columns:
+                values.extend(df[column].to_numpy(dtype=object)[new_rows].tolist())
+            else:
+                values.extend([None]*len(new_rows))
+
+    def add_table(self, table, source=None, chunksize=CSV_CHUNKSIZE, use_parquet=False, **filters):
+        """
+        Adds an edge table (a filename in processed_graphs, a path, or a DataFrame), chunksize rows at a time.
+
+        Args:
+            table: filename or DataFrame
+            source: name of the source (default: the file name without extensions)
+            use_parquet: whether to read the parquet version of a csv file if there is an up-to-date one (see graph_info.load_graph)
+            filters: predicates, subject_categories, object_categories, knowledge_sources (see graph_info.load_graph)
+
+        Returns:
+            number of rows added
+        """
+        if source is None:
+            source = _source_name(table, len(self.sources))
+        n_rows = 0
+        for chunk in _read_chunks(table, chunksize, _graph_filters(filters), use_parquet):
+            self.add_frame(chunk, source)
+            n_rows += len(chunk)
+        return n_rows
+
+    def edge_sources(self):
+        "Returns the list of sources of every edge, as '|'-separated source names."
+        names = self.sources
+        values = [names[s] for s in self._edge_source]
+        for row, other in self._other_sources.items():
+            codes = sorted([self._edge_source[row]] + other)
+            values[row] = '|'.join(names[s] for s in codes)
+        return values
+
+    def write(self, directory, key=None):
+        """
+        Writes the merged graph as a compiled graph. The nodes have the 'id' and 'id_prefix' properties, and the edges have the
+        'predicate', EDGE_COLUMNS and 'sources' properties.
+        """
+        self.edges.compact()
+        edge_types = {v: k for k, v in self.edge_types.items()}
+        predicate_lookup = np.array([edge_types[i] for i in range(len(edge_types))], dtype=object)
+        edge_columns = {'predicate': predicate_lookup[self.edges.predicate].tolist() if len(self.edges) > 0 else []}
+        edge_columns.update(self.edge_values)
+        edge_columns['sources'] = self.edge_sources()
+        node_columns = {'id': self.node_ids, 'id_prefix': self.node_prefixes}
+        compiled_graph.compile_graph(self.nodes, self.edges, {v: k for k, v in self.node_types.items()}, edge_types,
+                directory, key=key, reindexed=True, edge_columns=edge_columns, node_columns=node_columns)
+        return directory
+
+
+def merge_graphs(tables, directory=None, sources=None, chunksize=CSV_CHUNKSIZE, verbose=True, use_parquet=False, **filters):
+    """
+    Merges several edge tables into a compiled graph, streaming each table in chunks.
+
+    Args:
+        tables: list of filenames in processed_graphs, paths or DataFrames
+        directory: output directory. By default, the compiled graph is cached in the kgfe cache directory (see compiled_graph.default_cache_dir), and reused if the files haven't changed; this requires all tables to be files.
+        sources: list of source names for the tables (default: the file names without extensions)
+        chunksize: number of rows per chunk
+        verbose: whether to log progress at INFO level (see progress)
+        use_parquet: whether to read the parquet versions of csv files if there are up-to-date ones (see graph_info.load_graph)
+        filters: predicates, subject_categories, object_categories, knowledge_sources (see graph_info.load_graph)
+
+    Returns:
+        directory of the compiled graph
+    """
+    if sources is None:
+        sources = [_source_name(table, i) for i, table in enumerate(tables)]
+    key = None
+    if all(isinstance(table, str) for table in tables):
+        key = compiled_graph.source_key([_graph_path(table) for table in tables], merge_version=MERGE_VERSION,
+                sources=list(sources), filters=_graph_filters(filters), use_parquet=use_parquet)
+        if directory is None:
+            directory = compiled_graph.cache_path(key)
+        if compiled_graph.is_valid(directory, key):
+            log(verbose, 'Using cached merged graph %s', directory)
+            return directory
+    elif directory is None:
+        raise ValueError('merge_graphs needs an output directory when some of the tables are DataFrames')
+    progress = Progress('merge_graphs', verbose)
+    merger = GraphMerger()
+    n_rows = 0
+    with progress.phase('parse'):
+        for table, source in zip(tables, sources):
+            table_rows = merger.add_table(table, source, chunksize, use_parquet, **filters)
+            n_rows += table_rows
+            if isinstance(table, str):
+                progress.files.append(table)
+            progress.log('merged %s: %d rows', source, table_rows)
+            progress.update(n_rows, nodes=len(merger.nodes), edges=len(merger.edges))
+    with progress.phase('compile'):
+        merger.write(directory, key)
+    progress.finish()
+    return directory
+
+
+def merge_graphs_igraph(tables, directed=False, lazy_properties=False, **kwargs):
+    """
+    Merges several edge tables (see merge_graphs) and returns an igraph.Graph, with the same attributes as graph_info.df_to_graph and the 'sources' edge attribute.
+    """
+    directory = merge_graphs(tables, **kwargs)
+    return compiled_graph.load_compiled_igraph(directory, directed=directed, lazy_properties=lazy_properties)
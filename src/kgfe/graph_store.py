@@ -0,0 +1,203 @@
+# Read-only graph store on top of a compiled graph (see compiled_graph), using numpy memmaps.
+# This lets several processes share one copy of a large graph through the page cache, without building an igraph.Graph per process.
+
+import os
+
+import numpy as np
+
+from . import compiled_graph
+
+
+def gather_neighbors(indptr, indices, nodes):
+    """
+    Returns the concatenation of indices[indptr[n]:indptr[n+1]] for all n in nodes.
+    """
+    nodes = np.asarray(nodes, dtype=np.int64)
+    starts = np.asarray(indptr[nodes], dtype=np.int64)
+    lengths = np.asarray(indptr[nodes + 1], dtype=np.int64) - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    # positions into indices: each run starts at starts[i] and has length lengths[i]
+    run_offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    positions = np.arange(total, dtype=np.int64) + run_offsets
+    return np.asarray(indices[positions], dtype=np.int64)
+
+
+def transition_matrix(sources, targets, n_nodes):
+    """
+    Returns the column-normalized random walk transition matrix of the edges from sources to targets: a scipy.sparse CSR matrix whose
+    entry (j, i) is the number of edges from i to j divided by the number of edges from i, and a boolean array of the nodes without
+    edges from them (dangling nodes), whose columns are 0.
+    """
+    import scipy.sparse
+    out_degree = np.bincount(sources, minlength=n_nodes)
+    dangling = out_degree == 0
+    values = 1.0/out_degree[sources]
+    # duplicate (parallel) edges are summed
+    matrix = scipy.sparse.csr_matrix((values, (targets, sources)), shape=(n_nodes, n_nodes))
+    return matrix, dangling
+
+
+class GraphStore:
+    """
+    A read-only memory-mapped graph.
+
+    Nodes are referred to by index (0 to n_nodes-1); use find/find_all to convert node names (the igraph 'name' attribute) to indices.
+
+    Traversal methods take a mode argument, which is one of 'out', 'in' or 'all' (default, treats the graph as undirected).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = compiled_graph.read_meta(directory)
+        if self.meta.get('version') != compiled_graph.FORMAT_VERSION:
+            raise ValueError('Compiled graph at {0} has format version {1}, expected {2}'.format(
+                directory, self.meta.get('version'), compiled_graph.FORMAT_VERSION))
+        self.n_nodes = self.meta['n_nodes']
+        self.n_edges = self.meta['n_edges']
+        self.indptr = self._load('indptr')
+        self.indices = self._load('indices')
+        self.edge_type = self._load('edge_type')
+        self.in_indptr = self._load('in_indptr')
+        self.in_indices = self._load('in_indices')
+        self.category_codes = self._load('category')
+        self.name_order = self._load('name_order')
+        self.name_offsets, self.name_blob = compiled_graph.read_string_table(directory, 'name', mmap_mode='r')
+        self.node_types = {k: v for k, v in self.meta['node_types']}
+        self.edge_types = {k: v for k, v in self.meta['edge_types']}
+        self.category_index = {v: k for k, v in self.meta['node_types']}
+        self._transition = {}
+
+    def _load(self, name):
+        return np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.n_nodes
+
+    def name(self, node):
+        "Returns the name of a node index."
+        start, end = self.name_offsets[node], self.name_offsets[node + 1]
+        return bytes(self.name_blob[start:end]).decode('utf-8')
+
+    def names(self, nodes=None):
+        "Returns a list of names for the given node indices (or all nodes)."
+        return compiled_graph.decode_strings(self.name_offsets, self.name_blob, nodes)
+
+    def node_strings(self, column, nodes=None):
+        "Returns the values of a node property column ('name', 'feature_name', 'identifier' or 'source') for the given node indices."
+        if column == 'name':
+            return self.names(nodes)
+        return compiled_graph.read_column(self.directory, column, nodes)
+
+    def _name_position(self, name):
+        "Returns the position in name_order where name is, or would be inserted."
+        key = name.encode('utf-8')
+        lo = 0
+        hi = self.n_nodes
+        while lo < hi:
+            mid = (lo + hi) // 2
+            node = self.name_order[mid]
+            start, end = self.name_offsets[node], self.name_offsets[node + 1]
+            if bytes(self.name_blob[start:end]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, name):
+        """
+        Returns the index of the node with the given name, using a binary search over the sorted names. Raises a ValueError if there is no such node.
+        """
+        lo = self._name_position(name)
+        if lo < self.n_nodes:
+            node = int(self.name_order[lo])
+            if self.name(node) == name:
+                return node
+        raise ValueError('no such vertex: {0}'.format(name))
+
+    def find_all(self, names):
+        "Returns an array of node indices for a list of names."
+        return np.array([self.find(n) for n in names], dtype=np.int64)
+
+    def category(self, node):
+        "Returns the category label of a node index."
+        return self.node_types.get(int(self.category_codes[node]))
+
+    def nodes_in_category(self, category):
+        "Returns an array of the indices of all nodes in the given category."
+        if category not in self.category_index:
+            return np.zeros(0, dtype=np.int64)
+        return np.flatnonzero(np.asarray(self.category_codes) == self.category_index[category])
+
+    def _adjacency(self, mode):
+        if mode == 'out':
+            return [(self.indptr, self.indices)]
+        elif mode == 'in':
+            return [(self.in_indptr, self.in_indices)]
+        elif mode == 'all':
+            return [(self.indptr, self.indices), (self.in_indptr, self.in_indices)]
+        raise ValueError('mode must be one of "out", "in", or "all"')
+
+    def transition_matrix(self, mode='all'):
+        "Returns the random walk transition matrix of the edges followed in mode, and the dangling nodes (see transition_matrix). The result is cached."
+        if mode not in self._transition:
+            sources = []
+            targets = []
+            for indptr, indices in self._adjacency(mode):
+                indptr = np.asarray(indptr, dtype=np.int64)
+                sources.append(np.repeat(np.arange(self.n_nodes, dtype=np.int64), np.diff(indptr)))
+                targets.append(np.asarray(indices, dtype=np.int64))
+            self._transition[mode] = transition_matrix(np.concatenate(sources), np.concatenate(targets), self.n_nodes)
+        return self._transition[mode]
+
+    def degree(self, nodes=None, mode='all'):
+        "Returns the degrees of the given node indices (or all nodes) as an array."
+        degrees = 0
+        for indptr, _ in self._adjacency(mode):
+            indptr = np.asarray(indptr)
+            if nodes is None:
+                degrees = degrees + np.diff(indptr)
+            else:
+                nodes_array = np.asarray(nodes, dtype=np.int64)
+                degrees = degrees + (indptr[nodes_array + 1] - indptr[nodes_array])
+        return degrees
+
+    def neighbors(self, node, mode='all'):
+        "Returns an array of neighbor indices of a node (which may contain duplicates for multi-edges)."
+        return np.concatenate([np.asarray(indices[indptr[node]:indptr[node + 1]], dtype=np.int64)
+            for indptr, indices in self._adjacency(mode)])
+
+    def bfs_distances(self, source, max_depth=None, mode='all'):
+        """
+        Returns an array of unweighted shortest path lengths from the source node index (or array of source indices) to every node, with -1 for unreachable nodes.
+        """
+        adjacency = self._adjacency(mode)
+        distances = np.full(self.n_nodes, -1, dtype=np.int32)
+        frontier = np.unique(np.atleast_1d(np.asarray(source, dtype=np.int64)))
+        distances[frontier] = 0
+        depth = 0
+        while len(frontier) > 0 and (max_depth is None or depth < max_depth):
+            depth += 1
+            next_nodes = np.concatenate([gather_neighbors(indptr, indices, frontier) for indptr, indices in adjacency])
+            next_nodes = np.unique(next_nodes)
+            frontier = next_nodes[distances[next_nodes] < 0]
+            distances[frontier] = depth
+        return distances
+
+    def distances(self, sources, targets=None, mode='all'):
+        """
+        Returns a len(sources) x len(targets) array of shortest path lengths (-1 if unreachable). If targets is None, distances to all nodes are returned.
+        """
+        results = []
+        for s in sources:
+            d = self.bfs_distances(s, mode=mode)
+            if targets is not None:
+                d = d[np.asarray(targets, dtype=np.int64)]
+            results.append(d)
+        return np.array(results, dtype=np.int32).reshape(len(results), -1)
+
+    def to_igraph(self, directed=False, low_memory=False):
+        "Materializes the store as an igraph.Graph."
+        return compiled_graph.load_compiled_igraph(self.directory, directed=directed, low_memory=low_memory)
+
@@ -1,22 +1,214 @@
 # Import graph from kg2 csv dump, tsv dump, or jsonl dump.
 
 import csv
-import gzip
 import json
 import os
 
 import numpy as np
-from scipy import sparse, io
+import pandas as pd
+from scipy import sparse
 
+from .compressed_io import base_name
+from .edge_table import EdgeTable
+from .progress import get_progress, log
 
-# TODO: multiple edges between two nodes?
-def import_kg2_csv(node_filename, edge_filename, edges_to_include=None, remove_unused_nodes=False, verbose=True, reindex_edges=True, use_node_types=True, use_edge_types=True, use_edge_properties=False):
+# loader options that don't change the loaded graph, so they aren't part of the cache keys
+NON_KEY_OPTIONS = ('verbose', 'n_processes', 'progress', 'engine', 'chunksize')
+
+# number of rows per chunk of the pandas csv engine (see import_kg2_csv)
+CSV_CHUNKSIZE = 500000
+
+# import options supported by compile_kg2 with a memory_budget (see external_build), and the only values it supports
+EXTERNAL_BUILD_OPTIONS = {'use_edge_properties': False, 'use_node_types': True, 'use_edge_types': True, 'edge_format': 'table'}
+
+
+def _edge_properties(row):
+    "Returns the properties dict of a kg2 edge row (for use_edge_properties=True)."
+    if 'properties' in row:
+        edge_properties = row['properties']
+    else:
+        edge_properties = {}
+    if 'primary_knowledge_source' in row:
+        edge_properties['primary_knowledge_source'] = row['primary_knowledge_source']
+    edge_properties['id'] = int(row['id'])
+    return edge_properties
+
+
+def _finish(progress, owned, nodes, edges):
+    "Ends the current phase of a loader's progress and closes its files, and finishes the progress if the loader created it."
+    if owned:
+        progress.finish(nodes=len(nodes), edges=len(edges))
+    else:
+        progress.close_files()
+        progress.update(nodes=len(nodes), edges=len(edges))
+        progress.end_phase()
+
+
+def _csv_delimiter(filename):
+    return '\t' if 'tsv' in filename else ','
+
+
+def _read_kg2_csv_rows(f, delimiter, nodes, node_index, node_types, edges, edge_types, node_has_edge, is_node_file, progress, n_rows,
+        edges_to_include, use_node_types, use_edge_types, use_edge_properties, edge_format):
+    "engine='csv': parses a kg2 node or edge file row by row with csv.DictReader. Returns the number of rows read so far."
+    csv.field_size_limit(99999999)
+    dr = csv.DictReader(f, dialect='unix', delimiter=delimiter)
+    for i, row in enumerate(dr):
+        if i % progress.log_every == 0:
+            progress.update(n_rows + i, nodes=len(node_index), edges=len(edges))
+        if is_node_file:
+            row_name = ''
+            row_identifier = row['id']
+            if 'name' not in row:
+                row_name = row_identifier
+            else:
+                row_name = row['name']
+            row_source = row['category']
+            row_label = row['category']
+            if use_node_types:
+                if row_label in node_types:
+                    nodes.append((row['id'], row_name, node_types[row_label], row_identifier, row_source))
+                else:
+                    nodes.append((row['id'], row_name, len(node_types) + 1, row_identifier, row_source))
+                    node_types[row_label] = len(node_types) + 1
+            else:
+                nodes.append((row['id'], row_name, True, row_identifier, row_source))
+            node_index[row['id']] = len(nodes) - 1
+        else:
+            edge_type = row['predicate']
+            if edges_to_include is None or edge_type in edges_to_include:
+                node1 = row['subject']
+                node2 = row['object']
+                if edge_format == 'table':
+                    if edge_type not in edge_types:
+                        edge_types[edge_type] = len(edge_types) + 1
+                    edge_properties = None
+                    if use_edge_properties:
+                        edge_properties = _edge_properties(row)
+                    edges.append(node_index[node1], node_index[node2], edge_types[edge_type], edge_properties)
+                else:
+                    node_has_edge.add(node1)
+                    node_has_edge.add(node2)
+                    if use_edge_types:
+                        if edge_type in edge_types:
+                            edges[(node1, node2)] = edge_types[edge_type]
+                        else:
+                            edges[(node1, node2)] = len(edge_types) + 1
+                            edge_types[edge_type] = len(edge_types) + 1
+                    else:
+                        edges[(node1, node2)] = True
+                    if use_edge_properties:
+                        edges[(node1, node2)] = _edge_properties(row)
+        n_rows += 1
+    return n_rows
+
+
+def _append_table_edge(edges, pending_edges, node_index, node1, node2, edge_type, edge_properties):
+    "Adds an edge to an EdgeTable, or to pending_edges if one of its nodes hasn't been read yet (see _append_pending_edges)."
+    index1 = node_index.get(node1)
+    index2 = node_index.get(node2)
+    if index1 is None or index2 is None:
+        pending_edges.append((node1, node2, edge_type, edge_properties))
+    else:
+        edges.append(index1, index2, edge_type, edge_properties)
+
+
+def _append_pending_edges(edges, pending_edges, node_index):
+    "Adds the edges that came before their nodes in the file to an EdgeTable (after the other edges), raising a KeyError for nodes that aren't in the file."
+    for node1, node2, edge_type, edge_properties in pending_edges:
+        for node in (node1, node2):
+            if node not in node_index:
+                raise KeyError('Edge {0} -> {1} refers to node {2}, which is not in the file'.format(node1, node2, node))
+        edges.append(node_index[node1], node_index[node2], edge_type, edge_properties)
+
+
+def _global_codes(values, types):
+    "Returns the 1-based codes of a column in a label: code dict (adding new labels in first-seen order), as a list."
+    codes, uniques = pd.factorize(values, sort=False)
+    lookup = np.array([types.setdefault(u, len(types) + 1) for u in uniques], dtype=np.int64)
+    return lookup[codes].tolist() if len(codes) else []
+
+
+def _read_kg2_csv_chunks(f, delimiter, nodes, node_index, node_types, edges, edge_types, node_has_edge, is_node_file, progress, n_rows,
+        edges_to_include, use_node_types, use_edge_types, use_edge_properties, edge_format, chunksize):
+    """
+    engine='pandas': parses a kg2 node or edge file in chunks of chunksize rows with the pandas C parser, reading only the used columns,
+    with the same results as _read_kg2_csv_rows. Returns the number of rows read so far.
+    """
+    if is_node_file:
+        columns = {'id', 'name', 'category'}
+    else:
+        columns = {'subject', 'object', 'predicate'}
+    # edge properties use all the columns of the row
+    usecols = None if (use_edge_properties and not is_node_file) else (lambda c: c in columns)
+    reader = pd.read_csv(f, sep=delimiter, usecols=usecols, dtype=str, keep_default_na=False, na_filter=False,
+            chunksize=chunksize)
+    node_lookup = None
+    for chunk in reader:
+        n_chunk_rows = len(chunk)
+        if is_node_file:
+            ids = chunk['id'].tolist()
+            names = chunk['name'].tolist() if 'name' in chunk.columns else ids
+            categories = chunk['category']
+            if use_node_types:
+                codes = _global_codes(categories, node_types)
+            else:
+                codes = [True]*len(ids)
+            start = len(nodes)
+            nodes.extend(zip(ids, names, codes, ids, categories.tolist()))
+            node_index.update(zip(ids, range(start, len(nodes))))
+        else:
+            if edges_to_include is not None:
+                chunk = chunk[chunk['predicate'].isin(list(edges_to_include)).to_numpy()]
+            if edge_format == 'table' or use_edge_types:
+                codes = _global_codes(chunk['predicate'], edge_types)
+            subjects = chunk['subject'].tolist()
+            objects = chunk['object'].tolist()
+            properties = None
+            if use_edge_properties:
+                properties = [_edge_properties(row) for row in chunk.to_dict('records')]
+            if edge_format == 'table':
+                if node_lookup is None:
+                    node_lookup = (pd.Index(list(node_index.keys()), dtype=object), np.fromiter(node_index.values(), dtype=np.int64, count=len(node_index)))
+                src = _node_positions(node_lookup, subjects)
+                dst = _node_positions(node_lookup, objects)
+                edges.extend(src, dst, np.array(codes, dtype=np.int64), properties)
+            else:
+                node_has_edge.update(subjects)
+                node_has_edge.update(objects)
+                if use_edge_properties:
+                    values = properties
+                elif use_edge_types:
+                    values = codes
+                else:
+                    values = [True]*len(subjects)
+                edges.update(zip(zip(subjects, objects), values))
+        n_rows += n_chunk_rows
+        progress.update(n_rows, nodes=len(node_index), edges=len(edges))
+    return n_rows
+
+
+def _node_positions(node_lookup, names):
+    "Returns the node indices of an edge column, raising a KeyError for unknown nodes (like node_index[name])."
+    keys, values = node_lookup
+    positions = keys.get_indexer(names)
+    if (positions < 0).any():
+        raise KeyError(names[int(np.argmax(positions < 0))])
+    return values[positions]
+
+
+# The default edge dict keeps only one edge between two nodes; use edge_format='table' to keep all of them.
+def import_kg2_csv(node_filename, edge_filename, edges_to_include=None, remove_unused_nodes=False, verbose=True, reindex_edges=True, use_node_types=True, use_edge_types=True, use_edge_properties=False, edge_format='dict', progress=None, engine='pandas', chunksize=CSV_CHUNKSIZE):
     """
     Args:
         csv_filename: name of csv file (could be csv or tsv, or csv.gz or tsv.gz)
         edges_to_include: set of edge types
         remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
         reindex_edges: whether or not to use indices or original IDs in the edge list.
+        edge_format: 'dict' (default) or 'table'. If 'table', edges is returned as an edge_table.EdgeTable, which keeps every edge (including parallel edges with different types) and always indexes into nodes (reindex_edges is ignored).
+        progress: optional progress.Progress that collects the metrics of the load
+        engine: 'pandas' (default) reads the files in chunks of chunksize rows with the pandas C parser, reading only the used columns (all the edge columns if use_edge_properties is True) and filtering each chunk at once. 'csv' parses them row by row with csv.DictReader. Both return the same results.
+        chunksize: number of rows per chunk for engine='pandas'
 
     Returns:
         nodes: list of (_id, _name, _labels_id) where _labels_id corresponds to a key in node_types
@@ -24,83 +216,41 @@ def import_kg2_csv(node_filename, edge_filename, edges_to_include=None, remove_u
         node_types: dict of int: str (_labels)
         edge_types: dict of int: str (_type)
     """
+    if engine not in ('pandas', 'csv'):
+        raise ValueError('engine must be "pandas" or "csv"')
+    progress, owned = get_progress(progress, 'import_kg2_csv', verbose)
+    progress.start_phase('parse')
     nodes = []
-    n_nodes = 0
     # mapping of _id to index in nodes
     node_index = {}
     # node_types is a map of string (
     node_types = {}
-    edges = {}
+    edges = EdgeTable() if edge_format == 'table' else {}
     # edge_types is a map of string (_type) to node
     edge_types = {}
     # sets of nodes that have in-edges or out-edges (to use when deciding whether to remove nodes)
     node_has_edge = set()
-    csv.field_size_limit(99999999)
-    if node_filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(node_filename, 'rt')
-    else:
-        f = open(node_filename)
-    delimiter = ','
-    if 'tsv' in node_filename:
-        delimiter = '\t'
-    dr = csv.DictReader(f, dialect='unix', delimiter=delimiter)
-    for i, row in enumerate(dr):
-        if verbose and i % 100000 == 0:
-            print(i, 'nodes: ', len(node_index), 'edges: ', len(edges))
-        # if this is a node
-        row_name = ''
-        row_identifier = row['id']
-        if 'name' not in row:
-            row_name = row_identifier
-        else:
-            row_name = row['name']
-        row_source = row['category']
-        row_label = row['category']
-        if use_node_types:
-            if row_label in node_types:
-                nodes.append((row['id'], row_name, node_types[row_label], row_identifier, row_source))
+    n_rows = 0
+    for filename, is_node_file in [(node_filename, True), (edge_filename, False)]:
+        # handles compressed files
+        with progress.open(filename) as f:
+            if engine == 'pandas':
+                n_rows = _read_kg2_csv_chunks(f, _csv_delimiter(filename), nodes, node_index, node_types, edges, edge_types, node_has_edge,
+                        is_node_file, progress, n_rows, edges_to_include, use_node_types, use_edge_types, use_edge_properties, edge_format, chunksize)
             else:
-                nodes.append((row['id'], row_name, len(node_types) + 1, row_identifier, row_source))
-                node_types[row_label] = len(node_types) + 1
-        else:
-            nodes.append((row['id'], row_name, True, row_identifier, row_source))
-        node_index[row['id']] = n_nodes 
-        n_nodes += 1
-    if edge_filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(edge_filename, 'rt')
-    else:
-        f = open(edge_filename)
-    delimiter = ','
-    if 'tsv' in edge_filename:
-        delimiter = '\t'
-    dr = csv.DictReader(f, dialect='unix', delimiter=delimiter)
-    for i, row in enumerate(dr):
-        # if this row is an edge
-            edge_type = row['predicate']
-            if edges_to_include is None or edge_type in edges_to_include:
-                node1 = row['subject']
-                node2 = row['object']
-                node_has_edge.add(node1)
-                node_has_edge.add(node2)
-                if use_edge_types:
-                    if edge_type in edge_types:
-                        edges[(node1, node2)] = edge_types[edge_type]
-                    else:
-                        edges[(node1, node2)] = len(edge_types) + 1
-                        edge_types[edge_type] = len(edge_types) + 1
-                else:
-                    edges[(node1, node2)] = True
-                if use_edge_properties:
-                    if 'properties' in row:
-                        edge_properties = row['properties']
-                    else:
-                        edge_properties = {}
-                    if 'primary_knowledge_source' in row:
-                        edge_properties['primary_knowledge_source'] = row['primary_knowledge_source']
-                    edge_properties['id'] = int(row['id'])
-                    edges[(node1, node2)] = edge_properties
+                n_rows = _read_kg2_csv_rows(f, _csv_delimiter(filename), nodes, node_index, node_types, edges, edge_types, node_has_edge,
+                        is_node_file, progress, n_rows, edges_to_include, use_node_types, use_edge_types, use_edge_properties, edge_format)
+    progress.update(n_rows, nodes=len(node_index), edges=len(edges))
+    progress.start_phase('filter')
+    if edge_format == 'table':
+        if remove_unused_nodes:
+            keep = edges.remove_unused_nodes(len(nodes))
+            nodes = [nodes[i] for i in keep]
+        node_types = {v: k for k, v in node_types.items()}
+        edge_types = {v: k for k, v in edge_types.items()}
+        edges = edges.compact()
+        _finish(progress, owned, nodes, edges)
+        return nodes, edges, node_types, edge_types
     if remove_unused_nodes:
         # remove all nodes that don't have edges
         to_remove = set(node_index.keys()).difference(node_has_edge)
@@ -109,6 +259,7 @@ def import_kg2_csv(node_filename, edge_filename, edges_to_include=None, remove_u
         node_index = {n[0]: i for i, n in enumerate(nodes)}
     # convert edge indices
     if reindex_edges:
+        progress.start_phase('reindex')
         new_edges = {}
         for k, e in edges.items():
             node1, node2 = k
@@ -118,10 +269,11 @@ def import_kg2_csv(node_filename, edge_filename, edges_to_include=None, remove_u
         edges = new_edges
     node_types = {v: k for k, v in node_types.items()}
     edge_types = {v: k for k, v in edge_types.items()}
+    _finish(progress, owned, nodes, edges)
     return nodes, edges, node_types, edge_types
 
 
-def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove_unused_nodes=True, use_edge_types=True, use_node_types=True, verbose=True, reindex_edges=True, use_edge_properties=False):
+def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove_unused_nodes=True, use_edge_types=True, use_node_types=True, verbose=True, reindex_edges=True, use_edge_properties=False, n_processes=1, edge_format='dict', progress=None):
     """
     Imports a jsonl file that contains nodes and edges.
 
@@ -131,6 +283,9 @@ def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove
         edges_to_include: set of edge types
         remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
         reindex_edges: whether or not to use indices or original IDs in the edge list.
+        edge_format: 'dict' (default) or 'table'. If 'table', edges is returned as an edge_table.EdgeTable, which keeps every edge (including parallel edges with different types) and always indexes into nodes (reindex_edges is ignored). Edges that come before their nodes in the files are added after the other edges.
+        n_processes: number of processes used to parse the files. If this is not 1, the files are parsed in parallel by parallel_import.import_jsonl_parallel (None uses all cores).
+        progress: optional progress.Progress that collects the metrics of the load
 
     Returns:
         nodes: list of (_id, _name, _labels_id) where _labels_id corresponds to a key in node_types
@@ -138,30 +293,35 @@ def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove
         node_types: dict of int: str (_labels)
         edge_types: dict of int: str (_type)
     """
+    if n_processes != 1:
+        from .parallel_import import import_jsonl_parallel
+        return import_jsonl_parallel('kg2', [node_filename, edge_filename], edges_to_include, remove_unused_nodes,
+                use_edge_types=use_edge_types, use_node_types=use_node_types, verbose=verbose, reindex_edges=reindex_edges,
+                use_edge_properties=use_edge_properties, n_processes=n_processes, edge_format=edge_format, progress=progress)
+    progress, owned = get_progress(progress, 'import_kg2_jsonl', verbose)
+    progress.start_phase('parse')
     nodes = []
     n_nodes = 0
     # mapping of _id to index in nodes
     node_index = {}
     # node_types is a map of string (
     node_types = {}
-    edges = {}
+    edges = EdgeTable() if edge_format == 'table' else {}
+    # table edges whose nodes haven't been read yet
+    pending_edges = []
     # edge_types is a map of string (_type) to node
     edge_types = {}
     # sets of nodes that have in-edges or out-edges (to use when deciding whether to remove nodes)
     node_has_edge = set()
-    if node_filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(node_filename, 'rt')
-    else:
-        f = open(node_filename)
+    # handles gzip
+    f = progress.open(node_filename)
     line = f.readline()
     i = 0
     using_edge_file = False
     while line:
         row = json.loads(line)
-        if verbose and i % 100000 == 0:
-            print(i, 'nodes: ', len(node_index), 'edges: ', len(edges))
-            print(row)
+        if i % progress.log_every == 0:
+            progress.update(i, nodes=len(node_index), edges=len(edges))
         # if this is a node
         if 'id' in row and 'category' in row and 'subject' not in row and 'object' not in row:
             row_name = ''
@@ -188,37 +348,47 @@ def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove
             if edges_to_include is None or edge_type in edges_to_include:
                 node1 = row['subject']
                 node2 = row['object']
-                node_has_edge.add(node1)
-                node_has_edge.add(node2)
-                if use_edge_types:
-                    if edge_type in edge_types:
-                        edges[(node1, node2)] = edge_types[edge_type]
-                    else:
-                        edges[(node1, node2)] = len(edge_types) + 1
+                if edge_format == 'table':
+                    if edge_type not in edge_types:
                         edge_types[edge_type] = len(edge_types) + 1
+                    edge_properties = None
+                    if use_edge_properties:
+                        edge_properties = _edge_properties(row)
+                    _append_table_edge(edges, pending_edges, node_index, node1, node2, edge_types[edge_type], edge_properties)
                 else:
-                    edges[(node1, node2)] = True
-                if use_edge_properties:
-                    if 'properties' in row:
-                        edge_properties = row['properties']
+                    node_has_edge.add(node1)
+                    node_has_edge.add(node2)
+                    if use_edge_types:
+                        if edge_type in edge_types:
+                            edges[(node1, node2)] = edge_types[edge_type]
+                        else:
+                            edges[(node1, node2)] = len(edge_types) + 1
+                            edge_types[edge_type] = len(edge_types) + 1
                     else:
-                        edge_properties = {}
-                    if 'primary_knowledge_source' in row:
-                        edge_properties['primary_knowledge_source'] = row['primary_knowledge_source']
-                    edge_properties['id'] = int(row['id'])
-                    edges[(node1, node2)] = edge_properties
+                        edges[(node1, node2)] = True
+                    if use_edge_properties:
+                        edges[(node1, node2)] = _edge_properties(row)
         line = f.readline()
         if not line and not using_edge_file and edge_filename is not None:
             f.close()
-            print('Opening edge file', edge_filename)
-            if edge_filename.endswith('.gz'):
-                # handle gzip
-                f = gzip.open(edge_filename, 'rt')
-            else:
-                f = open(edge_filename)
+            progress.log('opening edge file %s', edge_filename)
+            f = progress.open(edge_filename)
             line = f.readline()
             using_edge_file = True
         i += 1
+    n_rows = i
+    progress.update(n_rows, nodes=len(node_index), edges=len(edges))
+    progress.start_phase('filter')
+    if edge_format == 'table':
+        _append_pending_edges(edges, pending_edges, node_index)
+        if remove_unused_nodes:
+            keep = edges.remove_unused_nodes(len(nodes))
+            nodes = [nodes[i] for i in keep]
+        node_types = {v: k for k, v in node_types.items()}
+        edge_types = {v: k for k, v in edge_types.items()}
+        edges = edges.compact()
+        _finish(progress, owned, nodes, edges)
+        return nodes, edges, node_types, edge_types
     if remove_unused_nodes:
         # remove all nodes that don't have edges
         to_remove = set(node_index.keys()).difference(node_has_edge)
@@ -227,6 +397,7 @@ def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove
         node_index = {n[0]: i for i, n in enumerate(nodes)}
     # convert edge indices
     if reindex_edges:
+        progress.start_phase('reindex')
         new_edges = {}
         for k, e in edges.items():
             node1, node2 = k
@@ -236,45 +407,118 @@ def import_kg2_jsonl(node_filename, edge_filename, edges_to_include=None, remove
         edges = new_edges
     node_types = {v: k for k, v in node_types.items()}
     edge_types = {v: k for k, v in edge_types.items()}
+    _finish(progress, owned, nodes, edges)
     return nodes, edges, node_types, edge_types
 
 
-
-
+def import_kg2(node_filename, edge_filename=None, edges_to_include=None, remove_unused_nodes=False, **kwargs):
+    """
+    Calls import_kg2_csv or import_kg2_jsonl depending on the file extension of node_filename (which can have a .gz, .bgz or .zst extension).
+    """
+    base_filename = base_name(node_filename)
+    if base_filename.endswith('.csv') or base_filename.endswith('.tsv'):
+        return import_kg2_csv(node_filename, edge_filename, edges_to_include, remove_unused_nodes, **kwargs)
+    elif base_filename.endswith('.json') or base_filename.endswith('.jsonl'):
+        return import_kg2_jsonl(node_filename, edge_filename, edges_to_include, remove_unused_nodes, **kwargs)
+    else:
+        raise Exception('Filename should be a csv, tsv, json, or jsonl.')
 
 
 def to_sparse(nodes, edges):
     """
-    Returns a DOK matrix from the edges...
+    Returns a CSR array of edge type codes from the (reindexed) edge dict.
+
+    If edges is an EdgeTable, a node pair can have several edges with different types, so the values of the CSR array are the numbers
+    of edges between the nodes, not type codes. Use EdgeTable.to_coo for a COO array of the type codes of every edge.
     """
+    from .compiled_graph import edges_to_arrays
     n_nodes = len(nodes)
-    edge_matrix = sparse.dok_array((n_nodes, n_nodes), dtype=int)
-    for k, v in sorted(edges.items()):
-        n1, n2 = k
-        edge_matrix[n1, n2] = v
-    return edge_matrix
-
-
-def load_kg2(filename='kg2.csv', edges_to_include=None, remove_unused_nodes=False, mtx_filename='spoke.mtx', **kwargs):
-    if filename.endswith('.csv') or filename.endswith('.csv.gz') or filename.endswith('.tsv') or filename.endswith('.tsv.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_csv(filename, edges_to_include, remove_unused_nodes, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_jsonl(filename, edges_to_include, remove_unused_nodes, **kwargs)
-    else:
-        raise Exception('Filename should be a csv, tsv, json, or jsonl.')
-    if not os.path.exists(mtx_filename):
+    if isinstance(edges, EdgeTable):
+        return edges.to_counts(n_nodes)
+    src, dst, edge_type = edges_to_arrays(nodes, edges, reindexed=True)
+    return sparse.coo_array((edge_type, (src, dst)), shape=(n_nodes, n_nodes)).tocsr()
+
+
+def _matrix_filename(mtx_filename):
+    "Matrices used to be cached in matrix market format; old .mtx filenames are mapped to .npz."
+    if mtx_filename.endswith('.mtx'):
+        return mtx_filename[:-4] + '.npz'
+    return mtx_filename
+
+
+def load_kg2(filename='kg2.csv', edges_to_include=None, remove_unused_nodes=False, mtx_filename='kg2.npz', edge_filename=None, **kwargs):
+    """
+    Returns nodes, edges, node_types, edge_types and the sparse adjacency matrix (see to_sparse).
+
+    The matrix is cached in mtx_filename (an npz file; a .mtx extension is replaced with .npz), and is only reused if it was built from the same files and options.
+    """
+    from . import compiled_graph
+    nodes, edges, node_types, edge_types = import_kg2(filename, edge_filename, edges_to_include, remove_unused_nodes, **kwargs)
+    mtx_filename = _matrix_filename(mtx_filename)
+    key_options = {k: v for k, v in kwargs.items() if k not in NON_KEY_OPTIONS}
+    key = compiled_graph.source_key([filename, edge_filename], loader='kg2_matrix',
+            edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes, **key_options)
+    edge_matrix = compiled_graph.read_matrix(mtx_filename, key)
+    if edge_matrix is None:
         edge_matrix = to_sparse(nodes, edges)
-        io.mmwrite(mtx_filename, edge_matrix)
-    else:
-        edge_matrix = io.mmread(mtx_filename)
+        compiled_graph.write_matrix(mtx_filename, edge_matrix, key)
     return nodes, edges, node_types, edge_types, edge_matrix
 
 
+def _edge_table_to_igraph(nodes, edges, node_types, edge_types, directed=False, low_memory=False):
+    """
+    Builds an igraph.Graph from an EdgeTable, with the same attributes as load_kg2_igraph_from_data. Every edge in the table becomes an igraph edge, so parallel edges are kept.
+    """
+    import igraph as ig
+    graph = ig.Graph(n=len(nodes), edges=np.column_stack([edges.src, edges.dst]), directed=directed)
+    graph.vs['name'] = [str(n[0]) for n in nodes]
+    graph.vs['feature_name'] = [n[1] for n in nodes]
+    graph.vs['category'] = [node_types[n[2]] for n in nodes]
+    graph.vs['identifier'] = [n[3] for n in nodes]
+    if not low_memory:
+        graph.vs['source'] = [n[4] for n in nodes]
+        graph.es['type'] = [edge_types[c] for c in edges.predicate.tolist()]
+        if edges.property_row is not None:
+            all_properties = [edges.edge_properties(i) for i in range(len(edges))]
+            keys = set()
+            for properties in all_properties:
+                keys.update(properties.keys())
+            keys.discard('type')
+            # igraph doesn't allow lists as edge properties, so we are converting them to a string.
+            for key in sorted(keys):
+                values = [p.get(key) for p in all_properties]
+                graph.es[key] = [str(v) if isinstance(v, list) or isinstance(v, dict) else v for v in values]
+    return graph
+
+
+def _edge_table_to_networkx(nodes, edges, node_types, edge_types, directed=False):
+    """
+    Builds a networkx MultiGraph (or MultiDiGraph) from an EdgeTable, so that parallel edges are kept. Nodes are keyed by their ids.
+    """
+    import networkx as nx
+    graph = nx.MultiDiGraph() if directed else nx.MultiGraph()
+    ids = [n[0] for n in nodes]
+    graph.add_edges_from((ids[s], ids[t], {'type': edge_types[c]})
+            for s, t, c in zip(edges.src.tolist(), edges.dst.tolist(), edges.predicate.tolist()))
+    node_attributes = {}
+    for n in nodes:
+        node_attributes[n[0]] = {
+                'name':  n[1],
+                'category': node_types[n[2]],
+                'identifier': n[3],
+                'source': n[4],
+        }
+    nx.set_node_attributes(graph, node_attributes)
+    return graph
+
+
 def load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unused_nodes=True, directed=False, verbose=False, low_memory=False, **kwargs):
     """
-    Uses the output of import_kg2_csv or import_kg2_jsonl
+    Uses the output of import_kg2_csv or import_kg2_jsonl. edges can be an edge dict or an EdgeTable.
     """
     import igraph as ig
+    if isinstance(edges, EdgeTable):
+        return _edge_table_to_igraph(nodes, edges, node_types, edge_types, directed, low_memory)
     if low_memory:
         edge_list = ({'s': str(v[0]), 't': str(v[1])} for v in edges.keys())
         del edges
@@ -288,8 +532,7 @@ def load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unuse
             edge_list = ({'source': str(v[0]), 'target': str(v[1]), **e} for v, e in edges.items())
         else:
             edge_list = ({'source': str(v[0]), 'target': str(v[1]), 'type': edge_types[e]} for v, e in edges.items())
-    if verbose:
-        print('creating node list')
+    log(verbose, 'creating node list')
     # set node attributes
     # convert the node id to a string, bc
     if low_memory:
@@ -308,12 +551,14 @@ def load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unuse
                 'identifier': n[3],
                 'source': n[4],
         } for n in nodes)
-    if verbose:
-        print('calling igraph.Graph.DictList')
+    log(verbose, 'calling igraph.Graph.DictList')
     if low_memory:
         graph = ig.Graph.DictList(node_list, edge_list, directed=directed,
                 edge_foreign_keys=('s', 't'),
                 iterative=False)
+        # the foreign keys are only needed to build the graph
+        del graph.es['s']
+        del graph.es['t']
     else:
         graph = ig.Graph.DictList(node_list, edge_list, directed=directed,
                 edge_foreign_keys=('source', 'target'),
@@ -323,14 +568,11 @@ def load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unuse
 
     pass
 
-def load_kg2_networkx(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=True, directed=False, **kwargs):
+def load_kg2_networkx(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=True, directed=False, edge_filename=None, **kwargs):
     import networkx as nx
-    if filename.endswith('.csv') or filename.endswith('.csv.gz') or filename.endswith('.tsv') or filename.endswith('.tsv.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_csv(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
-    else:
-        raise Exception('Filename should be a csv, tsv, json, or jsonl.')
+    nodes, edges, node_types, edge_types = import_kg2(filename, edge_filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
+    if isinstance(edges, EdgeTable):
+        return _edge_table_to_networkx(nodes, edges, node_types, edge_types, directed)
     edge_list = edges.keys()
     if directed:
         graph = nx.from_edgelist(edge_list, nx.DiGraph)
@@ -353,22 +595,96 @@ def load_kg2_networkx(filename='spoke.csv', edges_to_include=None, remove_unused
     return graph
 
 
-def load_kg2_igraph(filename='graph.jsonl.gz', edges_to_include=None, remove_unused_nodes=True, directed=False, verbose=False, low_memory=False, **kwargs):
+def compile_kg2(filename='graph.jsonl.gz', edges_to_include=None, remove_unused_nodes=True, edge_filename=None, cache_dir=None, verbose=False, delta_filenames=None, memory_budget=None, directed=False, **kwargs):
+    """
+    Parses the file into a compiled graph (see compiled_graph) in cache_dir (default: $KGFE_CACHE_DIR or ~/.cache/kgfe), unless an up-to-date compiled graph already exists for the same file and options.
+
+    delta_filenames is an optional list of delta files (see graph_delta), which are applied in order to the compiled graph. Every intermediate graph is cached, so adding a new delta file to the list only parses that file. directed only matters for delta files (see graph_delta.apply_delta).
+
+    If memory_budget (in bytes) is given, the graph is compiled out of core by external_build.build_kg2_external, which keeps about that much data in memory. The nodes are then numbered in the order of their ids, and parallel edges are kept (as with edge_format='table'). It raises a ValueError for the options it doesn't support (see EXTERNAL_BUILD_OPTIONS).
+
+    Returns the directory of the compiled graph.
+    """
+    from . import compiled_graph
+    if delta_filenames:
+        from . import graph_delta
+        directory = compile_kg2(filename, edges_to_include, remove_unused_nodes, edge_filename=edge_filename, cache_dir=cache_dir, verbose=verbose, memory_budget=memory_budget, **kwargs)
+        key = compiled_graph.read_meta(directory)['key']
+        for delta_filename in delta_filenames:
+            key = graph_delta.delta_key(key, delta_filename, directed, remove_unused_nodes)
+            delta_directory = compiled_graph.cache_path(key, cache_dir)
+            if not compiled_graph.is_valid(delta_directory, key):
+                log(verbose, 'Applying %s to compiled graph at %s', delta_filename, directory)
+                graph_delta.apply_delta(directory, delta_filename, delta_directory, key=key, edges_to_include=edges_to_include,
+                        directed=directed, remove_unused_nodes=remove_unused_nodes, verbose=verbose)
+            directory = delta_directory
+        return directory
+    if memory_budget is not None:
+        from .external_build import build_kg2_external
+        for option, value in EXTERNAL_BUILD_OPTIONS.items():
+            if option in kwargs and kwargs[option] != value:
+                raise ValueError('compile_kg2 with a memory_budget only supports {0}={1!r}'.format(option, value))
+        return build_kg2_external(filename, edge_filename, edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes,
+                memory_budget=memory_budget, cache_dir=cache_dir, verbose=verbose, progress=kwargs.get('progress'))
+    key_options = {k: v for k, v in kwargs.items() if k not in NON_KEY_OPTIONS}
+    key = compiled_graph.source_key([filename, edge_filename], loader='kg2',
+            edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes, **key_options)
+    directory = compiled_graph.cache_path(key, cache_dir)
+    if compiled_graph.is_valid(directory, key):
+        log(verbose, 'Using compiled graph at %s', directory)
+        return directory
+    progress, owned = get_progress(kwargs.pop('progress', None), 'compile_kg2', verbose)
+    nodes, edges, node_types, edge_types = import_kg2(filename, edge_filename, edges_to_include, remove_unused_nodes, reindex_edges=False, progress=progress, **kwargs)
+    progress.log('writing compiled graph to %s', directory)
+    with progress.phase('compile'):
+        compiled_graph.compile_graph(nodes, edges, node_types, edge_types, directory, key=key)
+    if owned:
+        progress.finish()
+    return directory
+
+
+def load_kg2_store(filename='graph.jsonl.gz', edges_to_include=None, remove_unused_nodes=True, edge_filename=None, cache_dir=None, verbose=False, delta_filenames=None, **kwargs):
+    """
+    Returns a read-only memory-mapped graph_store.GraphStore for the file, compiling it first if necessary (see compile_kg2).
+    """
+    from .graph_store import GraphStore
+    directory = compile_kg2(filename, edges_to_include, remove_unused_nodes, edge_filename=edge_filename, cache_dir=cache_dir, verbose=verbose, delta_filenames=delta_filenames, **kwargs)
+    return GraphStore(directory)
+
+
+def load_kg2_igraph(filename='graph.jsonl.gz', edges_to_include=None, remove_unused_nodes=True, directed=False, verbose=False, low_memory=False, edge_filename=None, use_cache=False, cache_dir=None, delta_filenames=None, lazy_properties=False, memory_budget=None, **kwargs):
     """
     Imports the file as an igraph. The file can be a json/jsonl export from neo4j, and it can be gzipped. The spoke IDs are converted to strings because igraph is very slow if the ids are ints.
+
+    If use_cache is True (it is off by default), the parsed graph is written to a compiled graph (see compile_kg2) on the first load, and later loads of the same unchanged file with the same options are read from the compiled graph without re-parsing.
+
+    If lazy_properties is True, the graph only keeps the node names and categories (and edge types) in memory, and the other node and edge properties are read from the compiled graph when needed (see property_store). This implies use_cache.
+
+    delta_filenames is an optional list of delta files (see graph_delta) that are applied to the graph in order. With use_cache, only delta files that haven't been applied to the cached graph are parsed.
+
+    If memory_budget is given, the file is compiled out of core (see compile_kg2). This implies use_cache.
     """
+    from . import compiled_graph
     if low_memory:
         kwargs['use_edge_properties'] = False
-    if filename.endswith('.csv') or filename.endswith('.csv.gz') or filename.endswith('.tsv') or filename.endswith('.tsv.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_csv(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
-        nodes, edges, node_types, edge_types = import_kg2_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
+    progress, owned = get_progress(kwargs.pop('progress', None), 'load_kg2_igraph', verbose)
+    if use_cache or lazy_properties or memory_budget is not None:
+        directory = compile_kg2(filename, edges_to_include, remove_unused_nodes, edge_filename=edge_filename, cache_dir=cache_dir, verbose=verbose, delta_filenames=delta_filenames, memory_budget=memory_budget, directed=directed, progress=progress, **kwargs)
+        with progress.phase('igraph'):
+            graph = compiled_graph.load_compiled_igraph(directory, directed=directed, low_memory=low_memory, lazy_properties=lazy_properties)
     else:
-        raise Exception('Filename should be a csv, tsv, json, or jsonl.')
-    if verbose:
-        print('Done loading data, creating edge list')
-    return load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unused_nodes, directed, verbose, low_memory, **kwargs)
-    # use igraph.graph.DictList
+        nodes, edges, node_types, edge_types = import_kg2(filename, edge_filename, edges_to_include, remove_unused_nodes, reindex_edges=False, progress=progress, **kwargs)
+        progress.log('done loading data, creating edge list')
+        with progress.phase('igraph'):
+            graph = load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unused_nodes, directed, verbose, low_memory, **kwargs)
+        if delta_filenames:
+            from .graph_delta import update_igraph
+            with progress.phase('delta'):
+                for delta_filename in delta_filenames:
+                    update_igraph(graph, delta_filename, edges_to_include, remove_unused_nodes)
+    if owned:
+        progress.finish(nodes=graph.vcount(), edges=graph.ecount())
+    return graph
 
 
 def symmetrize_matrix(matrix):
@@ -0,0 +1,302 @@
+# PageRank engines that work on igraph graphs and graph_store.GraphStore graphs, besides the igraph pagerank functions used by
+# explanations.topic_pagerank.
+#
+# - power_iteration: (personalized) pagerank of many restart distributions at once, on the cached column-normalized transition
+#   matrix, optionally warm-started (used by explanations.batch_topic_pagerank, and by global_pagerank).
+# - forward_push / approximate_pagerank: approximate personalized pagerank by local pushes (Andersen, Chung and Lang 2006), which
+#   only visits the neighborhood of the seeds. Its cost depends on 1/epsilon and on the degrees of the visited nodes, not on the
+#   size of the graph, so it works on memory-mapped GraphStores of millions of nodes without reading the whole graph.
+# - global_pagerank: pagerank without personalization, cached per graph, used to normalize the approximate scores (the scores of
+#   hubs are high for any seeds).
+#
+# Both follow the igraph conventions: parallel edges are counted, undirected edges (or mode='all' for GraphStores) are followed in
+# both directions, and the random walk restarts from the seeds (from any node for global pagerank) at dangling nodes.
+
+import collections
+import weakref
+
+import numpy as np
+import scipy.sparse
+
+from .graph_index import get_graph_index, resolve_nodes
+
+# dict of id(graph): (signature, dict of (alpha, mode, tol, max_iter): global pagerank array)
+_global_pageranks = {}
+
+
+def _is_store(graph):
+    from .graph_store import GraphStore
+    return isinstance(graph, GraphStore)
+
+
+def _signature(graph):
+    if _is_store(graph):
+        return (graph.directory, graph.n_nodes, graph.n_edges)
+    return (graph.vcount(), graph.ecount())
+
+
+def _n_nodes(graph):
+    return graph.n_nodes if _is_store(graph) else graph.vcount()
+
+
+def walk_adjacency(graph, mode='all'):
+    """
+    Returns the edges followed by the random walk, as a list of (indptr, indices) CSR arrays: the neighbors of node u are the
+    concatenation of indices[indptr[u]:indptr[u+1]] for all pairs. For an igraph graph this is a cached CSR snapshot of the graph
+    (see graph_index.GraphIndex.adjacency), and mode is ignored; for a GraphStore these are its memory-mapped arrays for mode.
+    """
+    if _is_store(graph):
+        return graph._adjacency(mode)
+    return get_graph_index(graph).adjacency()
+
+
+def transition_matrix(graph, mode='all'):
+    "Returns the column-normalized transition matrix and the dangling nodes of a graph or GraphStore (see GraphIndex.transition_matrix)."
+    if _is_store(graph):
+        return graph.transition_matrix(mode)
+    return get_graph_index(graph).transition_matrix()
+
+
+def topic_indices(graph, topic_ids, topic_weights=None):
+    """
+    Returns the node indices and restart weights of a topic set: topic_ids (a list of node ids, or a dict of node id: weight) and
+    topic_weights (a dict of node id: weight, for the ids in topic_ids without a weight, or all the topics if topic_ids is None).
+    graph can be an igraph graph or a GraphStore.
+    """
+    if isinstance(topic_ids, dict):
+        topic_weights = dict(topic_ids, **(topic_weights or {}))
+        topic_ids = None
+    if topic_ids is None:
+        topic_ids = list(topic_weights or {})
+    else:
+        topic_ids = list(topic_ids)
+    topic_weights = topic_weights or {}
+    weights = np.array([topic_weights.get(topic_id, 1.0) for topic_id in topic_ids], dtype=np.float64)
+    if len(topic_ids) == 0 or weights.sum() <= 0 or (weights < 0).any():
+        raise ValueError('a topic set must have at least one topic, and non-negative weights with a positive sum')
+    if _is_store(graph):
+        return graph.find_all(topic_ids), weights
+    return resolve_nodes(graph, topic_ids), weights
+
+
+def start_scores(graph, nstart):
+    """
+    Returns the initial scores of a warm-started pagerank as an array of one score per node, or None if no node has a score.
+
+    Args:
+        graph: an igraph graph or a GraphStore
+        nstart: an array of one score per node, or a dict of node id: score. Ids of the dict that aren't in the graph (e.g. nodes
+            that were removed since the scores were computed) are ignored, and nodes without a score start at 0.
+    """
+    n = _n_nodes(graph)
+    if not isinstance(nstart, dict):
+        start = np.asarray(nstart, dtype=np.float64).reshape(n)
+    else:
+        if _is_store(graph):
+            indices = []
+            values = []
+            for node_id, value in nstart.items():
+                try:
+                    indices.append(graph.find(node_id))
+                    values.append(value)
+                except ValueError:
+                    pass
+        else:
+            indices, missing = resolve_nodes(graph, list(nstart), missing='report')
+            missing = set(missing)
+            values = [value for node_id, value in nstart.items() if node_id not in missing]
+        start = np.zeros(n)
+        np.add.at(start, np.asarray(indices, dtype=np.int64), np.asarray(values, dtype=np.float64))
+    if start.sum() <= 0:
+        return None
+    return start
+
+
+def power_iteration(matrix, dangling, restart, alpha=0.7, tol=1e-9, max_iter=100, start=None, return_converged=False):
+    """
+    Personalized pagerank of several restart distributions at once, by power iteration with sparse-times-dense products.
+
+    Args:
+        matrix: column-normalized N x N transition matrix (see graph_index.GraphIndex.transition_matrix)
+        dangling: boolean array of the vertices without out-edges; the random walk restarts from them
+        restart: dense N x B array, whose columns are the restart distributions (normalized to sum to 1)
+        alpha: damping factor (probability of following an edge)
+        tol: a column stops being updated when the L1 norm of its change in one iteration is below tol
+        max_iter: maximum number of iterations
+        start: optional N x B array of initial scores (e.g. the scores of a previous version of the graph), instead of restart
+        return_converged: whether to also return which columns converged
+
+    Returns:
+        N x B array of pagerank scores, whose columns sum to 1, and if return_converged is True, a boolean array of the columns whose
+        change was below tol within max_iter iterations
+    """
+    restart = restart/restart.sum(axis=0)
+    scores = restart.copy() if start is None else np.array(start, dtype=np.float64).reshape(restart.shape)/np.sum(start, axis=0)
+    # columns that haven't converged, and their current values
+    active = np.arange(restart.shape[1])
+    current = scores
+    current_restart = restart
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        dangling_mass = current[dangling].sum(axis=0)
+        new = alpha*(matrix @ current) + current_restart*(alpha*dangling_mass + 1 - alpha)
+        converged = np.abs(new - current).sum(axis=0) < tol
+        current = new
+        if converged.any():
+            scores[:, active] = current
+            active = active[~converged]
+            current = current[:, ~converged]
+            current_restart = current_restart[:, ~converged]
+    if len(active):
+        scores[:, active] = current
+    scores = scores/scores.sum(axis=0)
+    if return_converged:
+        converged = np.ones(restart.shape[1], dtype=bool)
+        converged[active] = False
+        return scores, converged
+    return scores
+
+
+def global_pagerank(graph, alpha=0.7, nstart=None, tol=1e-9, max_iter=100, mode='all'):
+    """
+    Returns the pagerank of every node (without personalization) of an igraph graph or GraphStore, as an array.
+    The result is cached per graph, alpha, mode, tol and max_iter, so only the first call runs the power iteration.
+
+    Args:
+        nstart: optional initial scores (see start_scores), e.g. the pagerank of the previous release of the graph, so that the
+            iteration converges in fewer steps. If it is given, the result is recomputed, and only cached if the
+            iteration converged (otherwise it depends on nstart).
+        tol, max_iter: see power_iteration
+        mode: edges followed in a GraphStore ('out', 'in' or 'all')
+    """
+    key = id(graph)
+    signature = _signature(graph)
+    cached = _global_pageranks.get(key)
+    if cached is None or cached[0] != signature:
+        if key not in _global_pageranks:
+            weakref.finalize(graph, _global_pageranks.pop, key, None)
+        cached = (signature, {})
+        _global_pageranks[key] = cached
+    cache_key = (alpha, mode, tol, max_iter)
+    if nstart is None and cache_key in cached[1]:
+        return cached[1][cache_key]
+    matrix, dangling = transition_matrix(graph, mode)
+    n = matrix.shape[0]
+    start = None if nstart is None else start_scores(graph, nstart)
+    if start is not None:
+        start = start.reshape(n, 1)
+    scores, converged = power_iteration(matrix, dangling, np.ones((n, 1)), alpha, tol, max_iter, start, return_converged=True)
+    scores = scores[:, 0]
+    if start is None or converged[0]:
+        cached[1][cache_key] = scores
+    return scores
+
+
+def invalidate(graph):
+    "Discards the cached global pagerank of a graph (e.g. after changing its edges in place)."
+    _global_pageranks.pop(id(graph), None)
+
+
+def forward_push(adjacency, n_nodes, seeds, seed_weights, alpha=0.7, epsilon=1e-5, max_pushes=None):
+    """
+    Approximate personalized pagerank by forward pushes from the seeds (Andersen, Chung and Lang 2006).
+
+    Every node u has an estimate and a residual (mass that hasn't been distributed yet, initially the seed weights). A push moves
+    (1 - alpha) of the residual of u to its estimate and spreads the rest over its neighbors (or over the seeds, for dangling
+    nodes). Nodes are pushed while their residual is above epsilon times their degree, so at the end every node has a residual of
+    at most epsilon times its degree, after at most 1/((1 - alpha)*epsilon) pushes whatever the size of the graph.
+
+    Args:
+        adjacency: list of (indptr, indices) CSR arrays (see walk_adjacency)
+        n_nodes: number of nodes
+        seeds: array of seed node indices
+        seed_weights: array of restart weights of the seeds
+        alpha: damping factor
+        epsilon: residual threshold (per unit of degree)
+        max_pushes: optional maximum number of pushes
+
+    Returns:
+        nodes: sorted array of the nodes with a non-zero estimate
+        scores: array of their estimates (which sum to at most 1)
+        residual: total residual mass that was left (an upper bound on the L1 error)
+    """
+    seeds = np.asarray(seeds, dtype=np.int64)
+    seed_weights = np.asarray(seed_weights, dtype=np.float64)
+    seeds, inverse = np.unique(seeds, return_inverse=True)
+    seed_weights = np.bincount(inverse, weights=seed_weights)
+    seed_weights = seed_weights/seed_weights.sum()
+    # np.zeros doesn't touch the pages of large arrays until they are written, so this is cheap for large graphs
+    residual = np.zeros(n_nodes)
+    estimate = np.zeros(n_nodes)
+    queued = np.zeros(n_nodes, dtype=bool)
+    residual[seeds] = seed_weights
+    queued[seeds] = True
+    queue = collections.deque(seeds.tolist())
+    pushed = []
+    n_pushes = 0
+
+    def degrees(nodes):
+        return sum(np.asarray(indptr[nodes + 1], dtype=np.int64) - np.asarray(indptr[nodes], dtype=np.int64)
+                for indptr, _ in adjacency)
+
+    while queue and (max_pushes is None or n_pushes < max_pushes):
+        u = queue.popleft()
+        if not queued[u]:
+            continue
+        queued[u] = False
+        neighbors = [np.asarray(indices[indptr[u]:indptr[u + 1]]) for indptr, indices in adjacency]
+        neighbors = neighbors[0] if len(neighbors) == 1 else np.concatenate(neighbors)
+        mass = residual[u]
+        if mass <= epsilon*max(len(neighbors), 1):
+            continue
+        n_pushes += 1
+        if estimate[u] == 0:
+            pushed.append(u)
+        estimate[u] += (1 - alpha)*mass
+        residual[u] = 0
+        if len(neighbors) == 0:
+            targets = seeds
+            residual[seeds] += alpha*mass*seed_weights
+        else:
+            targets = neighbors
+            # parallel edges are counted with np.add.at
+            np.add.at(residual, neighbors, alpha*mass/len(neighbors))
+        active = targets[(residual[targets] > epsilon*np.maximum(degrees(targets), 1)) & ~queued[targets]]
+        if len(active):
+            active = np.unique(active)
+            queued[active] = True
+            queue.extend(active.tolist())
+    nodes = np.sort(np.array(pushed, dtype=np.int64))
+    return nodes, estimate[nodes], 1.0 - estimate[nodes].sum()
+
+
+def approximate_pagerank(graph, topic_ids=None, topic_weights=None, alpha=0.7, epsilon=1e-5, normalize=None, mode='all', max_pushes=None):
+    """
+    Approximate personalized pagerank of an igraph graph or GraphStore by local pushes (see forward_push).
+
+    Args:
+        graph: an igraph graph or a graph_store.GraphStore
+        topic_ids, topic_weights: the seeds (see topic_indices)
+        alpha: damping factor
+        epsilon: residual threshold; smaller values are more accurate and visit more nodes
+        normalize: None for the pagerank scores, 'degree' to divide them by the degree of the nodes, or 'pagerank' to divide them by
+            the global pagerank (see global_pagerank, which is computed once per graph), so that hubs don't dominate the results.
+        mode: edges followed in a GraphStore ('out', 'in' or 'all'); igraph graphs follow their own directedness
+        max_pushes: optional maximum number of pushes
+
+    Returns:
+        1 x N scipy.sparse.csr_matrix of scores, which is non-zero only for the nodes that were reached
+    """
+    n = _n_nodes(graph)
+    seeds, weights = topic_indices(graph, topic_ids, topic_weights)
+    adjacency = walk_adjacency(graph, mode)
+    nodes, scores, _ = forward_push(adjacency, n, seeds, weights, alpha, epsilon, max_pushes)
+    if normalize == 'degree':
+        degree = sum(np.asarray(indptr[nodes + 1], dtype=np.int64) - np.asarray(indptr[nodes], dtype=np.int64) for indptr, _ in adjacency)
+        scores = scores/np.maximum(degree, 1)
+    elif normalize == 'pagerank':
+        scores = scores/global_pagerank(graph, alpha, mode=mode)[nodes]
+    elif normalize is not None:
+        raise ValueError('normalize must be None, "degree" or "pagerank"')
+    return scipy.sparse.csr_matrix((scores, (np.zeros(len(nodes), dtype=np.int64), nodes)), shape=(1, n))
@@ -0,0 +1,353 @@
+# Parallel import of kg2 and spoke jsonl dumps.
+#
+# The input is split into byte ranges on line boundaries, each range is parsed in a worker process into columnar
+# partial results (node ids/names/category codes, edge subject/object/predicate codes), and the partial results are
+# merged and reindexed at the end. The outputs are the same as kg2_loader.import_kg2_jsonl and spoke_loader.import_spoke_jsonl.
+
+import json
+import multiprocessing as mp
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from . import compressed_io, kg2_loader, spoke_loader
+from .edge_table import EdgeTable
+from .progress import get_progress
+
+DEFAULT_CHUNK_SIZE = 64*1024*1024
+
+
+def decompress(filename, tmp_dir=None):
+    """
+    Decompresses a compressed file (see compressed_io) into a temporary file (in tmp_dir) and returns its path.
+    """
+    fd, path = tempfile.mkstemp(suffix='.jsonl', dir=tmp_dir)
+    with compressed_io.open_binary(filename) as f_in, os.fdopen(fd, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, 16*1024*1024)
+    return path
+
+
+def line_chunks(filename, n_chunks=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Splits an uncompressed or BGZF file into byte ranges that start and end on line boundaries.
+
+    Args:
+        filename: path to an uncompressed or BGZF file
+        n_chunks: minimum number of chunks
+        chunk_size: maximum size of a chunk in bytes (approximate)
+
+    Returns:
+        list of (start, end) byte offsets in the uncompressed data
+    """
+    size = compressed_io.uncompressed_size(filename)
+    if size == 0:
+        return []
+    n = max(n_chunks or 1, -(-size // chunk_size))
+    boundaries = [0]
+    with compressed_io.open_random_access(filename) as f:
+        for i in range(1, n):
+            offset = size*i // n
+            if offset <= boundaries[-1]:
+                continue
+            f.seek(offset - 1)
+            # move to the start of the next line
+            f.readline()
+            offset = f.tell()
+            if offset >= size:
+                break
+            if offset > boundaries[-1]:
+                boundaries.append(offset)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _read_lines(filename, start, end):
+    with compressed_io.open_random_access(filename) as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return data.splitlines()
+
+
+class _Codes:
+    "Assigns integer codes to labels in first-seen order."
+
+    def __init__(self):
+        self.codes = {}
+
+    def __call__(self, label):
+        code = self.codes.get(label)
+        if code is None:
+            code = len(self.codes)
+            self.codes[label] = code
+        return code
+
+    def labels(self):
+        return list(self.codes.keys())
+
+
+def _partial_result(node_ids, node_names, node_codes, node_identifiers, node_sources, node_labels,
+        subjects, objects, edge_codes, edge_labels, properties):
+    return {
+            'node_ids': node_ids,
+            'node_names': node_names,
+            'node_codes': np.array(node_codes, dtype=np.int32),
+            'node_identifiers': node_identifiers,
+            'node_sources': node_sources,
+            'node_labels': node_labels,
+            'subjects': subjects,
+            'objects': objects,
+            'edge_codes': np.array(edge_codes, dtype=np.int32),
+            'edge_labels': edge_labels,
+            'properties': properties,
+    }
+
+
+def parse_kg2_chunk(filename, start, end, edges_to_include=None, use_edge_properties=False):
+    """
+    Parses the kg2 jsonl rows in the byte range [start, end) of filename into a partial result.
+    """
+    node_ids = []
+    node_names = []
+    node_codes = []
+    node_identifiers = []
+    node_sources = []
+    subjects = []
+    objects = []
+    edge_codes = []
+    properties = []
+    node_types = _Codes()
+    edge_types = _Codes()
+    for line in _read_lines(filename, start, end):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if 'id' in row and 'category' in row and 'subject' not in row and 'object' not in row:
+            node_ids.append(row['id'])
+            node_names.append(row['name'] if 'name' in row else row['id'])
+            node_codes.append(node_types(row['category']))
+            node_identifiers.append(row['id'])
+            node_sources.append(row['category'])
+        else:
+            edge_type = row['predicate']
+            if edges_to_include is None or edge_type in edges_to_include:
+                subjects.append(row['subject'])
+                objects.append(row['object'])
+                edge_codes.append(edge_types(edge_type))
+                if use_edge_properties:
+                    properties.append(kg2_loader._edge_properties(row))
+    return _partial_result(node_ids, node_names, node_codes, node_identifiers, node_sources, node_types.labels(),
+            subjects, objects, edge_codes, edge_types.labels(), properties)
+
+
+def parse_spoke_chunk(filename, start, end, edges_to_include=None, use_edge_properties=False):
+    """
+    Parses the spoke (neo4j) jsonl rows in the byte range [start, end) of filename into a partial result.
+    """
+    node_ids = []
+    node_names = []
+    node_codes = []
+    node_identifiers = []
+    node_sources = []
+    subjects = []
+    objects = []
+    edge_codes = []
+    properties = []
+    node_types = _Codes()
+    edge_types = _Codes()
+    for line in _read_lines(filename, start, end):
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        if row['type'] == 'node':
+            row_properties = row['properties']
+            if 'name' in row_properties and row_properties['name'] != '':
+                row_name = row_properties['name']
+            elif 'pref_name' in row_properties and row_properties['pref_name'] != '':
+                row_name = row_properties['pref_name']
+            elif 'identifier' in row_properties and row_properties['identifier'] != '':
+                row_name = row_properties['identifier']
+            elif 'id' in row_properties and row_properties['id']:
+                row_name = row_properties['id']
+            else:
+                row_name = ''
+            row_identifier = ''
+            row_source = ''
+            if 'identifier' in row_properties and row_properties['identifier'] != '':
+                row_identifier = row_properties['identifier']
+            if 'source' in row_properties and row_properties['source'] != '':
+                row_source = row_properties['source']
+            node_ids.append(int(row['id']))
+            node_names.append(row_name)
+            node_codes.append(node_types(row['labels'][0]))
+            node_identifiers.append(row_identifier)
+            node_sources.append(row_source)
+        else:
+            edge_type = row['label']
+            if edges_to_include is None or edge_type in edges_to_include:
+                subjects.append(int(row['start']['id']))
+                objects.append(int(row['end']['id']))
+                edge_codes.append(edge_types(edge_type))
+                if use_edge_properties:
+                    properties.append(spoke_loader._edge_properties(row, edge_type))
+    return _partial_result(node_ids, node_names, node_codes, node_identifiers, node_sources, node_types.labels(),
+            subjects, objects, edge_codes, edge_types.labels(), properties)
+
+
+_PARSERS = {
+        'kg2': parse_kg2_chunk,
+        'spoke': parse_spoke_chunk,
+}
+
+
+def _parse_chunk(args):
+    schema, filename, start, end, edges_to_include, use_edge_properties = args
+    return _PARSERS[schema](filename, start, end, edges_to_include, use_edge_properties)
+
+
+def _global_codes(labels, global_types):
+    """
+    Maps a chunk's local labels to global codes (1-based, in first-seen order), adding unseen labels to global_types.
+    """
+    mapping = np.zeros(len(labels), dtype=np.int32)
+    for i, label in enumerate(labels):
+        if label not in global_types:
+            global_types[label] = len(global_types) + 1
+        mapping[i] = global_types[label]
+    return mapping
+
+
+def merge_partial_results(partials, remove_unused_nodes=True, use_edge_types=True, use_node_types=True,
+        reindex_edges=True, use_edge_properties=False, edge_format='dict'):
+    """
+    Merges partial results (in file order) into (nodes, edges, node_types, edge_types), as returned by import_kg2_jsonl.
+    """
+    node_types = {}
+    edge_types = {}
+    node_ids = []
+    node_names = []
+    node_codes = []
+    node_identifiers = []
+    node_sources = []
+    subjects = []
+    objects = []
+    edge_codes = []
+    properties = []
+    for p in partials:
+        node_ids.extend(p['node_ids'])
+        node_names.extend(p['node_names'])
+        node_codes.append(_global_codes(p['node_labels'], node_types)[p['node_codes']])
+        node_identifiers.extend(p['node_identifiers'])
+        node_sources.extend(p['node_sources'])
+        subjects.extend(p['subjects'])
+        objects.extend(p['objects'])
+        edge_codes.append(_global_codes(p['edge_labels'], edge_types)[p['edge_codes']])
+        properties.extend(p['properties'])
+    node_codes = np.concatenate(node_codes) if node_codes else np.zeros(0, dtype=np.int32)
+    edge_codes = np.concatenate(edge_codes) if edge_codes else np.zeros(0, dtype=np.int32)
+    # as in the serial import, the type dicts are empty if the types aren't used (edge tables always have edge types)
+    if not use_node_types:
+        node_types = {}
+    if not use_edge_types and edge_format != 'table':
+        edge_types = {}
+    if remove_unused_nodes:
+        # remove all nodes that don't have edges
+        has_edge = pd.Index(subjects).union(pd.Index(objects))
+        keep = np.flatnonzero(pd.Index(node_ids).isin(has_edge))
+    else:
+        keep = np.arange(len(node_ids))
+    codes = node_codes.tolist() if use_node_types else [True]*len(node_ids)
+    nodes = [(node_ids[i], node_names[i], codes[i], node_identifiers[i], node_sources[i]) for i in keep.tolist()]
+    if reindex_edges or edge_format == 'table':
+        # vectorized reindexing of node ids to positions in nodes (if an id occurs several times, the last node wins, as in the serial import)
+        node_index = pd.Index([n[0] for n in nodes])
+        positions = None
+        if not node_index.is_unique:
+            last_positions = pd.Series(np.arange(len(node_index)), index=node_index).groupby(level=0).last()
+            node_index = last_positions.index
+            positions = last_positions.to_numpy()
+        subject_positions = node_index.get_indexer(subjects)
+        object_positions = node_index.get_indexer(objects)
+        for ids, ids_positions in ((subjects, subject_positions), (objects, object_positions)):
+            missing = np.flatnonzero(ids_positions < 0)
+            if len(missing) > 0:
+                raise KeyError(ids[missing[0]])
+        if positions is not None:
+            subject_positions = positions[subject_positions]
+            object_positions = positions[object_positions]
+        if edge_format == 'table':
+            edges = EdgeTable(len(subjects), index_dtype=np.int32 if len(nodes) <= 2147483647 else np.int64)
+            edges.extend(subject_positions, object_positions, edge_codes, properties if use_edge_properties else None)
+            node_types = {v: k for k, v in node_types.items()}
+            edge_types = {v: k for k, v in edge_types.items()}
+            return nodes, edges, node_types, edge_types
+        edge_keys = zip(subject_positions.tolist(), object_positions.tolist())
+    else:
+        edge_keys = zip(subjects, objects)
+    if use_edge_properties:
+        edges = dict(zip(edge_keys, properties))
+    elif use_edge_types:
+        edges = dict(zip(edge_keys, edge_codes.tolist()))
+    else:
+        edges = dict.fromkeys(edge_keys, True)
+    node_types = {v: k for k, v in node_types.items()}
+    edge_types = {v: k for k, v in edge_types.items()}
+    return nodes, edges, node_types, edge_types
+
+
+def import_jsonl_parallel(schema, filenames, edges_to_include=None, remove_unused_nodes=True, use_edge_types=True,
+        use_node_types=True, verbose=True, reindex_edges=True, use_edge_properties=False,
+        n_processes=None, chunk_size=DEFAULT_CHUNK_SIZE, tmp_dir=None, edge_format='dict', progress=None):
+    """
+    Parallel import of jsonl files.
+
+    Args:
+        schema: 'kg2' or 'spoke'
+        filenames: list of jsonl files (nodes first), which can be compressed. BGZF files (see compressed_io.recompress) are read in parallel directly; other compressed files are decompressed into tmp_dir first.
+        n_processes: number of worker processes (default: os.cpu_count())
+        chunk_size: maximum number of bytes parsed by a worker at a time
+        progress: optional progress.Progress that collects the metrics of the load
+        see import_kg2_jsonl for the other arguments.
+
+    Returns:
+        nodes, edges, node_types, edge_types - see import_kg2_jsonl
+    """
+    if n_processes is None:
+        n_processes = os.cpu_count()
+    progress, owned = get_progress(progress, 'import_jsonl_parallel', verbose)
+    tmp_files = []
+    try:
+        tasks = []
+        for filename in filenames:
+            if filename is None:
+                continue
+            progress.files.append(filename)
+            progress.add_bytes(os.path.getsize(filename))
+            if compressed_io.detect_format(filename) in ('gzip', 'zstd'):
+                progress.log('decompressing %s', filename)
+                with progress.phase('decompress'):
+                    filename = decompress(filename, tmp_dir)
+                tmp_files.append(filename)
+            for start, end in line_chunks(filename, n_processes, chunk_size):
+                tasks.append((schema, filename, start, end, edges_to_include, use_edge_properties))
+        progress.log('parsing %d chunks with %d processes', len(tasks), n_processes)
+        with progress.phase('parse'):
+            if n_processes > 1 and len(tasks) > 1:
+                with mp.Pool(n_processes) as pool:
+                    partials = pool.map(_parse_chunk, tasks, chunksize=1)
+            else:
+                partials = [_parse_chunk(t) for t in tasks]
+    finally:
+        for filename in tmp_files:
+            os.remove(filename)
+    with progress.phase('merge'):
+        nodes, edges, node_types, edge_types = merge_partial_results(partials, remove_unused_nodes=remove_unused_nodes,
+                use_edge_types=use_edge_types, use_node_types=use_node_types, reindex_edges=reindex_edges,
+                use_edge_properties=use_edge_properties, edge_format=edge_format)
+    if owned:
+        progress.finish(nodes=len(nodes), edges=len(edges))
+    else:
+        progress.update(nodes=len(nodes), edges=len(edges))
+    return nodes, edges, node_types, edge_types
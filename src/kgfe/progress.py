@@ -0,0 +1,220 @@
+# Progress reporting and ingestion metrics for the loaders, on top of the logging module.
+#
+# Loaders log to the 'kgfe' logger: at INFO level if they are called with verbose=True, otherwise at DEBUG level.
+# Nothing is printed unless logging is configured, e.g. with logging.basicConfig(level=logging.INFO) or log_to_console().
+#
+# Every load creates a Progress object (or uses the one passed as progress=...), which counts rows, bytes read (the offset in the
+# compressed file for compressed files), nodes and edges, and times the loading phases (parse, filter, reindex, igraph).
+# Its summary (see Progress.summary) is kept in history, and can be exported as json with export_metrics to compare KG releases.
+
+import collections
+import io
+import json
+import logging
+import time
+
+logger = logging.getLogger('kgfe')
+
+# number of rows between progress messages
+LOG_EVERY = 100000
+
+# summaries of the most recent loads
+history = collections.deque(maxlen=100)
+
+
+def log(verbose, message, *args):
+    "Logs a message to the kgfe logger, at INFO level if verbose is True, otherwise at DEBUG level."
+    logger.log(logging.INFO if verbose else logging.DEBUG, message, *args)
+
+
+def log_to_console(level=logging.INFO):
+    "Prints the kgfe log messages at the given level or above to stderr."
+    if not any(getattr(h, '_kgfe_console', False) for h in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s: %(message)s'))
+        handler._kgfe_console = True
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def peak_rss():
+    "Returns the peak resident set size of this process in bytes, or None if it isn't available (e.g. on Windows)."
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak
+    return peak*1024
+
+
+class Progress:
+    """
+    Counters and phase timings of one load.
+
+    Args:
+        name: name of the load (e.g. the loader function)
+        verbose: whether progress messages are logged at INFO level (otherwise DEBUG)
+        log_every: number of rows between progress messages
+    """
+
+    def __init__(self, name, verbose=False, log_every=LOG_EVERY):
+        self.name = name
+        self.level = logging.INFO if verbose else logging.DEBUG
+        self.log_every = log_every
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.rows = 0
+        self.counters = {}
+        self.phases = {}
+        self.files = []
+        self._closed_bytes = 0
+        self._raw_files = []
+        self._phase = None
+
+    def open(self, filename):
+        """
+        Opens a text file (uncompressed, or compressed in any format supported by compressed_io) for reading,
+        and tracks the number of (compressed) bytes read from it.
+        """
+        from .compressed_io import open_binary
+        raw = _TrackedFile(filename)
+        self._raw_files.append(raw)
+        self.files.append(filename)
+        return io.TextIOWrapper(open_binary(io.BufferedReader(raw)), encoding='utf-8')
+
+    def bytes_read(self):
+        "Returns the number of bytes read from the files opened with open."
+        return self._closed_bytes + sum(raw.offset() for raw in self._raw_files)
+
+    def add_bytes(self, n_bytes):
+        "Adds bytes read outside of open (e.g. by worker processes)."
+        self._closed_bytes += n_bytes
+
+    def close_files(self):
+        for raw in self._raw_files:
+            raw.close()
+            self._closed_bytes += raw.offset()
+        self._raw_files = []
+
+    def elapsed(self):
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        return end - self.start_time
+
+    def update(self, rows=None, **counters):
+        "Sets the row count and other counters (e.g. nodes, edges), and logs the current throughput."
+        if rows is not None:
+            self.rows = rows
+        self.counters.update(counters)
+        if logger.isEnabledFor(self.level):
+            elapsed = max(self.elapsed(), 1e-9)
+            counts = ' '.join('{0}={1}'.format(k, v) for k, v in self.counters.items())
+            logger.log(self.level, '%s: %d rows (%.0f rows/s, %.1f MB/s) %s', self.name, self.rows, self.rows/elapsed,
+                    self.bytes_read()/elapsed/1e6, counts)
+
+    def phase(self, name):
+        "Returns a context manager that adds the time spent in it to the given phase."
+        return _Phase(self, name)
+
+    def start_phase(self, name):
+        "Starts timing a phase, ending the current one."
+        self.end_phase()
+        self._phase = _Phase(self, name).__enter__()
+
+    def end_phase(self):
+        "Ends the current phase (started with start_phase)."
+        if self._phase is not None:
+            self._phase.__exit__(None, None, None)
+            self._phase = None
+
+    def log(self, message, *args):
+        logger.log(self.level, '%s: ' + message, self.name, *args)
+
+    def finish(self, **counters):
+        "Sets the final counters, closes the tracked files, logs the summary and adds it to history. Returns the summary."
+        self.counters.update(counters)
+        self.end_phase()
+        self.close_files()
+        self.end_time = time.perf_counter()
+        summary = self.summary()
+        history.append(summary)
+        logger.log(self.level, '%s: done in %.2fs %s', self.name, summary['elapsed'], json.dumps(summary))
+        return summary
+
+    def summary(self):
+        "Returns a json-serializable dict of the metrics of this load."
+        elapsed = self.elapsed()
+        n_bytes = self.bytes_read()
+        return {
+            'name': self.name,
+            'files': list(self.files),
+            'elapsed': elapsed,
+            'rows': self.rows,
+            'rows_per_s': self.rows/elapsed if elapsed > 0 else None,
+            'bytes': n_bytes,
+            'bytes_per_s': n_bytes/elapsed if elapsed > 0 else None,
+            'counters': dict(self.counters),
+            'phases': dict(self.phases),
+            'peak_rss': peak_rss(),
+        }
+
+    def to_json(self, filename=None):
+        "Returns the summary as a json string, or writes it to filename."
+        data = json.dumps(self.summary(), indent=1)
+        if filename is None:
+            return data
+        with open(filename, 'w') as f:
+            f.write(data)
+
+
+class _TrackedFile(io.FileIO):
+    "A raw file that remembers its offset when it is closed."
+
+    final_offset = 0
+
+    def offset(self):
+        return self.final_offset if self.closed else self.tell()
+
+    def close(self):
+        if not self.closed:
+            self.final_offset = self.tell()
+        super().close()
+
+
+class _Phase:
+
+    def __init__(self, progress, name):
+        self.progress = progress
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        self.progress.phases[self.name] = self.progress.phases.get(self.name, 0.0) + duration
+        self.progress.log('%s took %.2fs', self.name, duration)
+        return False
+
+
+def get_progress(progress, name, verbose=False):
+    """
+    Returns (progress, owned): progress itself if it is a Progress object (created by a calling loader, or by the user to collect the metrics),
+    otherwise a new Progress for a load called name. The loader that owns the Progress calls its finish method.
+    """
+    if isinstance(progress, Progress):
+        return progress, False
+    return Progress(name, verbose), True
+
+
+def export_metrics(filename=None):
+    "Returns the summaries of the recent loads (see history) as a json string, or writes them to filename."
+    data = json.dumps(list(history), indent=1)
+    if filename is None:
+        return data
+    with open(filename, 'w') as f:
+        f.write(data)
@@ -0,0 +1,165 @@
+# Node and edge properties of a compiled graph (see compiled_graph), read on demand.
+#
+# Graphs loaded with load_kg2_igraph(..., lazy_properties=True) only keep the 'name' and 'category' vertex attributes and the edge 'type' attribute in memory.
+# The other properties (feature_name, identifier, source and the edge properties) stay in the compiled graph's column files, and are read
+# for the vertices and edges that are actually used, e.g. by graph_info.get_nodes_table, explanations.topic_pagerank and the subgraph functions in explanations.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from . import compiled_graph
+from .graph_store import GraphStore
+
+NODE_ATTRIBUTE_ORDER = ('name', 'feature_name', 'category', 'identifier', 'source')
+
+_stores = {}
+
+
+class PropertyStore(GraphStore):
+    """
+    A GraphStore with access to the node and edge property columns of the compiled graph.
+    """
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.node_columns = self.meta.get('node_columns', ['feature_name', 'identifier', 'source'])
+        self.edge_columns = self.meta.get('edge_property_columns', [])
+        self.edge_directory = os.path.join(directory, 'edge_properties')
+
+    def node_values(self, column, nodes=None):
+        "Returns the values of a node column for the given node indices (or all nodes)."
+        if column == 'category':
+            codes = self.category_codes if nodes is None else self.category_codes[np.asarray(nodes, dtype=np.int64)]
+            return compiled_graph._code_lookup(self.meta['node_types'])[np.asarray(codes)].tolist()
+        return self.node_strings(column, nodes)
+
+    def node_table(self, nodes=None, columns=None):
+        "Returns a DataFrame with one row per node index (or for all nodes) and the given columns (default: all node columns)."
+        if columns is None:
+            columns = ['name', 'feature_name', 'category'] + [c for c in self.node_columns if c != 'feature_name']
+        return pd.DataFrame({column: self.node_values(column, nodes) for column in columns})
+
+    def edge_values(self, column, edges):
+        """
+        Returns the values of an edge property column for the given edge indices (positions in the compiled CSR).
+        The 'source' and 'target' columns are the node ids of the ends of the edges.
+        """
+        edges = np.asarray(edges, dtype=np.int64)
+        if column == 'source':
+            return self.node_values('name', np.searchsorted(self.indptr, edges, side='right') - 1)
+        if column == 'target':
+            return self.node_values('name', np.asarray(self.indices[edges]))
+        return compiled_graph.read_column(self.edge_directory, column, edges)
+
+    def find_edges(self, node1, node2, directed=True):
+        "Returns the indices of the edges from node1 to node2 (in either direction if directed is False)."
+        start, end = self.indptr[node1], self.indptr[node1 + 1]
+        edges = start + np.flatnonzero(np.asarray(self.indices[start:end]) == node2)
+        if not directed and node1 != node2:
+            start, end = self.indptr[node2], self.indptr[node2 + 1]
+            edges = np.concatenate([edges, start + np.flatnonzero(np.asarray(self.indices[start:end]) == node1)])
+        return edges
+
+
+def get_property_store(graph):
+    """
+    Returns the PropertyStore of a graph loaded with lazy_properties=True (or of a subgraph of it), or None for other graphs.
+    """
+    if 'compiled_graph' not in graph.attributes():
+        return None
+    directory = graph['compiled_graph']
+    # the compiled graph is replaced (with a new meta.json) when it is rebuilt
+    key = (directory, os.stat(os.path.join(directory, 'meta.json')).st_mtime_ns)
+    if key not in _stores:
+        _stores[key] = PropertyStore(directory)
+    return _stores[key]
+
+
+def lazy_node_columns(graph):
+    "Returns the node columns of the graph's property store that aren't vertex attributes."
+    store = get_property_store(graph)
+    if store is None:
+        return []
+    attributes = set(graph.vs.attributes())
+    return [c for c in store.node_columns if c not in attributes]
+
+
+def node_attributes(graph, vertices):
+    """
+    Returns a list of attribute dicts for the given vertex indices, like graph.vs[v].attributes(), including the properties that are only in the property store.
+    """
+    vertices = list(vertices)
+    columns = lazy_node_columns(graph)
+    attributes = [graph.vs[v].attributes() for v in vertices]
+    if not columns:
+        return attributes
+    store = get_property_store(graph)
+    nodes = store.find_all([a['name'] for a in attributes])
+    values = {column: store.node_values(column, nodes) for column in columns}
+    result = []
+    for i, a in enumerate(attributes):
+        row = {}
+        for column in NODE_ATTRIBUTE_ORDER:
+            if column in a:
+                row[column] = a[column]
+            elif column in values:
+                row[column] = values[column][i]
+        for column, value in a.items():
+            row.setdefault(column, value)
+        for column in columns:
+            row.setdefault(column, values[column][i])
+        result.append(row)
+    return result
+
+
+def materialize(graph):
+    """
+    Sets the properties that are only in the property store as vertex and edge attributes of the graph (in place), e.g. before exporting a subgraph.
+    Does nothing for graphs that weren't loaded with lazy_properties=True. Returns the graph.
+    """
+    store = get_property_store(graph)
+    if store is None:
+        return graph
+    columns = lazy_node_columns(graph)
+    if columns:
+        nodes = store.find_all(graph.vs['name'])
+        for column in columns:
+            graph.vs[column] = store.node_values(column, nodes)
+    edge_columns = [c for c in store.edge_columns if c not in graph.es.attributes()]
+    if store.meta.get('edge_endpoints'):
+        edge_columns += [c for c in ['source', 'target'] if c not in graph.es.attributes()]
+    if edge_columns and len(graph.es) > 0:
+        nodes = store.find_all(graph.vs['name'])
+        has_type = 'type' in graph.es.attributes()
+        edge_types = store.edge_type
+        edge_type_index = {v: k for k, v in store.edge_types.items()}
+        positions = []
+        # every compiled edge is used once, so parallel edges (and reverse edges of undirected graphs) get their own rows.
+        # The edges of a lazy graph and its subgraphs are in compiled (CSR) order, so they are matched in order.
+        used = set()
+        for edge in graph.es:
+            node1 = nodes[edge.source]
+            node2 = nodes[edge.target]
+            candidates = store.find_edges(node1, node2, directed=graph.is_directed())
+            if has_type and len(candidates) > 1:
+                matching = candidates[np.asarray(edge_types[candidates]) == edge_type_index.get(edge['type'])]
+                if len(matching) > 0:
+                    candidates = matching
+            candidates = candidates.tolist()
+            position = next((c for c in candidates if c not in used), candidates[0] if candidates else -1)
+            used.add(position)
+            positions.append(position)
+        positions = np.array(positions, dtype=np.int64)
+        found = positions >= 0
+        for column in edge_columns:
+            values = [None]*len(positions)
+            for i, value in zip(np.flatnonzero(found).tolist(), store.edge_values(column, positions[found])):
+                values[i] = value
+            graph.es[column] = values
+    if not store.meta.get('typed_edges', True) and 'type' not in store.edge_columns and 'type' in graph.es.attributes():
+        # the edge types were only kept to match the edges (see compiled_graph.load_compiled_igraph)
+        del graph.es['type']
+    del graph['compiled_graph']
+    return graph
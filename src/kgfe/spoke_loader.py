@@ -1,22 +1,38 @@
 # Import spoke matrix from a neo4j csv dump.
 
 import csv
-import gzip
 import json
 import os
 
 import numpy as np
-from scipy import sparse, io
+from scipy import sparse
+
+from .compressed_io import base_name
+from .edge_table import EdgeTable
+from .kg2_loader import NON_KEY_OPTIONS, _append_pending_edges, _append_table_edge, _finish, to_sparse
+from .progress import get_progress, log
+
+
+def _edge_properties(row, edge_type):
+    "Returns the properties dict of a spoke jsonl edge row (for use_edge_properties=True)."
+    if 'properties' in row:
+        edge_properties = row['properties']
+    else:
+        edge_properties = {}
+    edge_properties['type'] = edge_type
+    edge_properties['id'] = int(row['id'])
+    return edge_properties
 
 
 # TODO: multiple edges between two nodes?
-def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=False, verbose=True, reindex_edges=True):
+def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=False, verbose=True, reindex_edges=True, progress=None):
     """
     Args:
         csv_filename: name of csv file
         edges_to_include: set of edge types
         remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
         reindex_edges: whether or not to use indices or original IDs in the edge list.
+        progress: optional progress.Progress that collects the metrics of the load
 
     Returns:
         nodes: list of (_id, _name, _labels_id) where _labels_id corresponds to a key in node_types
@@ -35,22 +51,20 @@ def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=Fa
     edge_types = {}
     # sets of nodes that have in-edges or out-edges (to use when deciding whether to remove nodes)
     node_has_edge = set()
+    progress, owned = get_progress(progress, 'import_spoke_csv', verbose)
+    progress.start_phase('parse')
     csv.field_size_limit(99999999)
-    if csv_filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(csv_filename, 'rt')
-    else:
-        f = open(csv_filename)
+    # handles gzip
+    f = progress.open(csv_filename)
     dr = csv.DictReader(f, dialect='unix')
-    for i, row in enumerate(dr):
-        if verbose and i % 100000 == 0:
-            print(i, 'nodes: ', len(node_index), 'edges: ', len(edges))
+    i = 0
+    for i, row in enumerate(dr, 1):
+        if i % progress.log_every == 0:
+            progress.update(i, nodes=len(node_index), edges=len(edges))
         # if this is a node
         if row['_id']:
-            print(row['license'])
             if row['name']:
                 row_name = row['name']
-                print(row_name)
             else:
                 row_name = row['pref_name']
             if row['_labels'] in node_types:
@@ -73,6 +87,9 @@ def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=Fa
                 else:
                     edges[(node1, node2)] = len(edge_types) + 1
                     edge_types[row['_type']] = len(edge_types) + 1
+    f.close()
+    progress.update(i, nodes=len(node_index), edges=len(edges))
+    progress.start_phase('filter')
     if remove_unused_nodes:
         # remove all nodes that don't have edges
         to_remove = set(node_index.keys()).difference(node_has_edge)
@@ -81,6 +98,7 @@ def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=Fa
         node_index = {n[0]: i for i, n in enumerate(nodes)}
     # convert edge indices
     if reindex_edges:
+        progress.start_phase('reindex')
         new_edges = {}
         for k, e in edges.items():
             node1, node2 = k
@@ -90,10 +108,11 @@ def import_spoke_csv(csv_filename, edges_to_include=None, remove_unused_nodes=Fa
         edges = new_edges
     node_types = {v: k for k, v in node_types.items()}
     edge_types = {v: k for k, v in edge_types.items()}
+    _finish(progress, owned, nodes, edges)
     return nodes, edges, node_types, edge_types
 
-# TODO: multiple edges between two nodes?
-def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True, use_edge_types=True, use_node_types=True, verbose=True, reindex_edges=True, use_edge_properties=False):
+# The default edge dict keeps only one edge between two nodes; use edge_format='table' to keep all of them.
+def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True, use_edge_types=True, use_node_types=True, verbose=True, reindex_edges=True, use_edge_properties=False, n_processes=1, edge_format='dict', progress=None):
     """
     Imports a jsonl file.
     Args:
@@ -101,6 +120,9 @@ def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True
         edges_to_include: set of edge types
         remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
         reindex_edges: whether or not to use indices or original IDs in the edge list.
+        edge_format: 'dict' (default) or 'table'. If 'table', edges is returned as an edge_table.EdgeTable, which keeps every edge (including parallel edges with different types) and always indexes into nodes (reindex_edges is ignored). Edges that come before their nodes in the file are added after the other edges.
+        n_processes: number of processes used to parse the file. If this is not 1, the file is parsed in parallel by parallel_import.import_jsonl_parallel (None uses all cores).
+        progress: optional progress.Progress that collects the metrics of the load
 
     Returns:
         nodes: list of (_id, _name, _labels_id) where _labels_id corresponds to a key in node_types
@@ -108,28 +130,34 @@ def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True
         node_types: dict of int: str (_labels)
         edge_types: dict of int: str (_type)
     """
+    if n_processes != 1:
+        from .parallel_import import import_jsonl_parallel
+        return import_jsonl_parallel('spoke', [filename], edges_to_include, remove_unused_nodes,
+                use_edge_types=use_edge_types, use_node_types=use_node_types, verbose=verbose, reindex_edges=reindex_edges,
+                use_edge_properties=use_edge_properties, n_processes=n_processes, edge_format=edge_format, progress=progress)
+    progress, owned = get_progress(progress, 'import_spoke_jsonl', verbose)
+    progress.start_phase('parse')
     nodes = []
     n_nodes = 0
     # mapping of _id to index in nodes
     node_index = {}
     # node_types is a map of string (
     node_types = {}
-    edges = {}
+    edges = EdgeTable() if edge_format == 'table' else {}
+    # table edges whose nodes haven't been read yet
+    pending_edges = []
     # edge_types is a map of string (_type) to node
     edge_types = {}
     # sets of nodes that have in-edges or out-edges (to use when deciding whether to remove nodes)
     node_has_edge = set()
-    if filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(filename, 'rt')
-    else:
-        f = open(filename)
+    # handles gzip
+    f = progress.open(filename)
     line = f.readline()
     i = 0
     while line:
         row = json.loads(line)
-        if verbose and i % 100000 == 0:
-            print(i, 'nodes: ', len(node_index), 'edges: ', len(edges))
+        if i % progress.log_every == 0:
+            progress.update(i, nodes=len(node_index), edges=len(edges))
         # if this is a node
         if row['type'] == 'node':
             row_name = ''
@@ -166,26 +194,41 @@ def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True
             if edges_to_include is None or edge_type in edges_to_include:
                 node1 = int(row['start']['id'])
                 node2 = int(row['end']['id'])
-                node_has_edge.add(node1)
-                node_has_edge.add(node2)
-                if use_edge_types:
-                    if edge_type in edge_types:
-                        edges[(node1, node2)] = edge_types[edge_type]
-                    else:
-                        edges[(node1, node2)] = len(edge_types) + 1
+                if edge_format == 'table':
+                    if edge_type not in edge_types:
                         edge_types[edge_type] = len(edge_types) + 1
+                    edge_properties = None
+                    if use_edge_properties:
+                        edge_properties = _edge_properties(row, edge_type)
+                    _append_table_edge(edges, pending_edges, node_index, node1, node2, edge_types[edge_type], edge_properties)
                 else:
-                    edges[(node1, node2)] = True
-                if use_edge_properties:
-                    if 'properties' in row:
-                        edge_properties = row['properties']
+                    node_has_edge.add(node1)
+                    node_has_edge.add(node2)
+                    if use_edge_types:
+                        if edge_type in edge_types:
+                            edges[(node1, node2)] = edge_types[edge_type]
+                        else:
+                            edges[(node1, node2)] = len(edge_types) + 1
+                            edge_types[edge_type] = len(edge_types) + 1
                     else:
-                        edge_properties = {}
-                    edge_properties['type'] = edge_type
-                    edge_properties['id'] = int(row['id'])
-                    edges[(node1, node2)] = edge_properties
+                        edges[(node1, node2)] = True
+                    if use_edge_properties:
+                        edges[(node1, node2)] = _edge_properties(row, edge_type)
         line = f.readline()
         i += 1
+    f.close()
+    progress.update(i, nodes=len(node_index), edges=len(edges))
+    progress.start_phase('filter')
+    if edge_format == 'table':
+        _append_pending_edges(edges, pending_edges, node_index)
+        if remove_unused_nodes:
+            keep = edges.remove_unused_nodes(len(nodes))
+            nodes = [nodes[i] for i in keep]
+        node_types = {v: k for k, v in node_types.items()}
+        edge_types = {v: k for k, v in edge_types.items()}
+        edges = edges.compact()
+        _finish(progress, owned, nodes, edges)
+        return nodes, edges, node_types, edge_types
     if remove_unused_nodes:
         # remove all nodes that don't have edges
         to_remove = set(node_index.keys()).difference(node_has_edge)
@@ -194,6 +237,7 @@ def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True
         node_index = {n[0]: i for i, n in enumerate(nodes)}
     # convert edge indices
     if reindex_edges:
+        progress.start_phase('reindex')
         new_edges = {}
         for k, e in edges.items():
             node1, node2 = k
@@ -203,10 +247,11 @@ def import_spoke_jsonl(filename, edges_to_include=None, remove_unused_nodes=True
         edges = new_edges
     node_types = {v: k for k, v in node_types.items()}
     edge_types = {v: k for k, v in edge_types.items()}
+    _finish(progress, owned, nodes, edges)
     return nodes, edges, node_types, edge_types
 
 
-def import_ckg_jsonl(filename, edges_to_include=None, remove_unused_nodes=False, use_edge_types=True, use_node_types=True, n_edges=300000000, n_nodes=20000000, verbose=True):
+def import_ckg_jsonl(filename, edges_to_include=None, remove_unused_nodes=False, use_edge_types=True, use_node_types=True, n_edges=None, n_nodes=None, verbose=True, batch_size=1000000, progress=None):
     """
     Imports a jsonl file.
     This tries to be less memory-intensive than the other import procedure.
@@ -214,7 +259,10 @@ def import_ckg_jsonl(filename, edges_to_include=None, remove_unused_nodes=False,
         filename: name of jsonl file
         edges_to_include: set of edge types
         remove_unused_nodes: True if nodes with no in- or out-edges are to be removed.
-        n_edges: An upper bound on the number of edges (does not have to be exact, but should be greater than the actual number of edges)
+        n_edges: Optional estimate of the number of edges, used as the initial capacity of the edge arrays. The arrays grow as needed, so this doesn't have to be an upper bound.
+        n_nodes: Unused, kept for backwards compatibility.
+        batch_size: number of edges that are parsed before being copied into the edge arrays.
+        progress: optional progress.Progress that collects the metrics of the load
 
     Returns:
         nodes: list of (_id, _name, _labels_id) where _labels_id corresponds to a key in node_types
@@ -228,25 +276,26 @@ def import_ckg_jsonl(filename, edges_to_include=None, remove_unused_nodes=False,
     node_index = {}
     # node_types is a map of string (
     node_types = {}
-    edges_start = np.zeros(n_edges, dtype=np.int64)
-    edges_end = np.zeros(n_edges, dtype=np.int64)
-    edges_values = np.zeros(n_edges, dtype=np.uint8)
+    # edges are collected in small python lists and copied into the table every batch_size edges,
+    # so peak memory follows the actual number of edges.
+    edge_table = EdgeTable(n_edges or batch_size)
+    edges_start = []
+    edges_end = []
+    edges_values = []
     # edge_types is a map of string (_type) to node
     edge_types = {}
-    # sets of nodes that have in-edges or out-edges (to use when deciding whether to remove nodes)
-    if filename.endswith('.gz'):
-        # handle gzip
-        f = gzip.open(filename, 'rt')
-    else:
-        f = open(filename)
+    progress, owned = get_progress(progress, 'import_ckg_jsonl', verbose)
+    progress.start_phase('parse')
+    # handles gzip
+    f = progress.open(filename)
     line = f.readline()
     i = 0
     # ne is number of current edges
     ne = 0
     while line:
         row = json.loads(line)
-        if verbose and i % 100000 == 0:
-            print(i, 'nodes: ', len(node_index), 'edges: ', ne)
+        if i % progress.log_every == 0:
+            progress.update(i, nodes=len(node_index), edges=ne)
         # if this is a node
         if row['type'] == 'node':
             if 'name' in row['properties'] and row['properties']['name'] != '':
@@ -272,65 +321,72 @@ def import_ckg_jsonl(filename, edges_to_include=None, remove_unused_nodes=False,
             n_nodes += 1
         # if this row is an edge
         # in neo4j exports, edges always come after nodes.
-        # assumption: there are less than 255 edge types
+        # edge type codes are stored as int16 (upcast to int32 if there are more than 32767 edge types)
         else:
             edge_type = row['label']
             if edges_to_include is None or edge_type in edges_to_include:
                 node1 = node_index[int(row['start']['id'])]
                 node2 = node_index[int(row['end']['id'])]
-                edges_start[ne] = node1
-                edges_end[ne] = node2
+                edges_start.append(node1)
+                edges_end.append(node2)
                 if use_edge_types:
                     if edge_type in edge_types:
-                        edges_values[ne] = edge_types[edge_type]
+                        edges_values.append(edge_types[edge_type])
                     else:
-                        edges_values[ne] = len(edge_types) + 1
+                        edges_values.append(len(edge_types) + 1)
                         edge_types[edge_type] = len(edge_types) + 1
                 else:
-                    edges_values[ne] = 1
+                    edges_values.append(1)
                 ne += 1
+                if len(edges_start) >= batch_size:
+                    edge_table.extend(edges_start, edges_end, edges_values)
+                    edges_start, edges_end, edges_values = [], [], []
         line = f.readline()
         i += 1
-    edges_values = edges_values[:ne]
-    edges_start = edges_start[:ne]
-    edges_end = edges_end[:ne]
-    edges = sparse.coo_array((edges_values, (edges_start, edges_end)), shape=(len(nodes), len(nodes)))
+    f.close()
+    progress.update(i, nodes=len(node_index), edges=ne)
+    progress.start_phase('reindex')
+    edge_table.extend(edges_start, edges_end, edges_values)
+    edge_table.compact()
+    edges = edge_table.to_coo(len(nodes))
     node_types = {v: k for k, v in node_types.items()}
     edge_types = {v: k for k, v in edge_types.items()}
+    _finish(progress, owned, nodes, edge_table)
     return nodes, edges, node_types, edge_types
 
 
-def to_sparse(nodes, edges):
+def load_spoke(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=False, mtx_filename='spoke.npz', **kwargs):
     """
-    Returns a DOK matrix from the edges...
-    """
-    n_nodes = len(nodes)
-    edge_matrix = sparse.dok_array((n_nodes, n_nodes), dtype=int)
-    for k, v in sorted(edges.items()):
-        n1, n2 = k
-        edge_matrix[n1, n2] = v
-    return edge_matrix
-
+    Returns nodes, edges, node_types, edge_types and the sparse adjacency matrix (see to_sparse).
 
-def load_spoke(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=False, mtx_filename='spoke.mtx', **kwargs):
-    if filename.endswith('.csv') or filename.endswith('.csv.gz'):
+    The matrix is cached in mtx_filename (an npz file; a .mtx extension is replaced with .npz), and is only reused if it was built from the same file and options.
+    """
+    from . import compiled_graph
+    from .kg2_loader import _matrix_filename
+    if base_name(filename).endswith('.csv'):
         nodes, edges, node_types, edge_types = import_spoke_csv(filename, edges_to_include, remove_unused_nodes, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
+    elif base_name(filename).endswith('.json') or base_name(filename).endswith('.jsonl'):
         nodes, edges, node_types, edge_types = import_spoke_jsonl(filename, edges_to_include, remove_unused_nodes, **kwargs)
-    if not os.path.exists(mtx_filename):
+    mtx_filename = _matrix_filename(mtx_filename)
+    key_options = {k: v for k, v in kwargs.items() if k not in NON_KEY_OPTIONS}
+    key = compiled_graph.source_key([filename], loader='spoke_matrix',
+            edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes, **key_options)
+    edge_matrix = compiled_graph.read_matrix(mtx_filename, key)
+    if edge_matrix is None:
         edge_matrix = to_sparse(nodes, edges)
-        io.mmwrite(mtx_filename, edge_matrix)
-    else:
-        edge_matrix = io.mmread(mtx_filename)
+        compiled_graph.write_matrix(mtx_filename, edge_matrix, key)
     return nodes, edges, node_types, edge_types, edge_matrix
 
 
 def load_spoke_networkx(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=True, directed=False, **kwargs):
     import networkx as nx
-    if filename.endswith('.csv') or filename.endswith('.csv.gz'):
+    if base_name(filename).endswith('.csv'):
         nodes, edges, node_types, edge_types = import_spoke_csv(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
+    elif base_name(filename).endswith('.json') or base_name(filename).endswith('.jsonl'):
         nodes, edges, node_types, edge_types = import_spoke_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, **kwargs)
+    if isinstance(edges, EdgeTable):
+        from .kg2_loader import _edge_table_to_networkx
+        return _edge_table_to_networkx(nodes, edges, node_types, edge_types, directed)
     edge_list = edges.keys()
     if directed:
         graph = nx.from_edgelist(edge_list, nx.DiGraph)
@@ -352,65 +408,46 @@ def load_spoke_networkx(filename='spoke.csv', edges_to_include=None, remove_unus
     nx.set_edge_attributes(graph, edge_attributes)
     return graph
 
-def load_spoke_igraph(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=True, directed=False, verbose=False, low_memory=False, **kwargs):
+def load_spoke_igraph(filename='spoke.csv', edges_to_include=None, remove_unused_nodes=True, directed=False, verbose=False, low_memory=False, use_cache=False, cache_dir=None, lazy_properties=False, **kwargs):
     """
     Imports the spoke file as an igraph. The file can be a csv or json/jsonl export from neo4j, and it can be gzipped. The spoke IDs are converted to strings because igraph is very slow if the ids are ints.
+
+    If use_cache is True (it is off by default), the parsed graph is compiled into cache_dir on the first load and read back from there while the file is unchanged (see kg2_loader.load_kg2_igraph).
+    If lazy_properties is True, the graph only keeps the node names and categories in memory, and the other properties are read from the compiled graph when needed (see property_store). This implies use_cache.
     """
-    import igraph as ig
+    from . import compiled_graph
+    from .kg2_loader import load_kg2_igraph_from_data
     if low_memory:
         kwargs['use_edge_properties'] = False
-    if filename.endswith('.csv') or filename.endswith('.csv.gz'):
-        nodes, edges, node_types, edge_types = import_spoke_csv(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, verbose=verbose, **kwargs)
-    elif filename.endswith('.json') or filename.endswith('.json.gz') or filename.endswith('.jsonl') or filename.endswith('.jsonl.gz'):
-        nodes, edges, node_types, edge_types = import_spoke_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, verbose=verbose, **kwargs)
+    use_cache = use_cache or lazy_properties
+    progress, owned = get_progress(kwargs.pop('progress', None), 'load_spoke_igraph', verbose)
+    if use_cache:
+        key_options = {k: v for k, v in kwargs.items() if k not in NON_KEY_OPTIONS}
+        key = compiled_graph.source_key([filename], loader='spoke',
+                edges_to_include=edges_to_include, remove_unused_nodes=remove_unused_nodes, **key_options)
+        directory = compiled_graph.cache_path(key, cache_dir)
+        if compiled_graph.is_valid(directory, key):
+            log(verbose, 'Loading compiled graph from %s', directory)
+            return compiled_graph.load_compiled_igraph(directory, directed=directed, low_memory=low_memory, lazy_properties=lazy_properties)
+    if base_name(filename).endswith('.csv'):
+        nodes, edges, node_types, edge_types = import_spoke_csv(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, verbose=verbose, progress=progress, **kwargs)
+    elif base_name(filename).endswith('.json') or base_name(filename).endswith('.jsonl'):
+        nodes, edges, node_types, edge_types = import_spoke_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, verbose=verbose, progress=progress, **kwargs)
     else:
-        raise ValueError('File has to be a csv, csv.gz, json, json.gz file')
-    if verbose:
-        print('Done loading data, creating edge list')
-    # use igraph.graph.DictList
-    if low_memory:
-        edge_list = ({'s': str(v[0]), 't': str(v[1])} for v in edges.keys())
-        del edges
+        raise ValueError('File has to be a csv or json/jsonl file, optionally compressed')
+    progress.log('done loading data, creating edge list')
+    if use_cache:
+        progress.log('writing compiled graph to %s', directory)
+        with progress.phase('compile'):
+            compiled_graph.compile_graph(nodes, edges, node_types, edge_types, directory, key=key)
+        del nodes, edges
+        with progress.phase('igraph'):
+            graph = compiled_graph.load_compiled_igraph(directory, directed=directed, low_memory=low_memory, lazy_properties=lazy_properties)
     else:
-        if 'use_edge_properties' in kwargs and kwargs['use_edge_properties'] == True:
-            # igraph doesn't allow lists as edge properties, so we are converting them to a string.
-            for v, e in edges.items():
-                for key, value in e.copy().items():
-                    if isinstance(value, list) or isinstance(value, dict):
-                        e[key] = str(value)
-            edge_list = ({'source': str(v[0]), 'target': str(v[1]), **e} for v, e in edges.items())
-        else:
-            edge_list = ({'source': str(v[0]), 'target': str(v[1]), 'type': edge_types[e]} for v, e in edges.items())
-    if verbose:
-        print('creating node list')
-    # set node attributes
-    # convert the node id to a string, bc
-    if low_memory:
-        node_list = ({
-             'name': str(n[0]),
-             'feature_name':  n[1],
-             'category': node_types[n[2]],
-             'identifier': n[3],
-            } for n in nodes)
-        del nodes
-    else:
-        node_list = ({
-                'name': str(n[0]),
-                'feature_name':  n[1],
-                'category': node_types[n[2]],
-                'identifier': n[3],
-                'source': n[4],
-        } for n in nodes)
-    if verbose:
-        print('calling igraph.Graph.DictList')
-    if low_memory:
-        graph = ig.Graph.DictList(node_list, edge_list, directed=directed,
-                edge_foreign_keys=('s', 't'),
-                iterative=False)
-    else:
-        graph = ig.Graph.DictList(node_list, edge_list, directed=directed,
-                edge_foreign_keys=('source', 'target'),
-                iterative=False)
+        with progress.phase('igraph'):
+            graph = load_kg2_igraph_from_data(nodes, edges, node_types, edge_types, remove_unused_nodes, directed, verbose, low_memory, **kwargs)
+    if owned:
+        progress.finish(nodes=graph.vcount(), edges=graph.ecount())
     return graph
 
 
@@ -422,8 +459,7 @@ def load_kg2_igraph(filename='graph.jsonl.gz', edges_to_include=None, remove_unu
     if low_memory:
         kwargs['use_edge_properties'] = False
     nodes, edges, node_types, edge_types = import_kg2_jsonl(filename, edges_to_include, remove_unused_nodes, reindex_edges=False, verbose=verbose, **kwargs)
-    if verbose:
-        print('Done loading data, creating edge list')
+    log(verbose, 'Done loading data, creating edge list')
     # use igraph.graph.DictList
     if low_memory:
         edge_list = ({'s': str(v[0]), 't': str(v[1])} for v in edges.keys())
@@ -438,8 +474,7 @@ def load_kg2_igraph(filename='graph.jsonl.gz', edges_to_include=None, remove_unu
             edge_list = ({'source': str(v[0]), 'target': str(v[1]), **e} for v, e in edges.items())
         else:
             edge_list = ({'source': str(v[0]), 'target': str(v[1]), 'type': edge_types[e]} for v, e in edges.items())
-    if verbose:
-        print('creating node list')
+    log(verbose, 'creating node list')
     # set node attributes
     # convert the node id to a string, bc
     if low_memory:
@@ -458,8 +493,7 @@ def load_kg2_igraph(filename='graph.jsonl.gz', edges_to_include=None, remove_unu
                 'identifier': n[3],
                 'source': n[4],
         } for n in nodes)
-    if verbose:
-        print('calling igraph.Graph.DictList')
+    log(verbose, 'calling igraph.Graph.DictList')
     if low_memory:
         graph = ig.Graph.DictList(node_list, edge_list, directed=directed,
                 edge_foreign_keys=('s', 't'),
@@ -2,6 +2,8 @@
 # based on the networkx implementation at https://networkx.org/documentation/stable/_modules/networkx/algorithms/approximation/steinertree.html#steiner_tree
 import igraph as ig
 
+from .graph_index import resolve_nodes
+
 
 def steiner_tree(G, source_nodes, method='takahashi'):
     """
@@ -12,7 +14,7 @@ def steiner_tree(G, source_nodes, method='takahashi'):
 
     Returns: a subgraph
     """
-    indices = [G.vs.find(name=i).index for i in source_nodes]
+    indices = resolve_nodes(G, source_nodes).tolist()
     if method == 'takahashi':
         tree = takahashi_matsuyama_steiner_tree(G, indices)
     elif method == 'shortest_paths':
@@ -0,0 +1,240 @@
+# Synthetic knowledge graphs in the kg2 and SPOKE dump formats, for benchmarks and tests (see benchmark).
+#
+# Nodes get a category from a fixed mix (more genes and proteins than diseases, as in kg2 and SPOKE), and every edge gets a predicate
+# from a fixed mix, whose subject and object are drawn from the categories allowed for that predicate (e.g. treats is
+# SmallMolecule -> Disease). Endpoints are drawn with probability proportional to a power-law weight (rank ** -exponent, with the
+# ranks shuffled), so that the degrees are heavy-tailed like those of real knowledge graphs, with a few hubs of very high degree.
+# Edges are generated and written in chunks, so graphs of 10^8 edges can be written with a few GB of memory.
+
+import gzip
+
+import numpy as np
+import pandas as pd
+
+# (kg2 category, kg2 id prefix, SPOKE label, SPOKE source, fraction of nodes)
+CATEGORIES = [
+        ('biolink:Gene', 'NCBIGene', 'Gene', 'Entrez Gene', 0.25),
+        ('biolink:Protein', 'UniProtKB', 'Protein', 'UniProt', 0.25),
+        ('biolink:SmallMolecule', 'CHEBI', 'Compound', 'ChEMBL', 0.2),
+        ('biolink:Disease', 'MONDO', 'Disease', 'Disease Ontology', 0.05),
+        ('biolink:PhenotypicFeature', 'HP', 'SideEffect', 'SIDER', 0.05),
+        ('biolink:Pathway', 'REACT', 'Pathway', 'Reactome', 0.05),
+        ('biolink:BiologicalProcess', 'GO', 'BiologicalProcess', 'Gene Ontology', 0.1),
+        ('biolink:AnatomicalEntity', 'UBERON', 'Anatomy', 'Uberon', 0.05),
+]
+
+# (kg2 predicate, SPOKE label, subject categories, object categories, fraction of edges), categories are indices into CATEGORIES
+PREDICATES = [
+        ('biolink:interacts_with', 'INTERACTS_PiP', [1], [1], 0.3),
+        ('biolink:gene_product_of', 'ENCODES_GeP', [0], [1], 0.05),
+        ('biolink:affects', 'UPREGULATES_CuG', [2], [0, 1], 0.15),
+        ('biolink:treats', 'TREATS_CtD', [2], [3], 0.02),
+        ('biolink:gene_associated_with_condition', 'ASSOCIATES_DaG', [0], [3], 0.05),
+        ('biolink:has_phenotype', 'PRESENTS_DpS', [3], [4], 0.03),
+        ('biolink:causes_adverse_event', 'CAUSES_CcSE', [2], [4], 0.05),
+        ('biolink:participates_in', 'PARTICIPATES_GpPW', [0, 1], [5, 6], 0.2),
+        ('biolink:expressed_in', 'EXPRESSES_AeG', [0], [7], 0.1),
+        ('biolink:subclass_of', 'ISA_DiD', [3], [3], 0.05),
+]
+
+# exponent of the power-law node weights; 0.7 gives a degree distribution with a tail exponent of about 2.4
+DEGREE_EXPONENT = 0.7
+
+# average degree (edges per node) if n_nodes isn't given
+EDGES_PER_NODE = 10
+
+# number of edges generated and written at a time
+CHUNK_SIZE = 1000000
+
+
+def _open_output(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wt', encoding='utf-8', compresslevel=1)
+    return open(filename, 'w', encoding='utf-8')
+
+
+def _format(filename):
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith('.tsv'):
+        return 'tsv'
+    return 'jsonl'
+
+
+def _n_nodes(n_edges, n_nodes):
+    if n_nodes is None:
+        n_nodes = n_edges//EDGES_PER_NODE
+    return max(n_nodes, 2*len(CATEGORIES))
+
+
+def sample_nodes(n_nodes, seed=0):
+    """
+    Returns the category of every node: an array of n_nodes indices into CATEGORIES, in random order.
+    Every category has at least one node.
+    """
+    rng = np.random.default_rng(seed)
+    fractions = np.array([c[-1] for c in CATEGORIES])
+    counts = np.maximum(1, np.floor(fractions/fractions.sum()*n_nodes).astype(np.int64))
+    counts[0] += n_nodes - counts.sum()
+    categories = np.repeat(np.arange(len(CATEGORIES)), counts)
+    rng.shuffle(categories)
+    return categories
+
+
+def sample_edges(categories, n_edges, seed=0, exponent=DEGREE_EXPONENT, chunk_size=CHUNK_SIZE):
+    """
+    Generates the edges of a synthetic graph in chunks.
+
+    Args:
+        categories: category of every node, as returned by sample_nodes
+        n_edges: number of edges
+        seed: random seed
+        exponent: exponent of the power-law node weights (0 gives uniform degrees)
+        chunk_size: number of edges per chunk
+
+    Returns:
+        generator of (subjects, objects, predicates) arrays, where subjects and objects are node indices and predicates are
+        indices into PREDICATES
+    """
+    rng = np.random.default_rng([seed, 1])
+    n_nodes = len(categories)
+    weights = (rng.permutation(n_nodes) + 1.0)**-exponent
+    # node pools and cumulative weights of the subject and object categories of every predicate
+    pools = []
+    for _, _, subject_categories, object_categories, _ in PREDICATES:
+        pool = []
+        for allowed in [subject_categories, object_categories]:
+            nodes = np.flatnonzero(np.isin(categories, allowed))
+            pool.append((nodes, np.cumsum(weights[nodes])))
+        pools.append(pool)
+    fractions = np.array([p[-1] for p in PREDICATES])
+    fractions = fractions/fractions.sum()
+    for start in range(0, n_edges, chunk_size):
+        n = min(chunk_size, n_edges - start)
+        predicates = rng.choice(len(PREDICATES), size=n, p=fractions).astype(np.int32)
+        subjects = np.empty(n, dtype=np.int64)
+        objects = np.empty(n, dtype=np.int64)
+        for p, pool in enumerate(pools):
+            rows = np.flatnonzero(predicates == p)
+            for endpoints, (nodes, cumulative) in zip([subjects, objects], pool):
+                draws = rng.random(len(rows))*cumulative[-1]
+                endpoints[rows] = nodes[np.minimum(np.searchsorted(cumulative, draws, side='right'), len(nodes) - 1)]
+        yield subjects, objects, predicates
+
+
+def _kg2_ids(categories):
+    prefixes = [c[1] for c in CATEGORIES]
+    return ['{0}:{1}'.format(prefixes[c], i) for i, c in enumerate(categories.tolist())]
+
+
+def generate_kg2(node_filename, edge_filename=None, n_edges=10000, n_nodes=None, seed=0, exponent=DEGREE_EXPONENT, chunk_size=CHUNK_SIZE):
+    """
+    Writes a synthetic graph in the kg2 format, as csv/tsv or jsonl files (chosen by the extension, optionally .gz).
+
+    Args:
+        node_filename: name of the node file
+        edge_filename: name of the edge file. If None, the edges are written to node_filename after the nodes (jsonl only).
+        n_edges: number of edges
+        n_nodes: number of nodes (default: n_edges/EDGES_PER_NODE)
+        seed: random seed; the same seed and chunk_size give the same files
+        exponent: exponent of the power-law node weights
+        chunk_size: number of edges generated and written at a time
+
+    Returns:
+        dict with the number of nodes and edges and the names of the files
+    """
+    n_nodes = _n_nodes(n_edges, n_nodes)
+    file_format = _format(node_filename)
+    if edge_filename is None and file_format != 'jsonl':
+        raise ValueError('nodes and edges can only be written to the same file in the jsonl format')
+    categories = sample_nodes(n_nodes, seed)
+    ids = np.array(_kg2_ids(categories), dtype=object)
+    category_names = np.array([c[0] for c in CATEGORIES], dtype=object)
+    predicate_names = np.array([p[0] for p in PREDICATES], dtype=object)
+    node_file = _open_output(node_filename)
+    edge_file = node_file if edge_filename is None else _open_output(edge_filename)
+    try:
+        if file_format == 'jsonl':
+            for start in range(0, n_nodes, chunk_size):
+                node_file.write(''.join('{{"id": "{0}", "name": "node {1}", "category": "{2}"}}\n'.format(i, n, c)
+                    for n, (i, c) in enumerate(zip(ids[start:start + chunk_size], category_names[categories[start:start + chunk_size]]), start)))
+        else:
+            sep = ',' if file_format == 'csv' else '\t'
+            pd.DataFrame({'id': ids, 'name': ['node {0}'.format(i) for i in range(n_nodes)], 'category': category_names[categories]}).to_csv(
+                    node_file, sep=sep, index=False)
+        start = 0
+        for subjects, objects, predicates in sample_edges(categories, n_edges, seed, exponent, chunk_size):
+            if file_format == 'jsonl':
+                edge_file.write(''.join('{{"id": {0}, "subject": "{1}", "object": "{2}", "predicate": "{3}"}}\n'.format(n, s, o, p)
+                    for n, (s, o, p) in enumerate(zip(ids[subjects], ids[objects], predicate_names[predicates]), start)))
+            else:
+                pd.DataFrame({'id': np.arange(start, start + len(subjects)), 'subject': ids[subjects], 'object': ids[objects],
+                    'predicate': predicate_names[predicates]}).to_csv(edge_file, sep=sep, index=False, header=(start == 0))
+            start += len(subjects)
+        if n_edges == 0 and file_format != 'jsonl':
+            edge_file.write(sep.join(['id', 'subject', 'object', 'predicate']) + '\n')
+    finally:
+        node_file.close()
+        if edge_file is not node_file:
+            edge_file.close()
+    return {'n_nodes': n_nodes, 'n_edges': n_edges, 'files': [node_filename] + ([edge_filename] if edge_filename is not None else [])}
+
+
+def generate_spoke(filename, n_edges=10000, n_nodes=None, seed=0, exponent=DEGREE_EXPONENT, chunk_size=CHUNK_SIZE):
+    """
+    Writes a synthetic graph in the SPOKE format: a neo4j jsonl export (as read by spoke_loader.import_spoke_jsonl and import_ckg_jsonl)
+    or a neo4j csv export (as read by spoke_loader.import_spoke_csv), chosen by the extension (optionally .gz).
+    See generate_kg2 for the arguments.
+    """
+    n_nodes = _n_nodes(n_edges, n_nodes)
+    file_format = _format(filename)
+    categories = sample_nodes(n_nodes, seed)
+    labels = np.array([c[2] for c in CATEGORIES], dtype=object)[categories]
+    sources = np.array([c[3] for c in CATEGORIES], dtype=object)[categories]
+    predicate_names = np.array([p[1] for p in PREDICATES], dtype=object)
+    with _open_output(filename) as f:
+        if file_format == 'jsonl':
+            for start in range(0, n_nodes, chunk_size):
+                f.write(''.join('{{"type": "node", "id": "{0}", "labels": ["{1}"], "properties": {{"name": "node {0}", "identifier": {0}, "source": "{2}"}}}}\n'.format(i, l, s)
+                    for i, (l, s) in enumerate(zip(labels[start:start + chunk_size], sources[start:start + chunk_size]), start)))
+        else:
+            pd.DataFrame({'_id': np.arange(n_nodes), '_labels': ':' + labels, 'name': ['node {0}'.format(i) for i in range(n_nodes)],
+                'pref_name': '', '_start': '', '_end': '', '_type': ''}).to_csv(f, index=False)
+        start = n_nodes
+        for subjects, objects, predicates in sample_edges(categories, n_edges, seed, exponent, chunk_size):
+            if file_format == 'jsonl':
+                f.write(''.join('{{"type": "relationship", "id": "{0}", "label": "{1}", "start": {{"id": "{2}"}}, "end": {{"id": "{3}"}}, "properties": {{}}}}\n'.format(n, p, s, o)
+                    for n, (s, o, p) in enumerate(zip(subjects.tolist(), objects.tolist(), predicate_names[predicates]), start)))
+            else:
+                pd.DataFrame({'_id': '', '_labels': '', 'name': '', 'pref_name': '', '_start': subjects, '_end': objects,
+                    '_type': predicate_names[predicates]}).to_csv(f, index=False, header=False)
+            start += len(subjects)
+    return {'n_nodes': n_nodes, 'n_edges': n_edges, 'files': [filename]}
+
+
+def generate_dataframe(n_edges=10000, n_nodes=None, seed=0, exponent=DEGREE_EXPONENT):
+    """
+    Returns a synthetic graph as an edge DataFrame in the format of graph_info.df_to_graph (one row per edge, with the ids, names and
+    categories of the subject and object).
+    """
+    n_nodes = _n_nodes(n_edges, n_nodes)
+    categories = sample_nodes(n_nodes, seed)
+    prefixes = np.array([c[1] for c in CATEGORIES], dtype=object)[categories]
+    category_names = np.array([c[0] for c in CATEGORIES], dtype=object)[categories]
+    names = np.array(['node {0}'.format(i) for i in range(n_nodes)], dtype=object)
+    predicate_names = np.array([p[0] for p in PREDICATES], dtype=object)
+    chunks = []
+    for subjects, objects, predicates in sample_edges(categories, n_edges, seed, exponent, max(n_edges, 1)):
+        chunks.append(pd.DataFrame({
+            'subject_id_prefix': prefixes[subjects], 'subject_id': subjects, 'subject_name': names[subjects],
+            'subject_category': category_names[subjects],
+            'object_id_prefix': prefixes[objects], 'object_id': objects, 'object_name': names[objects],
+            'object_category': category_names[objects],
+            'predicate': predicate_names[predicates], 'Primary_Knowledge_Source': 'infores:synthetic', 'Knowledge_Source': 'infores:synthetic',
+            'publications': '',
+        }))
+    if not chunks:
+        return pd.DataFrame(columns=['subject_id_prefix', 'subject_id', 'subject_name', 'subject_category', 'object_id_prefix', 'object_id',
+            'object_name', 'object_category', 'predicate', 'Primary_Knowledge_Source', 'Knowledge_Source', 'publications'])
+    return chunks[0]
@@ -1,12 +1,96 @@
 # API for https://academic.oup.com/bioinformatics/article/38/17/4194/6633929, https://togoid.dbcls.jp/apidoc/
-import functools
+#
+# The ids are sent in batches of at most BATCH_SIZE ids (to stay below the URL length limit), using a thread pool with one
+# keep-alive connection per thread. The converted ids are stored per id in a sqlite database in the kgfe cache directory,
+# so ids that were already converted (in any process) aren't sent again.
+import http.client
 import json
+import os
+import sqlite3
+import threading
 import urllib.parse
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-# TODO: make this cached?
-@functools.cache
-def convert_ids(ids, source, dest):
+API_URL = 'https://api.togoid.dbcls.jp/convert'
+BATCH_SIZE = 100
+N_THREADS = 4
+TIMEOUT = 60
+
+_connections = threading.local()
+
+
+def cache_filename():
+    "Returns the sqlite file where the converted ids are cached."
+    from .compiled_graph import default_cache_dir
+    return os.path.join(default_cache_dir(), 'togoid.sqlite')
+
+
+def _open_cache(filename):
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(filename)
+    db.execute('CREATE TABLE IF NOT EXISTS conversions (route TEXT, id TEXT, results TEXT, PRIMARY KEY (route, id))')
+    return db
+
+
+def _read_cache(db, route, ids):
+    "Returns a dict of id: list of converted ids for the ids that are in the cache."
+    cached = {}
+    # sqlite limits the number of query parameters
+    for start in range(0, len(ids), 500):
+        batch = ids[start:start+500]
+        query = 'SELECT id, results FROM conversions WHERE route = ? AND id IN ({0})'.format(','.join('?'*len(batch)))
+        for i, results in db.execute(query, [route] + batch):
+            cached[i] = json.loads(results)
+    return cached
+
+
+def _connection(url):
+    "Returns this thread's connection to the host of url, opening it if needed."
+    parts = urllib.parse.urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    connections = getattr(_connections, 'connections', None)
+    if connections is None:
+        connections = _connections.connections = {}
+    if key not in connections:
+        if parts.scheme == 'https':
+            connections[key] = http.client.HTTPSConnection(parts.netloc, timeout=TIMEOUT)
+        else:
+            connections[key] = http.client.HTTPConnection(parts.netloc, timeout=TIMEOUT)
+    return connections[key]
+
+
+def _get(url, values):
+    "Sends a GET request and returns the decoded json response. Retries once if the kept-alive connection was closed by the server."
+    parts = urllib.parse.urlsplit(url)
+    path = (parts.path or '/') + '?' + urllib.parse.urlencode(values)
+    for attempt in range(2):
+        connection = _connection(url)
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            body = response.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if attempt == 1:
+                raise
+            continue
+        if response.status != 200:
+            raise IOError('TogoID request failed with status {0}: {1}'.format(response.status, body[:200]))
+        return json.loads(body)
+
+
+def _convert_batch(ids, route, url):
+    "Converts one batch of ids, returning a dict of id: list of converted ids (empty for ids that couldn't be converted)."
+    data = _get(url, {'ids': ','.join(ids), 'route': route, 'report': 'pair'})
+    results = {i: [] for i in ids}
+    for pair in data['results']:
+        results.setdefault(pair[0], []).append(pair[1])
+    return results
+
+
+def convert_ids(ids, source, dest, batch_size=BATCH_SIZE, n_threads=N_THREADS, use_cache=True, cache_file=None, url=API_URL):
     """
     List of databases for source/dest: https://academic.oup.com/view-large/401921930
 
@@ -19,18 +103,38 @@ def convert_ids(ids, source, dest):
         ids (list of strings)
         source (database)
         dest (database)
+        batch_size: maximum number of ids per request
+        n_threads: number of concurrent requests
+        use_cache: whether to use the on-disk cache of converted ids
+        cache_file: sqlite file of the cache (default: cache_filename())
+        url: url of the TogoID convert API
+
+    Returns:
+        dict with 'route' and 'results', which is a list of [source id, dest id] pairs in the order of ids.
     """
-    # URL: https://api.togoid.dbcls.jp
-    # /convert
-    url = 'https://api.togoid.dbcls.jp/convert'
-    values = {'ids': ','.join(str(i) for i in ids),
-              'route': source + ',' + dest,
-              'report': 'pair'}
-    url_values = urllib.parse.urlencode(values)
-    full_url = url + '?' + url_values
-    response = urllib.request.urlopen(full_url)
-    data = json.load(response)
-    return data
+    route = source + ',' + dest
+    ids = list(dict.fromkeys(str(i) for i in ids))
+    db = None
+    results = {}
+    if use_cache:
+        db = _open_cache(cache_file or cache_filename())
+        results = _read_cache(db, route, ids)
+    missing = [i for i in ids if i not in results]
+    batches = [missing[start:start+batch_size] for start in range(0, len(missing), batch_size)]
+    try:
+        if batches:
+            with ThreadPoolExecutor(max_workers=max(1, min(n_threads, len(batches)))) as executor:
+                for batch_results in executor.map(lambda batch: _convert_batch(batch, route, url), batches):
+                    results.update(batch_results)
+                    if db is not None:
+                        db.executemany('INSERT OR REPLACE INTO conversions VALUES (?, ?, ?)',
+                                [(route, i, json.dumps(r)) for i, r in batch_results.items()])
+                        db.commit()
+    finally:
+        if db is not None:
+            db.close()
+    pairs = [[i, r] for i in ids for r in results.get(i, [])]
+    return {'route': route.split(','), 'results': pairs}
 
 def convert_prots_to_genes(prot_ids):
     """
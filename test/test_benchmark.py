@@ -0,0 +1,75 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from kgfe import benchmark, graph_info, kg2_loader, spoke_loader, synthetic_kg
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_synthetic_kg(self):
+        for extension in ['jsonl', 'csv', 'tsv.gz']:
+            node_filename = os.path.join(self.tmp_dir, 'nodes.' + extension)
+            edge_filename = os.path.join(self.tmp_dir, 'edges.' + extension)
+            info = synthetic_kg.generate_kg2(node_filename, edge_filename, n_edges=5000, chunk_size=1000)
+            nodes, edges, node_types, edge_types = kg2_loader.import_kg2(node_filename, edge_filename, verbose=False, edge_format='table')
+            self.assertEqual(info['n_nodes'], 500)
+            self.assertEqual(len(nodes), 500)
+            self.assertEqual(len(edges), 5000)
+            self.assertEqual(set(node_types.values()), {c[0] for c in synthetic_kg.CATEGORIES})
+            self.assertEqual(set(edge_types.values()), {p[0] for p in synthetic_kg.PREDICATES})
+        # the same seed gives the same graph
+        other_filename = os.path.join(self.tmp_dir, 'edges2.csv')
+        synthetic_kg.generate_kg2(os.path.join(self.tmp_dir, 'nodes2.csv'), other_filename, n_edges=5000, chunk_size=1000)
+        with open(os.path.join(self.tmp_dir, 'edges.csv')) as f, open(other_filename) as f2:
+            self.assertEqual(f.read(), f2.read())
+        filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        synthetic_kg.generate_spoke(filename, n_edges=5000)
+        nodes, edges, node_types, edge_types = spoke_loader.import_ckg_jsonl(filename, verbose=False)
+        self.assertEqual(len(nodes), 500)
+        self.assertEqual(len(edge_types), len(synthetic_kg.PREDICATES))
+        # the edges follow the predicate schema, and the degrees are heavy-tailed
+        graph = graph_info.df_to_graph(synthetic_kg.generate_dataframe(20000), directed=True)
+        schema = {p[0]: ({synthetic_kg.CATEGORIES[c][0] for c in p[2]}, {synthetic_kg.CATEGORIES[c][0] for c in p[3]})
+                for p in synthetic_kg.PREDICATES}
+        for e in graph.es[:1000]:
+            subjects, objects = schema[e['predicate']]
+            self.assertIn(graph.vs[e.source]['category'], subjects)
+            self.assertIn(graph.vs[e.target]['category'], objects)
+        degrees = np.array(graph.degree())
+        self.assertGreater(degrees.max(), 20*np.median(degrees))
+
+    def test_run_benchmarks(self):
+        output = os.path.join(self.tmp_dir, 'results.json')
+        directory = os.path.join(self.tmp_dir, 'data')
+        report = benchmark.run_benchmarks([2000], directory=directory, isolate=False, output=output)
+        self.assertEqual([r['loader'] for r in report['results']], list(benchmark.LOADERS))
+        for result in report['results']:
+            self.assertEqual(result['n_edges'], 2000)
+            self.assertGreater(result['rows_per_s'], 0)
+            self.assertGreater(result['bytes'], 0)
+        with open(output) as f:
+            self.assertEqual(json.load(f), json.loads(json.dumps(report)))
+        self.assertEqual(benchmark.compare(output, report), [])
+        # the datasets are kept in directory and reused
+        n_files = len(os.listdir(directory))
+        report = benchmark.run_benchmarks([2000], ['import_kg2_csv'], directory=directory)
+        self.assertEqual(len(os.listdir(directory)), n_files)
+        slower = json.loads(json.dumps(report))
+        slower['results'][0]['wall_time'] *= 2
+        regressions = benchmark.compare(report, slower)
+        self.assertEqual([(r['loader'], r['metric']) for r in regressions], [('import_kg2_csv', 'wall_time')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from kgfe import compressed_io, kg2_loader, parallel_import
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class CompressedIOTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # enough lines for several BGZF blocks and decompression tasks
+        self.data = ''.join(json.dumps({'id': 'CHEBI:{0}'.format(i), 'name': 'node {0}'.format(i), 'category': 'biolink:SmallMolecule'}) + '\n'
+                for i in range(30000)).encode('utf-8')
+        self.gz_filename = os.path.join(self.tmp_dir, 'nodes.jsonl.gz')
+        with gzip.open(self.gz_filename, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_bgzf(self):
+        bgzf_filename = os.path.join(self.tmp_dir, 'nodes.bgzf.jsonl.gz')
+        compressed_io.recompress(self.gz_filename, bgzf_filename, n_threads=2)
+        self.assertEqual(compressed_io.detect_format(self.gz_filename), 'gzip')
+        self.assertEqual(compressed_io.detect_format(bgzf_filename), 'bgzf')
+        # BGZF files are valid gzip files
+        with gzip.open(bgzf_filename, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        for filename in [self.gz_filename, bgzf_filename]:
+            for threads in [True, False]:
+                with compressed_io.open_binary(filename, threads=threads, n_threads=2) as f:
+                    self.assertEqual(f.read(), self.data)
+        with compressed_io.open_text(bgzf_filename) as f:
+            self.assertEqual(f.readline(), self.data.decode('utf-8').split('\n')[0] + '\n')
+        # the .gzi index has the same offsets as reading the block headers
+        with open(bgzf_filename, 'rb') as f:
+            scanned = compressed_io._scan_blocks(f)
+        indexed = compressed_io.bgzf_index(bgzf_filename)
+        self.assertEqual(indexed[0].tolist(), scanned[0])
+        self.assertEqual(indexed[1].tolist(), scanned[1])
+        self.assertGreater(len(scanned[0]), 10)
+        # random access
+        self.assertEqual(compressed_io.uncompressed_size(bgzf_filename), len(self.data))
+        with compressed_io.open_random_access(bgzf_filename) as f:
+            for start in [0, 1000, compressed_io.BGZF_BLOCK_SIZE - 10, len(self.data) - 100, 1500000]:
+                f.seek(start)
+                self.assertEqual(f.read(5000), self.data[start:start + 5000])
+        with self.assertRaises(ValueError):
+            compressed_io.open_random_access(self.gz_filename)
+        # in-place conversion
+        compressed_io.recompress(self.gz_filename)
+        self.assertEqual(compressed_io.detect_format(self.gz_filename), 'bgzf')
+        self.assertTrue(os.path.exists(self.gz_filename + '.gzi'))
+
+    def test_multi_member_gzip(self):
+        filename = os.path.join(self.tmp_dir, 'multi.gz')
+        with open(filename, 'wb') as f:
+            f.write(gzip.compress(b'line 1\n'))
+            f.write(gzip.compress(b'line 2\n'))
+        with compressed_io.open_text(filename) as f:
+            self.assertEqual(f.readlines(), ['line 1\n', 'line 2\n'])
+
+    def test_errors(self):
+        filename = os.path.join(self.tmp_dir, 'truncated.gz')
+        with open(self.gz_filename, 'rb') as f:
+            data = f.read()
+        with open(filename, 'wb') as f:
+            f.write(data[:1000] + b'\x00'*1000)
+        with self.assertRaises(Exception):
+            with compressed_io.open_binary(filename) as f:
+                f.read()
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        filename = os.path.join(self.tmp_dir, 'nodes.jsonl.zst')
+        with open(filename, 'wb') as f:
+            f.write(zstandard.ZstdCompressor().compress(self.data))
+        self.assertEqual(compressed_io.detect_format(filename), 'zstd')
+        with compressed_io.open_binary(filename) as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_loaders(self):
+        edge_filename = os.path.join(self.tmp_dir, 'edges.jsonl')
+        with open(edge_filename, 'w') as f:
+            for i in range(0, 1000, 2):
+                f.write(json.dumps({'id': i, 'subject': 'CHEBI:{0}'.format(i), 'object': 'CHEBI:{0}'.format(i + 1),
+                    'predicate': 'biolink:interacts_with'}) + '\n')
+        expected = kg2_loader.import_kg2_jsonl(self.gz_filename, edge_filename, verbose=False)
+        bgzf_filename = os.path.join(self.tmp_dir, 'nodes.jsonl.bgz')
+        compressed_io.recompress(self.gz_filename, bgzf_filename)
+        self.assertEqual(kg2_loader.import_kg2(bgzf_filename, edge_filename, remove_unused_nodes=True, verbose=False), expected)
+        # BGZF files are split into chunks without being decompressed first
+        chunks = parallel_import.line_chunks(bgzf_filename, 2, 500000)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(self.data))
+        self.assertGreater(len(chunks), 2)
+        parallel = parallel_import.import_jsonl_parallel('kg2', [bgzf_filename, edge_filename], verbose=False,
+                n_processes=2, chunk_size=500000)
+        self.assertEqual(parallel, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from kgfe import gene_names, graph_info
+
+MOUSE_GENE_INFO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Mus_musculus.gene_info.gz')
+PROTS_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'prots_hba1c_outliers_2023_07_21.csv')
+
+
+class GeneNamesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_cache_dir = os.environ.get('KGFE_CACHE_DIR')
+        self.old_species = copy.deepcopy(gene_names.SPECIES)
+        os.environ['KGFE_CACHE_DIR'] = self.tmp_dir
+        self.gene_info = os.path.join(self.tmp_dir, 'Mus_musculus.gene_info.gz')
+        shutil.copy(MOUSE_GENE_INFO, self.gene_info)
+        # the human symbol tables are built from the mouse file, since Homo_sapiens.gene_info.gz isn't in the repository
+        gene_names.SPECIES['human']['gene_info'] = self.gene_info
+        gene_names._tables.clear()
+
+    def tearDown(self):
+        gene_names.SPECIES.clear()
+        gene_names.SPECIES.update(self.old_species)
+        gene_names._tables.clear()
+        for name in gene_names._DICT_TABLES:
+            gene_names.__dict__.pop(name, None)
+        if self.old_cache_dir is None:
+            del os.environ['KGFE_CACHE_DIR']
+        else:
+            os.environ['KGFE_CACHE_DIR'] = self.old_cache_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookups(self):
+        # nothing is loaded until the first lookup
+        self.assertEqual(len(gene_names._tables), 0)
+        expected = gene_names._read_gene_info(self.gene_info)
+        self.assertEqual(gene_names.get_ids(['Pzp', 'A2m', 'not a gene', 'Aanat']), [11287, 11287, 11298])
+        self.assertEqual(gene_names.get_symbols([11287, '11298', 0]), ['Pzp', 'Aanat'])
+        self.assertEqual(gene_names.get_symbol(11298), 'Aanat')
+        self.assertEqual(gene_names.get_id('Nat4'), 11298)
+        self.assertRaises(KeyError, gene_names.get_ids, ['not a gene'], ignore_missing=False)
+        self.assertEqual(gene_names.ID_TO_SYMBOL, expected['id_to_symbol'])
+        self.assertEqual(gene_names.SYMBOL_TO_ID, expected['symbol_to_id'])
+        self.assertEqual(gene_names.convert('uniprot', 'ncbi', ['P31946']), [7529])
+
+    def test_index_cache(self):
+        gene_names.get_ids(['Pzp'])
+        index = os.path.join(gene_names.index_dir(), 'human', 'gene_info', 'symbol_to_id.keys.npy')
+        self.assertTrue(os.path.exists(index))
+        # a new process memory-maps the index instead of reading the source file
+        gene_names._tables.clear()
+        self.assertEqual(gene_names.get_ids(['Pzp']), [11287])
+        self.assertIsInstance(gene_names._tables[('human', 'symbol_to_id')].keys, np.memmap)
+        # changing the source file rebuilds the index
+        os.utime(self.gene_info, ns=(0, 0))
+        gene_names._tables.clear()
+        self.assertEqual(gene_names.get_ids(['Pzp']), [11287])
+        self.assertNotIsInstance(gene_names._tables[('human', 'symbol_to_id')].keys, np.memmap)
+
+    def test_convert_array(self):
+        ids = pd.Series(['Pzp', None, 'not a gene', 'Aanat'])
+        values, found = gene_names.convert_array(ids, 'symbol', 'ncbi')
+        self.assertEqual(found.tolist(), [True, False, False, True])
+        self.assertEqual(values[found].tolist(), [11287, 11298])
+        values, found = gene_names.convert_array(np.array([11298, 0, 11287]), 'ncbi', 'symbol')
+        self.assertEqual(values.tolist(), ['Aanat', None, 'Pzp'])
+        values, found = gene_names.convert_array(['11298', 'x', float('nan')], 'geneid', 'ncbi')
+        self.assertEqual(found.tolist(), [True, False, False])
+        # all the uniprot ids of a protein table in one call
+        prots = pd.read_csv(PROTS_FILENAME)
+        graph_ids, found = gene_names.to_graph_ids(prots['uniprot'], 'uniprot')
+        self.assertEqual(len(graph_ids), len(prots))
+        self.assertGreater(found.mean(), 0.9)
+        expected = gene_names.uniprot_to_gene_ids(prots['uniprot'])
+        self.assertEqual(graph_ids[found].tolist(), ['NCBIGene::{0}'.format(i) for i in expected])
+        self.assertTrue(all(x is None for x in graph_ids[~found]))
+        graph_ids, found = gene_names.to_graph_ids(['P31946', 'not a protein'], 'uniprot', 'uniprot', prefix='UniProtKB:')
+        self.assertEqual(graph_ids.tolist(), ['UniProtKB:P31946', 'UniProtKB:not a protein'])
+
+    def test_species(self):
+        gene_names.register_species('mouse', taxon_id=10090, gene_info=self.gene_info)
+        self.assertEqual(gene_names.get_ids(['Pzp'], species='mouse'), [11287])
+        self.assertEqual(gene_names.get_ids(['Pzp'], species=10090), [11287])
+        self.assertIn(('mouse', 'symbol_to_id'), gene_names._tables)
+        # without an ensembl file, the ensembl ids come from the gene_info file
+        ensembl_id = gene_names.gene_ids_to_ensembl([11287], species='mouse')[0]
+        self.assertTrue(ensembl_id.startswith('ENSMUSG'))
+        self.assertEqual(gene_names.convert('ensembl', 'symbol', [ensembl_id], species='mouse'), ['Pzp'])
+        self.assertRaises(ValueError, gene_names.uniprot_to_gene_ids, ['P31946'], species='mouse')
+        self.assertRaises(ValueError, gene_names.get_ids, ['Pzp'], species='fly')
+
+    def test_msigdb(self):
+        zip_filename = os.path.join(self.tmp_dir, 'msigdb.zip')
+        collections = {
+            'c1.json': {'SET_A': {'collection': 'C1', 'exactSource': 'src a', 'pmid': '1', 'geneSymbols': ['Pzp', 'not a gene', 'Aanat']},
+                        'SET_B': {'collection': 'C1', 'exactSource': 'src b', 'pmid': '', 'geneSymbols': ['A2m']}},
+            'c2.json': {'SET_C': {'collection': 'C2', 'exactSource': '', 'pmid': '2', 'geneSymbols': ['Aanat']}},
+        }
+        with zipfile.ZipFile(zip_filename, 'w') as f:
+            for name, data in collections.items():
+                f.writestr(name, json.dumps(data))
+        df = graph_info.load_msigdb('c1.json', zip_filename)
+        self.assertEqual(df['subject_id'].tolist(), [11287, 11298, 11287])
+        self.assertEqual(df['subject_name'].tolist(), ['Pzp', 'Aanat', 'A2m'])
+        self.assertEqual(df['object_id'].tolist(), ['SET_A', 'SET_A', 'SET_B'])
+        self.assertEqual(df['Primary_Knowledge_Source'].tolist(), ['src a', 'src a', 'src b'])
+        # the second load reads the cache
+        self.assertEqual(graph_info.load_msigdb('c1.json', zip_filename).to_dict('records'), df.to_dict('records'))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp_dir, 'msigdb'))), 1)
+        results = graph_info.load_msigdb_collections(zip_filename=zip_filename, n_processes=2)
+        self.assertEqual(list(results), ['c1.json', 'c2.json'])
+        self.assertEqual(results['c1.json'].to_dict('records'), df.to_dict('records'))
+        self.assertEqual(results['c2.json']['object_id'].tolist(), ['SET_C'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
 
+import numpy as np
+from scipy import stats
+
 import kgfe
 
 class GraphTest(unittest.TestCase):
@@ -19,6 +22,69 @@ class GraphTest(unittest.TestCase):
         for node in top_nodes:
             self.assertTrue(node['score'] > 0 and node['score'] < 1)
 
+    def test_pagerank_top_k(self):
+        _, top_nodes = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids)
+        # top_k ranks only the top nodes, in the same order
+        ranked = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, top_k=100)
+        self.assertEqual(len(ranked), 100)
+        self.assertEqual(ranked.names, [node['name'] for node in top_nodes[:100]])
+        self.assertEqual(ranked.scores.tolist(), [node['score'] for node in top_nodes[:100]])
+        self.assertEqual(ranked.to_list(), top_nodes[:100])
+        table = ranked.to_dataframe()
+        self.assertEqual(table['name'].tolist(), ranked.names)
+        self.assertEqual(len(ranked.pagerank), len(self.graph.vs))
+        self.assertEqual(len(kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, top_k=10**9)), len(top_nodes))
+
+    def test_batch_pagerank(self):
+        topic_sets = [self.topic_ids, self.topic_ids[:2], {'NCBIGene::958': 3.0, 'NCBIGene::100': 1.0}]
+        scores = kgfe.explanations.batch_topic_pagerank(self.graph, topic_sets, batch_size=2)
+        self.assertEqual(scores.shape, (len(self.graph.vs), 3))
+        expected = [kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, top_k=10),
+                kgfe.explanations.topic_pagerank(self.graph, self.topic_ids[:2], top_k=10),
+                kgfe.explanations.topic_pagerank(self.graph, topic_weights={'NCBIGene::958': 3.0, 'NCBIGene::100': 1.0}, top_k=10)]
+        for i, ranked in enumerate(expected):
+            self.assertTrue(abs(scores[:, i] - ranked.pagerank).max() < 1e-7)
+        top = kgfe.explanations.batch_topic_pagerank(self.graph, topic_sets, top_k=10)
+        self.assertEqual([r.names[:5] for r in top], [r.names[:5] for r in expected])
+        # unit weights are the same as no weights
+        weighted = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, topic_weights={}, top_k=10)
+        self.assertTrue(abs(weighted.pagerank - expected[0].pagerank).max() < 1e-12)
+        with self.assertRaises(ValueError):
+            kgfe.explanations.batch_topic_pagerank(self.graph, [[]])
+
+    def test_local_pagerank(self):
+        exact = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, top_k=20)
+        scores = kgfe.pagerank.approximate_pagerank(self.graph, self.topic_ids, epsilon=1e-8)
+        # the error is bounded per unit of degree
+        degrees = np.maximum(self.graph.degree(), 1)
+        self.assertTrue((abs(scores.toarray().ravel() - exact.pagerank)/degrees).max() < 1e-7)
+        # local pushes visit only part of the graph with a large epsilon
+        self.assertLess(kgfe.pagerank.approximate_pagerank(self.graph, self.topic_ids, epsilon=1e-3).nnz, len(self.graph.vs)/10)
+        local = kgfe.explanations.local_topic_pagerank(self.graph, self.topic_ids, epsilon=1e-8, top_k=20)
+        self.assertEqual(local.names[:10], exact.names[:10])
+        self.assertEqual(len(set(local.names) & set(self.topic_ids)), 0)
+        normalized = kgfe.explanations.local_topic_pagerank(self.graph, self.topic_ids, normalize='pagerank', top_k=20)
+        self.assertEqual(len(normalized), 20)
+        # warm-started global and personalized pagerank
+        global_scores = kgfe.pagerank.global_pagerank(self.graph)
+        self.assertTrue(abs(global_scores - self.graph.pagerank(damping=0.7)).max() < 1e-8)
+        warm = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, nstart=exact.pagerank, top_k=20)
+        self.assertEqual(warm.names, exact.names)
+        warm = kgfe.explanations.topic_pagerank(self.graph, nstart=global_scores, max_iter=2, top_k=20)
+        self.assertTrue(abs(warm.pagerank - global_scores).max() < 1e-8)
+        # ids of nstart that aren't in the graph (e.g. removed nodes) are ignored
+        previous = dict(zip(self.graph.vs['name'], global_scores.tolist()), **{'removed node': 1.0})
+        warm = kgfe.explanations.topic_pagerank(self.graph, self.topic_ids, nstart=previous, top_k=20)
+        self.assertEqual(warm.names, exact.names)
+        warm = kgfe.pagerank.global_pagerank(self.graph, nstart={'removed node': 1.0, self.topic_ids[0]: 1.0})
+        self.assertTrue(abs(warm - global_scores).max() < 1e-8)
+        # warm starts that didn't converge aren't cached
+        graph = self.graph.copy()
+        unconverged = kgfe.explanations.topic_pagerank(graph, nstart=np.ones(len(graph.vs)), max_iter=2, top_k=20)
+        self.assertTrue(abs(unconverged.pagerank - global_scores).max() > 1e-8)
+        self.assertTrue(abs(kgfe.pagerank.global_pagerank(graph) - global_scores).max() < 1e-8)
+        self.assertTrue(abs(kgfe.pagerank.global_pagerank(graph, max_iter=2) - global_scores).max() > 1e-8)
+
     def test_hypergeom(self):
         hypergeom_results = kgfe.explanations.hypergeom_test(self.graph, self.topic_ids, 'Gene')
         self.assertTrue(len(hypergeom_results) > 0)
@@ -39,6 +105,116 @@ class GraphTest(unittest.TestCase):
         # average pairwise distance within groups of 20 randomly selected genes
         self.assertTrue(null_stats > 3 and null_stats < 4)
 
+    def test_graph_index(self):
+        graph = self.graph
+        index = kgfe.graph_index.get_graph_index(graph)
+        self.assertIs(kgfe.graph_index.get_graph_index(graph), index)
+        # same results as scanning the vertices
+        names_to_ids = {}
+        gene_ids = {}
+        genes = []
+        for v in graph.vs:
+            if v['category'] == 'Gene':
+                names_to_ids[v['feature_name']] = v['name']
+                gene_ids[v['id']] = v.index
+                genes.append(v.index)
+        self.assertEqual(kgfe.graph_info.get_names_to_ids(graph, 'Gene'), names_to_ids)
+        self.assertEqual(kgfe.graph_info.get_category_ids_to_nodes(graph, 'Gene'), gene_ids)
+        self.assertEqual([v.index for v in kgfe.graph_info.nodes_in_category(graph, 'Gene')], genes)
+        self.assertEqual(kgfe.graph_info.nodes_in_category(graph, 'not a category'), [])
+        self.assertEqual(index.degree.tolist(), graph.degree())
+        with self.assertRaisesRegex(KeyError, 'not a column'):
+            index.mapping('not a column', 'name')
+        with self.assertRaisesRegex(KeyError, 'not a column'):
+            index.mapping('feature_name', 'not a column')
+        # degree_sample accepts vertex names as well as indices
+        nodes = list(range(20))
+        names = graph.vs[nodes]['name']
+        dist = stats.expon(scale=10)
+        np.random.seed(0)
+        sampled = kgfe.graph_info.degree_sample(graph, nodes, 5, dist)
+        np.random.seed(0)
+        self.assertEqual(kgfe.graph_info.degree_sample(graph, names, 5, dist).tolist(), graph.vs[sampled.tolist()]['name'])
+        # returned dicts are copies
+        kgfe.graph_info.get_names_to_ids(graph).clear()
+        self.assertEqual(len(kgfe.graph_info.get_names_to_ids(graph)), len(set(graph.vs['feature_name'])))
+        # the index is rebuilt when the graph changes
+        graph.add_vertices(1, {'name': ['new'], 'category': ['Gene'], 'feature_name': ['new gene']})
+        self.assertEqual(kgfe.graph_info.get_names_to_ids(graph, 'Gene')['new gene'], 'new')
+
+    def test_resolve_nodes(self):
+        resolve_nodes = kgfe.graph_index.resolve_nodes
+        indices = resolve_nodes(self.graph, self.topic_ids)
+        self.assertEqual(indices.tolist(), [self.graph.vs.find(name=i).index for i in self.topic_ids])
+        ids = self.topic_ids[:2] + ['not a node'] + self.topic_ids[2:]
+        self.assertRaises(ValueError, resolve_nodes, self.graph, ids)
+        self.assertEqual(resolve_nodes(self.graph, ids, missing='drop').tolist(), indices.tolist())
+        found, missing = resolve_nodes(self.graph, ids, missing='report')
+        self.assertEqual(found.tolist(), indices.tolist())
+        self.assertEqual(missing, ['not a node'])
+        self.assertEqual(len(resolve_nodes(self.graph, [])), 0)
+        # sets, generators and dict views are resolved like lists
+        self.assertEqual(sorted(resolve_nodes(self.graph, set(self.topic_ids)).tolist()), sorted(indices.tolist()))
+        self.assertEqual(resolve_nodes(self.graph, (i for i in self.topic_ids)).tolist(), indices.tolist())
+        self.assertEqual(resolve_nodes(self.graph, dict.fromkeys(self.topic_ids).keys()).tolist(), indices.tolist())
+        self.assertEqual(kgfe.explanations.topic_pagerank(self.graph, {self.topic_ids[0]})[1],
+                kgfe.explanations.topic_pagerank(self.graph, [self.topic_ids[0]])[1])
+        universe = [v['name'] for v in self.graph.vs if v['category'] == 'Gene']
+        self.assertEqual(kgfe.explanations.hypergeom_test(self.graph, self.topic_ids, 'Gene', query_universe=set(universe)),
+                kgfe.explanations.hypergeom_test(self.graph, self.topic_ids, 'Gene', query_universe=universe))
+        pairs = kgfe.feature_engineering.get_feature_pairs(self.graph, ids)
+        self.assertTrue(all(i in indices and n in indices for i, n, _ in pairs))
+
+    def test_load_graph_filters(self):
+        df = kgfe.load_graph('reactome_genes_chems.csv.gz', predicates='participates_in', subject_categories=['Gene'])
+        expected = self.df[(self.df['predicate'] == 'participates_in') & (self.df['subject_category'] == 'Gene')]
+        self.assertEqual(len(df), len(expected))
+        self.assertGreater(len(df), 0)
+        self.assertEqual(df['object_id'].tolist(), expected['object_id'].tolist())
+        # the id columns are strings, whichever rows are read
+        self.assertEqual(df['subject_id'].tolist(), expected['subject_id'].tolist())
+        self.assertEqual(df.dtypes.to_dict(), self.df[df.columns].dtypes.to_dict())
+        self.assertTrue(all(isinstance(x, str) for x in df['subject_id']))
+        df = kgfe.load_graph('reactome_genes_chems.csv.gz', columns=['subject_id', 'object_id'], object_categories='Pathway')
+        self.assertEqual(list(df.columns), ['subject_id', 'object_id'])
+        self.assertEqual(len(df), (self.df['object_category'] == 'Pathway').sum())
+
+    @unittest.skipUnless(kgfe.graph_info._has_pyarrow(), 'requires pyarrow')
+    def test_parquet(self):
+        import os
+        import tempfile
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, 'graph.parquet')
+        kgfe.convert_to_parquet('reactome_genes_chems.csv.gz', filename, row_group_size=1000, sort_rows=True)
+        df = kgfe.load_graph(filename, predicates=['participates_in'], subject_categories='Gene')
+        expected = self.df[(self.df['predicate'] == 'participates_in') & (self.df['subject_category'] == 'Gene')]
+        self.assertEqual(sorted(df['object_id'].astype(str)), sorted(expected['object_id'].astype(str)))
+        # the parquet version of a csv is read with use_parquet=True while the csv is unchanged
+        csv_filename = os.path.join(tmp_dir, 'small.csv')
+        self.df.head(100).to_csv(csv_filename, index=False)
+        parquet = kgfe.convert_to_parquet(csv_filename)
+        self.assertEqual(kgfe.graph_info.fresh_parquet(csv_filename), parquet)
+        self.assertEqual(len(kgfe.load_graph(csv_filename, use_parquet=True)), 100)
+        self.df.head(50).to_csv(csv_filename, index=False)
+        self.assertIsNone(kgfe.graph_info.fresh_parquet(csv_filename))
+        self.assertEqual(len(kgfe.load_graph(csv_filename, use_parquet=True)), 50)
+
+    def test_parquet_sibling(self):
+        "A parquet file next to a csv file is only read with use_parquet=True, if convert_to_parquet wrote it from the current csv."
+        import os
+        import tempfile
+        tmp_dir = tempfile.mkdtemp()
+        filename = os.path.join(tmp_dir, 'graph.csv')
+        self.df.head(100).to_csv(filename, index=False)
+        expected = kgfe.load_graph(filename)
+        with open(os.path.join(tmp_dir, 'graph.parquet'), 'wb') as f:
+            f.write(b'not the parquet version of graph.csv')
+        self.assertIsNone(kgfe.graph_info.fresh_parquet(filename))
+        self.assertTrue(kgfe.load_graph(filename).equals(expected))
+        self.assertTrue(kgfe.load_graph(filename, use_parquet=True).equals(expected))
+        if not kgfe.graph_info._has_pyarrow():
+            self.assertRaises(ImportError, kgfe.convert_to_parquet, filename)
+
     def test_steiner_tree(self):
         st = kgfe.explanations.steiner_tree(self.graph, self.topic_ids)
         self.assertTrue(st.is_connected())
@@ -0,0 +1,585 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from kgfe import kg2_loader, spoke_loader, parallel_import, explanations, graph_delta, graph_store, graph_info, graph_index, property_store, graph_merge, progress, external_build, compiled_graph, pagerank
+
+KG2_NODES = [
+        {'id': 'NCBIGene:1', 'name': 'A1BG', 'category': 'biolink:Gene'},
+        {'id': 'NCBIGene:2', 'name': 'A2M', 'category': 'biolink:Gene'},
+        {'id': 'NCBIGene:3', 'name': 'A2MP1', 'category': 'biolink:Gene'},
+        {'id': 'CHEBI:15377', 'name': 'water', 'category': 'biolink:SmallMolecule'},
+        {'id': 'MONDO:0005148', 'name': 'type 2 diabetes mellitus', 'category': 'biolink:Disease'},
+        {'id': 'MONDO:0000001', 'name': 'disease', 'category': 'biolink:Disease'},
+]
+
+KG2_EDGES = [
+        {'id': 1, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'},
+        {'id': 2, 'subject': 'NCBIGene:2', 'object': 'MONDO:0005148', 'predicate': 'biolink:gene_associated_with_condition'},
+        {'id': 3, 'subject': 'CHEBI:15377', 'object': 'NCBIGene:1', 'predicate': 'biolink:affects'},
+        {'id': 4, 'subject': 'NCBIGene:3', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'},
+        {'id': 5, 'subject': 'CHEBI:15377', 'object': 'MONDO:0005148', 'predicate': 'biolink:treats'},
+]
+
+SPOKE_ROWS = [
+        {'type': 'node', 'id': '10', 'labels': ['Gene'], 'properties': {'name': 'INS', 'identifier': 3630, 'source': 'Entrez Gene'}},
+        {'type': 'node', 'id': '11', 'labels': ['Gene'], 'properties': {'name': 'GCG', 'identifier': 2641, 'source': 'Entrez Gene'}},
+        {'type': 'node', 'id': '12', 'labels': ['Compound'], 'properties': {'pref_name': 'METFORMIN', 'identifier': 'DB00331'}},
+        {'type': 'node', 'id': '13', 'labels': ['Disease'], 'properties': {'identifier': 'DOID:9352'}},
+        {'type': 'node', 'id': '14', 'labels': ['Disease'], 'properties': {'id': 'x'}},
+        {'type': 'relationship', 'id': '100', 'label': 'INTERACTS_GiG', 'start': {'id': '10'}, 'end': {'id': '11'}, 'properties': {}},
+        {'type': 'relationship', 'id': '101', 'label': 'TREATS_CtD', 'start': {'id': '12'}, 'end': {'id': '13'}, 'properties': {'phase': 4}},
+        {'type': 'relationship', 'id': '102', 'label': 'ASSOCIATES_DaG', 'start': {'id': '13'}, 'end': {'id': '10'}, 'properties': {}},
+        {'type': 'relationship', 'id': '103', 'label': 'UPREGULATES_CuG', 'start': {'id': '12'}, 'end': {'id': '13'}, 'properties': {}},
+]
+
+
+def write_kg2_jsonl(filename, rows):
+    with open(filename, 'w') as f:
+        for row in rows:
+            f.write(json.dumps(row) + '\n')
+
+
+def graph_summary(graph):
+    "Returns the node attributes and typed edges of a kg2 igraph, independent of vertex/edge order."
+    nodes = {v['name']: (v['feature_name'], v['category'], v['identifier'], v['source']) for v in graph.vs}
+    edges = set()
+    for e in graph.es:
+        edges.add((graph.vs[e.source]['name'], graph.vs[e.target]['name'], e['type']))
+    return nodes, edges
+
+
+class LoaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.node_filename = os.path.join(self.tmp_dir, 'nodes.jsonl')
+        self.edge_filename = os.path.join(self.tmp_dir, 'edges.jsonl')
+        write_kg2_jsonl(self.node_filename, KG2_NODES)
+        write_kg2_jsonl(self.edge_filename, KG2_EDGES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_compiled_cache(self):
+        graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=False, verbose=False)
+        # the unused node is removed
+        self.assertEqual(len(graph.vs), len(KG2_NODES) - 1)
+        self.assertEqual(len(graph.es), len(KG2_EDGES))
+        graph_1 = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        graph_2 = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        self.assertEqual(graph_summary(graph), graph_summary(graph_1))
+        self.assertEqual(graph_summary(graph), graph_summary(graph_2))
+        # a different edge filter gets its own compiled graph
+        graph_3 = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                edges_to_include={'biolink:interacts_with'}, use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        self.assertEqual(len(graph_3.es), 2)
+        # changing the source file invalidates the cache
+        write_kg2_jsonl(self.edge_filename, KG2_EDGES[:2])
+        graph_4 = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        self.assertEqual(len(graph_4.es), 2)
+
+    def test_graph_store(self):
+        graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        store = kg2_loader.load_kg2_store(self.node_filename, edge_filename=self.edge_filename,
+                cache_dir=self.cache_dir, verbose=False)
+        self.assertEqual(len(store), len(graph.vs))
+        self.assertEqual(store.names(), graph.vs['name'])
+        for v in graph.vs:
+            self.assertEqual(store.find(v['name']), v.index)
+            self.assertEqual(store.category(v.index), v['category'])
+            self.assertEqual(sorted(store.neighbors(v.index).tolist()), sorted(graph.neighbors(v.index)))
+        self.assertRaises(ValueError, store.find, 'MONDO:0000001')
+        self.assertEqual(store.degree().tolist(), graph.degree())
+        self.assertEqual(store.distances(range(len(store))).tolist(), graph.distances())
+        genes = store.nodes_in_category('biolink:Gene')
+        self.assertEqual(store.names(genes), ['NCBIGene:1', 'NCBIGene:2', 'NCBIGene:3'])
+        ids = ['NCBIGene:1', 'NCBIGene:3', 'MONDO:0005148']
+        stats = explanations.graph_node_stats_store(store, ids)
+        igraph_stats = explanations.graph_node_stats(graph, ids)
+        self.assertAlmostEqual(stats['average_pairwise_distance'], igraph_stats['average_pairwise_distance'])
+        self.assertAlmostEqual(stats['degree_mean'], igraph_stats['degree_mean'])
+        # pagerank on the store follows the same edges as on the igraph graph
+        exact = explanations.topic_pagerank(graph, ids, top_k=5).pagerank
+        approximate = pagerank.approximate_pagerank(store, ids, epsilon=1e-10).toarray().ravel()
+        self.assertTrue(abs(approximate - exact).max() < 1e-8)
+        self.assertTrue(abs(pagerank.global_pagerank(store) - graph.pagerank(damping=0.7)).max() < 1e-8)
+        warm = pagerank.global_pagerank(store, nstart={'NCBIGene:1': 1.0, 'removed node': 1.0})
+        self.assertTrue(abs(warm - graph.pagerank(damping=0.7)).max() < 1e-8)
+
+    def test_parallel_jsonl(self):
+        gz_filename = os.path.join(self.tmp_dir, 'edges.jsonl.gz')
+        with gzip.open(gz_filename, 'wt') as f:
+            for row in KG2_EDGES:
+                f.write(json.dumps(row) + '\n')
+        for options in [{}, {'reindex_edges': False}, {'remove_unused_nodes': False},
+                {'edges_to_include': {'biolink:interacts_with'}}, {'use_edge_properties': True},
+                {'use_node_types': False, 'use_edge_types': False}]:
+            serial = kg2_loader.import_kg2_jsonl(self.node_filename, gz_filename, verbose=False, **options)
+            parallel = parallel_import.import_jsonl_parallel('kg2', [self.node_filename, gz_filename],
+                    verbose=False, n_processes=2, chunk_size=100, **options)
+            self.assertEqual(serial, parallel)
+        spoke_filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        write_kg2_jsonl(spoke_filename, SPOKE_ROWS)
+        for options in [{}, {'reindex_edges': False}, {'use_edge_properties': True}, {'use_node_types': False, 'use_edge_types': False}]:
+            serial = spoke_loader.import_spoke_jsonl(spoke_filename, verbose=False, **options)
+            parallel = spoke_loader.import_spoke_jsonl(spoke_filename, verbose=False, n_processes=2, **options)
+            self.assertEqual(serial, parallel)
+        # the duplicate edge keeps the last edge type
+        nodes, edges, node_types, edge_types = parallel_import.import_jsonl_parallel('spoke', [spoke_filename],
+                verbose=False, n_processes=2, chunk_size=100)
+        self.assertEqual(edge_types[edges[(2, 3)]], 'UPREGULATES_CuG')
+
+    def test_kg2_csv_engines(self):
+        node_filename = os.path.join(self.tmp_dir, 'nodes.csv')
+        pd.DataFrame(KG2_NODES).to_csv(node_filename, index=False)
+        edge_filename = os.path.join(self.tmp_dir, 'edges.tsv.gz')
+        edges = pd.DataFrame(KG2_EDGES + [{'id': 6, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:affects'}])
+        edges['primary_knowledge_source'] = 'infores:test'
+        edges.to_csv(edge_filename, sep='\t', index=False)
+        for options in [{}, {'reindex_edges': False}, {'remove_unused_nodes': True}, {'use_edge_types': False}, {'use_node_types': False},
+                {'edges_to_include': {'biolink:interacts_with', 'biolink:affects'}}, {'use_edge_properties': True},
+                {'edge_format': 'table'}, {'edge_format': 'table', 'remove_unused_nodes': True, 'use_edge_properties': True}]:
+            rows = kg2_loader.import_kg2_csv(node_filename, edge_filename, verbose=False, engine='csv', **options)
+            chunks = kg2_loader.import_kg2_csv(node_filename, edge_filename, verbose=False, chunksize=2, **options)
+            if options.get('edge_format') == 'table':
+                self.assertEqual(rows[0], chunks[0])
+                self.assertEqual(list(rows[1].items()), list(chunks[1].items()))
+                self.assertEqual(rows[1].properties, chunks[1].properties)
+                self.assertEqual(rows[2:], chunks[2:])
+            else:
+                self.assertEqual(rows, chunks)
+                self.assertEqual(list(rows[1]), list(chunks[1]))
+
+    def test_external_build(self):
+        rng = np.random.default_rng(0)
+        nodes = [{'id': 'N:{0}'.format(i), 'name': 'node {0}'.format(i), 'category': 'biolink:' + 'ABC'[i % 3]} for i in rng.permutation(3000)]
+        edges = [{'id': i, 'subject': 'N:{0}'.format(s), 'object': 'N:{0}'.format(o), 'predicate': 'biolink:p{0}'.format(i % 4)}
+                for i, (s, o) in enumerate(rng.integers(0, 2500, size=(5000, 2)).tolist())]
+        node_filename = os.path.join(self.tmp_dir, 'big_nodes.jsonl')
+        edge_filename = os.path.join(self.tmp_dir, 'big_edges.jsonl')
+        write_kg2_jsonl(node_filename, nodes)
+        write_kg2_jsonl(edge_filename, edges)
+        for options in [{}, {'remove_unused_nodes': False}, {'edges_to_include': {'biolink:p1', 'biolink:p2'}}]:
+            # the budget is below the minimum chunk size, so the build uses several runs
+            directory = kg2_loader.compile_kg2(node_filename, edge_filename=edge_filename, cache_dir=self.cache_dir, memory_budget=1, **options)
+            graph = compiled_graph.load_compiled_igraph(directory, directed=True)
+            expected = kg2_loader.load_kg2_igraph(node_filename, edge_filename=edge_filename, use_cache=False, directed=True,
+                    verbose=False, edge_format='table', **options)
+            self.assertEqual(graph_summary(graph), graph_summary(expected))
+            self.assertEqual(graph.ecount(), expected.ecount())
+            self.assertEqual(graph.vs['name'], sorted(graph.vs['name']))
+            store = graph_store.GraphStore(directory)
+            self.assertEqual(store.find('N:10'), graph.vs.find(name='N:10').index)
+            self.assertEqual(sorted(store.neighbors(store.find('N:10'), mode='out').tolist()),
+                    sorted(graph.neighbors(graph.vs.find(name='N:10'), mode='out')))
+        self.assertEqual(sorted(graph.es.attributes()), sorted(expected.es.attributes()))
+        # options that the out-of-core build doesn't support
+        for option, value in [('use_edge_properties', True), ('use_node_types', False), ('use_edge_types', False), ('edge_format', 'dict')]:
+            with self.assertRaises(ValueError):
+                kg2_loader.compile_kg2(node_filename, edge_filename=edge_filename, cache_dir=self.cache_dir, memory_budget=1, **{option: value})
+        kg2_loader.compile_kg2(node_filename, edge_filename=edge_filename, cache_dir=self.cache_dir, memory_budget=1, edge_format='table')
+        # the last row of a duplicate node id is used
+        node_filename = os.path.join(self.tmp_dir, 'dup_nodes.csv')
+        edge_filename = os.path.join(self.tmp_dir, 'dup_edges.csv')
+        pd.DataFrame(KG2_NODES + [{'id': 'NCBIGene:1', 'name': 'A1BG (new)', 'category': 'biolink:Protein'}]).to_csv(node_filename, index=False)
+        pd.DataFrame(KG2_EDGES).to_csv(edge_filename, index=False)
+        directory = external_build.build_kg2_external(node_filename, edge_filename, os.path.join(self.tmp_dir, 'dup'))
+        graph = compiled_graph.load_compiled_igraph(directory)
+        self.assertEqual(graph.vs.find(name='NCBIGene:1')['feature_name'], 'A1BG (new)')
+        self.assertEqual(graph.vs.find(name='NCBIGene:1')['category'], 'biolink:Protein')
+        self.assertEqual(graph.vcount(), 5)
+
+    def test_edge_table(self):
+        # a parallel edge with a different predicate
+        edges = KG2_EDGES + [{'id': 6, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:regulates'}]
+        write_kg2_jsonl(self.edge_filename, edges)
+        nodes, edge_dict, node_types, edge_types = kg2_loader.import_kg2_jsonl(self.node_filename, self.edge_filename, verbose=False)
+        self.assertEqual(len(edge_dict), len(KG2_EDGES))
+        t_nodes, table, t_node_types, t_edge_types = kg2_loader.import_kg2_jsonl(self.node_filename, self.edge_filename,
+                verbose=False, edge_format='table')
+        self.assertEqual(t_nodes, nodes)
+        self.assertEqual(len(table), len(edges))
+        typed_edges = set((s, o, t_edge_types[p]) for (s, o), p in table.items())
+        self.assertIn((0, 1, 'biolink:interacts_with'), typed_edges)
+        self.assertIn((0, 1, 'biolink:regulates'), typed_edges)
+        p_nodes, p_table, _, p_edge_types = parallel_import.import_jsonl_parallel('kg2', [self.node_filename, self.edge_filename],
+                verbose=False, n_processes=2, chunk_size=100, edge_format='table')
+        self.assertEqual(p_nodes, nodes)
+        self.assertEqual(set((s, o, p_edge_types[p]) for (s, o), p in p_table.items()), typed_edges)
+        # the matrix of an edge table counts the parallel edges, like a matrix of an edge dict it is a CSR array
+        matrix = kg2_loader.to_sparse(t_nodes, table)
+        self.assertEqual(matrix.format, kg2_loader.to_sparse(nodes, edge_dict).format)
+        self.assertEqual(matrix.format, 'csr')
+        self.assertEqual(matrix.nnz, len(edge_dict))
+        self.assertEqual(matrix[0, 1], 2)
+        self.assertEqual(matrix.sum(), len(edges))
+        coo = table.to_coo(len(t_nodes))
+        self.assertEqual(sorted(t_edge_types[p] for s, o, p in zip(coo.row, coo.col, coo.data) if (s, o) == (0, 1)),
+                ['biolink:interacts_with', 'biolink:regulates'])
+        graph = kg2_loader.load_kg2_igraph_from_data(t_nodes, table, t_node_types, t_edge_types)
+        self.assertEqual(len(graph.es), len(edges))
+        self.assertEqual(sorted(graph.es['type']), sorted(e['predicate'] for e in edges))
+        graph = kg2_loader.load_kg2_networkx(self.node_filename, edge_filename=self.edge_filename,
+                verbose=False, edge_format='table')
+        self.assertEqual(graph.number_of_edges('NCBIGene:1', 'NCBIGene:2'), 2)
+        self.assertEqual(graph.nodes['NCBIGene:1']['name'], 'A1BG')
+        # edges that come before their nodes in the file
+        mixed_filename = os.path.join(self.tmp_dir, 'mixed.jsonl')
+        write_kg2_jsonl(mixed_filename, edges[:2] + KG2_NODES + edges[2:])
+        m_nodes, m_table, _, m_edge_types = kg2_loader.import_kg2_jsonl(mixed_filename, None, verbose=False, edge_format='table')
+        self.assertEqual(m_nodes, t_nodes)
+        self.assertEqual(set((s, o, m_edge_types[p]) for (s, o), p in m_table.items()), typed_edges)
+        write_kg2_jsonl(mixed_filename, [{'id': 7, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:9', 'predicate': 'biolink:affects'}] + KG2_NODES)
+        with self.assertRaisesRegex(KeyError, 'NCBIGene:9'):
+            kg2_loader.import_kg2_jsonl(mixed_filename, None, verbose=False, edge_format='table')
+        spoke_filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        write_kg2_jsonl(spoke_filename, SPOKE_ROWS)
+        s_nodes, s_table, _, s_edge_types = spoke_loader.import_spoke_jsonl(spoke_filename, verbose=False, edge_format='table')
+        write_kg2_jsonl(spoke_filename, SPOKE_ROWS[::-1])
+        r_nodes, r_table, _, r_edge_types = spoke_loader.import_spoke_jsonl(spoke_filename, verbose=False, edge_format='table')
+        self.assertEqual(sorted(n[:2] for n in r_nodes), sorted(n[:2] for n in s_nodes))
+        self.assertEqual(set((r_nodes[s][0], r_nodes[o][0], r_edge_types[p]) for (s, o), p in r_table.items()),
+                set((s_nodes[s][0], s_nodes[o][0], s_edge_types[p]) for (s, o), p in s_table.items()))
+
+    def test_sparse_matrix(self):
+        mtx_filename = os.path.join(self.tmp_dir, 'kg2.mtx')
+        nodes, edges, node_types, edge_types, matrix = kg2_loader.load_kg2(self.node_filename,
+                mtx_filename=mtx_filename, edge_filename=self.edge_filename, verbose=False)
+        npz_filename = os.path.join(self.tmp_dir, 'kg2.npz')
+        self.assertTrue(os.path.exists(npz_filename))
+        self.assertEqual(matrix.nnz, len(edges))
+        for (n1, n2), t in edges.items():
+            self.assertEqual(matrix[n1, n2], t)
+        _, _, _, _, matrix_2 = kg2_loader.load_kg2(self.node_filename,
+                mtx_filename=npz_filename, edge_filename=self.edge_filename, verbose=False)
+        self.assertEqual((matrix != matrix_2).nnz, 0)
+        # a different edge filter doesn't reuse the cached matrix
+        _, edges_3, _, _, matrix_3 = kg2_loader.load_kg2(self.node_filename, edges_to_include={'biolink:interacts_with'},
+                mtx_filename=npz_filename, edge_filename=self.edge_filename, verbose=False)
+        self.assertEqual(matrix_3.nnz, 2)
+        self.assertEqual(len(edges_3), 2)
+        self.assertEqual(sorted(f for f in os.listdir(self.tmp_dir) if f.startswith('kg2.npz')), ['kg2.npz', 'kg2.npz.key.json'])
+        # a matrix without its key file (an interrupted write) isn't used
+        key = {'edges_to_include': ['biolink:interacts_with']}
+        compiled_graph.write_matrix(npz_filename, matrix_3, key)
+        self.assertEqual(compiled_graph.read_matrix(npz_filename, key).nnz, 2)
+        os.remove(npz_filename + '.key.json')
+        self.assertIsNone(compiled_graph.read_matrix(npz_filename, key))
+
+    def test_graph_delta(self):
+        delta_filename = os.path.join(self.tmp_dir, 'delta.jsonl')
+        new_node = {'id': 'NCBIGene:4', 'name': 'AAAS', 'category': 'biolink:Gene'}
+        write_kg2_jsonl(delta_filename, [
+            new_node,
+            {'subject': 'NCBIGene:4', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'},
+            {'subject': 'NCBIGene:4', 'object': 'CHEBI:15377', 'predicate': 'biolink:related_to'},
+            # already in the graph
+            {'subject': 'NCBIGene:3', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'},
+            {'subject': 'CHEBI:15377', 'object': 'MONDO:0005148', 'predicate': 'biolink:treats', '_op': 'remove'},
+            {'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', '_op': 'remove'},
+        ])
+        graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False)
+        updated = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=True, cache_dir=self.cache_dir, verbose=False, delta_filenames=[delta_filename])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+        store = kg2_loader.load_kg2_store(self.node_filename, edge_filename=self.edge_filename,
+                cache_dir=self.cache_dir, verbose=False)
+        # the updated graph is the same as a graph loaded from updated files
+        write_kg2_jsonl(self.node_filename, KG2_NODES + [new_node])
+        write_kg2_jsonl(self.edge_filename, [KG2_EDGES[1], KG2_EDGES[2], KG2_EDGES[3],
+            {'id': 6, 'subject': 'NCBIGene:4', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'},
+            {'id': 7, 'subject': 'NCBIGene:4', 'object': 'CHEBI:15377', 'predicate': 'biolink:related_to'}])
+        reloaded = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=False, verbose=False)
+        self.assertEqual(graph_summary(updated), graph_summary(reloaded))
+        # existing nodes keep their indices
+        self.assertEqual(updated.vs['name'][:len(graph.vs)], graph.vs['name'])
+        self.assertEqual(updated.vs[len(graph.vs)]['name'], 'NCBIGene:4')
+        updated_store = graph_store.GraphStore(graph_delta.apply_delta(store.directory, delta_filename,
+            os.path.join(self.tmp_dir, 'updated')))
+        self.assertEqual(updated_store.names(), updated.vs['name'])
+        self.assertEqual(updated_store.find('NCBIGene:4'), len(graph.vs))
+        self.assertEqual(updated_store.degree().tolist(), updated.degree())
+        directed = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                directed=True, use_cache=False, verbose=False)
+        for v in directed.vs:
+            node = updated_store.find(v['name'])
+            self.assertEqual(updated_store.degree([node], mode='in')[0], v.indegree())
+            self.assertEqual(updated_store.degree([node], mode='out')[0], v.outdegree())
+        # igraph updates in place
+        graph = graph_delta.update_igraph(graph, delta_filename)
+        self.assertEqual(graph_summary(graph), graph_summary(reloaded))
+        self.assertEqual(graph.vs['name'], updated.vs['name'])
+
+    def test_graph_delta_options(self):
+        delta_filename = os.path.join(self.tmp_dir, 'delta.jsonl')
+        new_nodes = [{'id': 'NCBIGene:4', 'name': 'AAAS', 'category': 'biolink:Gene'},
+                {'id': 'NCBIGene:5', 'name': 'AACS', 'category': 'biolink:Gene'}]
+        write_kg2_jsonl(delta_filename, new_nodes + [
+            {'subject': 'NCBIGene:4', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'},
+            # the reverse of an edge of the graph
+            {'subject': 'NCBIGene:2', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with', '_op': 'remove'},
+        ])
+        reversed_edge = ('NCBIGene:1', 'NCBIGene:2', 'biolink:interacts_with')
+
+        def load(**kwargs):
+            "Returns the cached and uncached graphs with the delta applied."
+            return [kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, use_cache=use_cache,
+                cache_dir=self.cache_dir, verbose=False, delta_filenames=[delta_filename], **kwargs) for use_cache in (True, False)]
+        # undirected graphs: the edge is removed, and the new node without edges is skipped
+        cached, uncached = load()
+        self.assertEqual(graph_summary(cached), graph_summary(uncached))
+        self.assertEqual(sorted(cached.es.attributes()), sorted(uncached.es.attributes()))
+        self.assertEqual(sorted((e['source'], e['target'], e['type']) for e in cached.es),
+                sorted((e['source'], e['target'], e['type']) for e in uncached.es))
+        self.assertNotIn('NCBIGene:5', cached.vs['name'])
+        self.assertNotIn(reversed_edge, graph_summary(cached)[1])
+        # directed graphs: the edge is kept
+        cached, uncached = load(directed=True)
+        self.assertEqual(graph_summary(cached), graph_summary(uncached))
+        self.assertIn(reversed_edge, graph_summary(cached)[1])
+        # without remove_unused_nodes, all new nodes are added
+        cached, uncached = load(remove_unused_nodes=False)
+        self.assertEqual(graph_summary(cached), graph_summary(uncached))
+        self.assertEqual(cached.vs['name'][-2:], ['NCBIGene:4', 'NCBIGene:5'])
+        # the same as undirected graphs loaded from updated files
+        updated = {remove_unused_nodes: load(remove_unused_nodes=remove_unused_nodes)[0] for remove_unused_nodes in (True, False)}
+        write_kg2_jsonl(self.node_filename, KG2_NODES + new_nodes)
+        write_kg2_jsonl(self.edge_filename, KG2_EDGES[1:] + [
+            {'id': 6, 'subject': 'NCBIGene:4', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'}])
+        for remove_unused_nodes, graph in updated.items():
+            reloaded = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                    use_cache=False, verbose=False, remove_unused_nodes=remove_unused_nodes)
+            self.assertEqual(graph_summary(graph), graph_summary(reloaded))
+
+    def test_graph_delta_cached_index(self):
+        graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, verbose=False)
+        before = pagerank.global_pagerank(graph)
+        adjacency = graph_index.get_graph_index(graph).adjacency()
+        # one edge is removed and one is added, so the edge count doesn't change
+        delta_filename = os.path.join(self.tmp_dir, 'delta.jsonl')
+        write_kg2_jsonl(delta_filename, [
+            {'subject': 'NCBIGene:3', 'object': 'CHEBI:15377', 'predicate': 'biolink:affects'},
+            {'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', '_op': 'remove'}])
+        n_edges = graph.ecount()
+        graph_delta.update_igraph(graph, delta_filename)
+        self.assertEqual(graph.ecount(), n_edges)
+        self.assertIsNot(graph_index.get_graph_index(graph).adjacency(), adjacency)
+        scores = pagerank.global_pagerank(graph)
+        self.assertTrue(abs(scores - np.array(graph.pagerank(damping=0.7))).max() < 1e-8)
+        self.assertTrue(abs(scores - before).max() > 1e-3)
+
+    def test_lazy_properties(self):
+        graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                use_cache=False, verbose=False)
+        lazy = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                cache_dir=self.cache_dir, verbose=False, lazy_properties=True)
+        self.assertEqual(sorted(lazy.vs.attributes()), ['category', 'name'])
+        self.assertEqual(graph_info.get_nodes_table(lazy).to_dict('records'), graph_info.get_nodes_table(graph).to_dict('records'))
+        ids = ['NCBIGene:1', 'NCBIGene:3']
+        self.assertEqual(explanations.topic_pagerank(lazy, ids)[1], explanations.topic_pagerank(graph, ids)[1])
+        tree, subgraph = explanations.steiner_tree_subgraph(lazy, ids)
+        _, expected_subgraph = explanations.steiner_tree_subgraph(graph, ids)
+        self.assertEqual(graph_info.get_nodes_table(subgraph).to_dict('records'),
+                graph_info.get_nodes_table(expected_subgraph).to_dict('records'))
+        # the source column (the category for kg2) is dictionary-encoded
+        store = property_store.get_property_store(lazy)
+        self.assertEqual(store.node_values('source', [0, 3]), ['biolink:Gene', 'biolink:SmallMolecule'])
+        # edge properties are cached and read on demand
+        # a reverse edge and parallel edges with the same type
+        multi_filename = os.path.join(self.tmp_dir, 'multi_edges.jsonl')
+        write_kg2_jsonl(multi_filename, KG2_EDGES + [
+            {'id': 6, 'subject': 'NCBIGene:2', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'},
+            {'id': 7, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'},
+            {'id': 8, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'}])
+        spoke_filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        rows = [dict(row) for row in SPOKE_ROWS]
+        rows[7] = dict(rows[7], properties={'sources': ['OMIM', 'DisGeNET']})
+        write_kg2_jsonl(spoke_filename, rows)
+        spoke_graph = spoke_loader.load_spoke_igraph(spoke_filename, use_edge_properties=True, use_cache=False)
+        cached_graph = spoke_loader.load_spoke_igraph(spoke_filename, use_edge_properties=True, use_cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(sorted(cached_graph.es.attributes()), ['id', 'source', 'sources', 'target', 'type'])
+        for e in cached_graph.es:
+            expected = spoke_graph.es.find(_between=((spoke_graph.vs.find(name=cached_graph.vs[e.source]['name']).index,),
+                (spoke_graph.vs.find(name=cached_graph.vs[e.target]['name']).index,)))
+            self.assertEqual(e['type'], expected['type'])
+            self.assertEqual(e['sources'], expected['sources'])
+        lazy_graph = spoke_loader.load_spoke_igraph(spoke_filename, use_edge_properties=True, cache_dir=self.cache_dir,
+                lazy_properties=True)
+        self.assertEqual(sorted(lazy_graph.es.attributes()), ['type'])
+        subgraph = property_store.materialize(lazy_graph.induced_subgraph(lazy_graph.vs.select(name_in=['10', '13'])))
+        self.assertEqual(subgraph.es['sources'], [str(['OMIM', 'DisGeNET'])])
+        self.assertEqual(subgraph.vs['identifier'], [3630, 'DOID:9352'])
+
+    def test_load_modes(self):
+        "Uncached, cached and lazy loads (once materialized) have the same attributes."
+        def attributes(graph):
+            graph = property_store.materialize(graph)
+            nodes = {a: graph.vs[a] for a in graph.vs.attributes()}
+            # cached graphs have their edges sorted by source node
+            edges = sorted((sorted(e.attributes().items()) for e in graph.es), key=repr)
+            return nodes, edges
+
+        # a reverse edge and parallel edges with the same type
+        multi_filename = os.path.join(self.tmp_dir, 'multi_edges.jsonl')
+        write_kg2_jsonl(multi_filename, KG2_EDGES + [
+            {'id': 6, 'subject': 'NCBIGene:2', 'object': 'NCBIGene:1', 'predicate': 'biolink:interacts_with'},
+            {'id': 7, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'},
+            {'id': 8, 'subject': 'NCBIGene:1', 'object': 'NCBIGene:2', 'predicate': 'biolink:interacts_with'}])
+        spoke_filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        rows = [dict(row) for row in SPOKE_ROWS]
+        rows[7] = dict(rows[7], properties={'sources': ['OMIM', 'DisGeNET']})
+        rows[8] = dict(rows[8], properties={'phase': 4})
+        write_kg2_jsonl(spoke_filename, rows)
+        loaders = [
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, verbose=False, **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, verbose=False,
+                    use_edge_properties=True, **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, verbose=False,
+                    edge_format='table', **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename, verbose=False,
+                    edge_format='table', use_edge_properties=True, **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=multi_filename, verbose=False,
+                    use_edge_properties=True, **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=multi_filename, verbose=False,
+                    edge_format='table', use_edge_properties=True, **kwargs),
+                lambda **kwargs: kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=multi_filename, verbose=False,
+                    directed=True, edge_format='table', use_edge_properties=True, **kwargs),
+                lambda **kwargs: spoke_loader.load_spoke_igraph(spoke_filename, **kwargs),
+                lambda **kwargs: spoke_loader.load_spoke_igraph(spoke_filename, use_edge_properties=True, **kwargs),
+        ]
+        for load in loaders:
+            expected = attributes(load())
+            self.assertEqual(attributes(load(use_cache=True, cache_dir=self.cache_dir)), expected)
+            self.assertEqual(attributes(load(cache_dir=self.cache_dir, lazy_properties=True)), expected)
+        low_memory = spoke_loader.load_spoke_igraph(spoke_filename, low_memory=True)
+        self.assertEqual(attributes(spoke_loader.load_spoke_igraph(spoke_filename, low_memory=True, use_cache=True, cache_dir=self.cache_dir)),
+                attributes(low_memory))
+        self.assertEqual(low_memory.es.attributes(), [])
+        # edge properties keep their types, and missing properties are None
+        graph = spoke_loader.load_spoke_igraph(spoke_filename, use_edge_properties=True, use_cache=True, cache_dir=self.cache_dir)
+        self.assertEqual(sorted(graph.es['phase'], key=repr), [4, None, None])
+
+    def test_ckg_jsonl(self):
+        spoke_filename = os.path.join(self.tmp_dir, 'spoke.jsonl')
+        write_kg2_jsonl(spoke_filename, SPOKE_ROWS)
+        nodes, edges, node_types, edge_types = spoke_loader.import_ckg_jsonl(spoke_filename, verbose=False, batch_size=2)
+        self.assertEqual([n[1] for n in nodes], ['INS', 'GCG', 'METFORMIN', 'DOID:9352', 'x'])
+        self.assertEqual(edges.shape, (5, 5))
+        self.assertEqual(edges.row.dtype, np.int32)
+        typed_edges = sorted(zip(edges.row.tolist(), edges.col.tolist(), [edge_types[t] for t in edges.data]))
+        self.assertEqual(typed_edges, [(0, 1, 'INTERACTS_GiG'), (2, 3, 'TREATS_CtD'), (2, 3, 'UPREGULATES_CuG'), (3, 0, 'ASSOCIATES_DaG')])
+        nodes, edges, node_types, edge_types = spoke_loader.import_ckg_jsonl(spoke_filename, verbose=False,
+                edges_to_include={'TREATS_CtD'}, n_edges=1)
+        self.assertEqual(edges.nnz, 1)
+
+    def test_graph_merge(self):
+        def row(subject, object_, predicate, subject_name='', object_name='', source='x'):
+            return {'subject_id': subject[1], 'object_id': object_[1], 'subject_id_prefix': subject[0], 'object_id_prefix': object_[0],
+                    'subject_name': subject_name, 'object_name': object_name, 'predicate': predicate,
+                    'Primary_Knowledge_Source': source, 'Knowledge_Source': source, 'publications': 'PMID:' + predicate,
+                    'subject_category': 'Gene' if subject[0] == 'NCBIGene' else 'Protein', 'object_category': 'Protein'}
+        table1 = pd.DataFrame([row(('NCBIGene', 1), ('UNIPROT', 'P1'), 'translates_to', 'A', 'a'),
+            row(('NCBIGene', 2), ('UNIPROT', 'P2'), 'translates_to', 'B', 'b'),
+            row(('NCBIGene', 1), ('UNIPROT', 'P1'), 'translates_to', 'A', 'a')])
+        table2 = pd.DataFrame([row(('UNIPROT', 'P1'), ('UNIPROT', 'P2'), 'binds', 'a', 'b'),
+            row(('NCBIGene', 1), ('UNIPROT', 'P1'), 'translates_to', 'A1', 'a'),
+            row(('NCBIGene', 1), ('UNIPROT', 'P1'), 'regulates', 'A1', 'a')])
+        filename = os.path.join(self.tmp_dir, 'table2.tsv')
+        table2.to_csv(filename, sep='\t', index=False)
+        directory = os.path.join(self.tmp_dir, 'merged')
+        graph_merge.merge_graphs([table1, filename], directory, chunksize=2, verbose=False)
+        graph = graph_merge.merge_graphs_igraph([table1, filename], directory=directory, chunksize=2, verbose=False, directed=True)
+        self.assertEqual(graph.vs['name'], ['NCBIGene::1', 'UNIPROT::P1', 'NCBIGene::2', 'UNIPROT::P2'])
+        # the last row of a node sets its attributes
+        self.assertEqual(graph.vs['feature_name'], ['A1', 'a', 'B', 'b'])
+        self.assertEqual(graph.vs['category'], ['Gene', 'Protein', 'Gene', 'Protein'])
+        edges = sorted((graph.vs[e.source]['name'], graph.vs[e.target]['name'], e['predicate'], e['sources']) for e in graph.es)
+        self.assertEqual(edges, [('NCBIGene::1', 'UNIPROT::P1', 'regulates', 'table2'),
+            ('NCBIGene::1', 'UNIPROT::P1', 'translates_to', 'table0|table2'),
+            ('NCBIGene::2', 'UNIPROT::P2', 'translates_to', 'table0'),
+            ('UNIPROT::P1', 'UNIPROT::P2', 'binds', 'table2')])
+        # the attributes are those of df_to_graph on the concatenated tables, and every edge keeps the attributes of its first row
+        expected = graph_info.df_to_graph(pd.concat([table1, pd.read_csv(filename, sep='\t')], ignore_index=True), directed=True)
+        expected_edges = {}
+        for e in expected.es:
+            key = (expected.vs[e.source]['name'], expected.vs[e.target]['name'], e['predicate'])
+            expected_edges.setdefault(key, e.attributes())
+        self.maxDiff = None
+        for lazy_properties in [False, True]:
+            merged = graph_merge.merge_graphs_igraph([table1, filename], directory=os.path.join(self.tmp_dir, 'merged_2'),
+                    verbose=False, directed=True, lazy_properties=lazy_properties)
+            property_store.materialize(merged)
+            self.assertEqual(sorted(merged.vs.attributes()), sorted(expected.vs.attributes()))
+            for attribute in expected.vs.attributes():
+                self.assertEqual(merged.vs[attribute], expected.vs[attribute])
+            self.assertEqual(sorted(merged.es.attributes()), sorted(expected.es.attributes() + ['sources']))
+            edges = {}
+            for e in merged.es:
+                attributes = e.attributes()
+                del attributes['sources']
+                edges[(merged.vs[e.source]['name'], merged.vs[e.target]['name'], e['predicate'])] = attributes
+            self.assertEqual(edges, expected_edges)
+            self.assertEqual(graph_info.get_category_ids_to_nodes(merged, 'Protein'),
+                    graph_info.get_category_ids_to_nodes(expected, 'Protein'))
+        # filters, and caching of merged files
+        old_cache_dir = os.environ.get('KGFE_CACHE_DIR')
+        os.environ['KGFE_CACHE_DIR'] = self.cache_dir
+        try:
+            directory = graph_merge.merge_graphs([filename], predicates=['binds', 'regulates'], verbose=False)
+            self.assertTrue(directory.startswith(self.cache_dir))
+            meta = json.load(open(os.path.join(directory, 'meta.json')))
+            self.assertEqual(meta['n_edges'], 2)
+            self.assertEqual(graph_merge.merge_graphs([filename], predicates=['binds', 'regulates'], verbose=False), directory)
+        finally:
+            if old_cache_dir is None:
+                del os.environ['KGFE_CACHE_DIR']
+            else:
+                os.environ['KGFE_CACHE_DIR'] = old_cache_dir
+
+
+    def test_progress(self):
+        import contextlib
+        import io
+        load = progress.Progress('test_load', log_every=2)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            graph = kg2_loader.load_kg2_igraph(self.node_filename, edge_filename=self.edge_filename,
+                    use_cache=False, progress=load)
+            summary = load.finish()
+            # the loaders are silent by default, even with verbose=True
+            kg2_loader.import_kg2_jsonl(self.node_filename, self.edge_filename, verbose=True)
+        self.assertEqual(output.getvalue(), '')
+        self.assertEqual(summary['rows'], len(KG2_NODES) + len(KG2_EDGES))
+        self.assertEqual(summary['bytes'], os.path.getsize(self.node_filename) + os.path.getsize(self.edge_filename))
+        self.assertEqual(summary['counters']['nodes'], graph.vcount())
+        self.assertTrue({'parse', 'filter', 'igraph'}.issubset(summary['phases']))
+        self.assertTrue(summary['peak_rss'] is None or summary['peak_rss'] > 0)
+        self.assertEqual(json.loads(load.to_json())['name'], 'test_load')
+        # the summaries of the recent loads are exported as json
+        metrics = json.loads(progress.export_metrics())
+        self.assertEqual(metrics[-2], json.loads(json.dumps(summary)))
+        self.assertEqual(metrics[-1]['name'], 'import_kg2_jsonl')
+        with self.assertLogs('kgfe', level='INFO') as logs:
+            kg2_loader.import_kg2_jsonl(self.node_filename, self.edge_filename, verbose=True)
+        self.assertTrue(any('rows/s' in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
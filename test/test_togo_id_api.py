@@ -0,0 +1,83 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kgfe import togo_id_api
+
+# responses of the TogoID convert API (uniprot -> ncbigene), replayed by the local server
+RESPONSES = {
+    'Q13427': ['9360'],
+    'P02790': ['3263'],
+    'P31946': ['7529'],
+    'P04637': ['7157'],
+    'P38398': ['672'],
+}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        ids = query['ids'][0].split(',')
+        self.requests.append(ids)
+        pairs = [[i, r] for i in ids for r in RESPONSES.get(i, [])]
+        body = json.dumps({'ids': ids, 'route': query['route'][0].split(','), 'results': pairs}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TogoIDTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'togoid.sqlite')
+        ReplayHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), ReplayHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:{0}/convert'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_convert_ids(self):
+        ids = ['Q13427', 'P02790', 'not_an_id', 'P31946', 'P04637']
+        data = togo_id_api.convert_ids(ids, 'uniprot', 'ncbigene', batch_size=2, n_threads=2,
+                cache_file=self.cache_file, url=self.url)
+        self.assertEqual(data['results'], [['Q13427', '9360'], ['P02790', '3263'], ['P31946', '7529'], ['P04637', '7157']])
+        self.assertEqual(data['route'], ['uniprot', 'ncbigene'])
+        self.assertEqual(len(ReplayHandler.requests), 3)
+        self.assertTrue(all(len(r) <= 2 for r in ReplayHandler.requests))
+        # only the ids that aren't in the cache are requested, including ids that couldn't be converted
+        ReplayHandler.requests = []
+        data = togo_id_api.convert_ids(['P38398', 'not_an_id', 'P02790'], 'uniprot', 'ncbigene',
+                cache_file=self.cache_file, url=self.url)
+        self.assertEqual(data['results'], [['P38398', '672'], ['P02790', '3263']])
+        self.assertEqual(ReplayHandler.requests, [['P38398']])
+        # the cache is per route
+        ReplayHandler.requests = []
+        togo_id_api.convert_ids(['P02790'], 'uniprot', 'hgnc', cache_file=self.cache_file, url=self.url)
+        self.assertEqual(ReplayHandler.requests, [['P02790']])
+        # without the cache, everything is requested
+        ReplayHandler.requests = []
+        togo_id_api.convert_ids(['P02790'], 'uniprot', 'ncbigene', use_cache=False, url=self.url)
+        self.assertEqual(ReplayHandler.requests, [['P02790']])
+
+
+if __name__ == '__main__':
+    unittest.main()